@@ -0,0 +1,35 @@
+"""Forms only admins use, imported on first use so public requests never load them."""
+from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileAllowed, FileRequired
+from wtforms import StringField, DecimalField, IntegerField, TextAreaField, SubmitField, SelectField
+from wtforms.validators import DataRequired, NumberRange, Length, Optional, ValidationError
+
+
+class CategoryForm(FlaskForm):
+    name = StringField('Category Name', validators=[DataRequired(), Length(max=100)])
+    parent_id = SelectField('Parent Category', coerce=int, choices=[], validate_choice=False)
+    submit = SubmitField('Add Category')
+
+
+class ProductForm(FlaskForm):
+    name = StringField('Product Name', validators=[DataRequired(), Length(max=150)])
+    description = TextAreaField('Description', validators=[DataRequired()])
+    price = DecimalField('Price ($)', validators=[DataRequired(), NumberRange(min=0)])
+    discount = IntegerField('Discount (%)', validators=[NumberRange(min=0, max=100)])
+    stock_quantity = IntegerField('Stock Quantity', validators=[DataRequired(), NumberRange(min=0)])
+    image_url = StringField('Image URL')
+    image_file = FileField('Or upload an image', validators=[FileAllowed(['jpg', 'jpeg', 'png', 'webp', 'gif'])])
+    category_id = SelectField('Category', coerce=int, validators=[DataRequired()])
+    submit = SubmitField('Add Product')
+
+    def validate_image_url(self, field):
+        if not field.data and not self.image_file.data:
+            raise ValidationError('Enter an image URL or upload an image.')
+
+
+class CatalogImportForm(FlaskForm):
+    file = FileField('Catalog File', validators=[FileRequired()])
+    format = SelectField('Format', choices=[('', 'From the file name'), ('csv', 'CSV'), ('jsonl', 'JSON Lines')],
+                         default='')
+    batch_size = IntegerField('Rows per Batch', validators=[Optional(), NumberRange(min=1)])
+    submit = SubmitField('Import')
@@ -0,0 +1,288 @@
+from datetime import datetime, timedelta, date
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, delete, insert, func, case
+
+from create_db import (Order, OrderItem, Product, Category, User, AnalyticsOrdersDaily,
+                       AnalyticsCategoriesDaily, AnalyticsProductsDaily, AnalyticsState)
+from orders import TERMINAL_STATUSES
+
+STATE_KEY = 'sales'
+DEFAULT_CHUNKSIZE = 50000
+# Orders still open after this long are treated as settled, so one forgotten
+# pending order can't make every refresh rescan months of history
+DEFAULT_OPEN_WINDOW = timedelta(days=30)
+# The watermark only moves past orders at least this old. Ids are handed out before commit, so a
+# newer order can be visible while an older id is still being written
+DEFAULT_SETTLE = timedelta(minutes=5)
+CANCELLED = 'Cancelled'
+SUMMARY_TABLES = (AnalyticsOrdersDaily, AnalyticsCategoriesDaily, AnalyticsProductsDaily)
+
+
+class RefreshResult:
+    def __init__(self, since, orders, items, last_order_id):
+        self.since = since  # first day recomputed, None when nothing was new
+        self.orders = orders
+        self.items = items
+        self.last_order_id = last_order_id
+
+
+def _cents(series):
+    # DECIMAL columns arrive as Decimal objects; integer cents keep the sums exact and vectorised
+    return (pd.to_numeric(series, errors='coerce').fillna(0).astype('float64') * 100).round().astype('int64')
+
+
+def _money(cents):
+    return Decimal(int(cents)).scaleb(-2)
+
+
+def _decimal(value):
+    return Decimal(str(value or 0))
+
+
+def _client_orders():
+    # Same population as the admin order dashboard: admin test orders are left out
+    return User.is_admin.is_not(True)
+
+
+def _combine(parts, keys):
+    if not parts:
+        return pd.DataFrame()
+    return pd.concat(parts).groupby(keys, sort=False).sum()
+
+
+def _order_frames(connection, since, chunksize):
+    stmt = (
+        select(Order.id, Order.created_at, Order.status, Order.payment_method, Order.total_amount)
+        .join(Order.user)
+        .where(_client_orders(), Order.created_at >= since)
+        .order_by(Order.id)
+    )
+    return pd.read_sql(stmt, connection, chunksize=chunksize)
+
+
+def _item_frames(connection, since, chunksize):
+    stmt = (
+        select(OrderItem.order_id, Order.created_at, Order.status, OrderItem.product_id, OrderItem.quantity,
+               OrderItem.price_each, Product.price.label('list_price'), Product.category_id)
+        .join(OrderItem.order)
+        .join(Order.user)
+        .outerjoin(Product, OrderItem.product_id == Product.id)
+        .where(_client_orders(), Order.created_at >= since)
+        .order_by(OrderItem.order_id, OrderItem.id)
+    )
+    return pd.read_sql(stmt, connection, chunksize=chunksize)
+
+
+def _normalise(frame):
+    frame['day'] = pd.to_datetime(frame['created_at']).dt.normalize()
+    frame['status'] = frame['status'].fillna('unknown').str.title()
+    return frame
+
+
+def _summarise_orders(frame):
+    frame['payment_method'] = frame['payment_method'].fillna('')
+    frame['revenue'] = _cents(frame['total_amount'])
+    frame['orders'] = 1
+    return frame.groupby(['day', 'payment_method', 'status'], sort=False)[['orders', 'revenue']].sum()
+
+
+def _summarise_items(frame):
+    frame = frame[frame['status'] != CANCELLED]
+    units = frame['quantity'].fillna(0).astype('int64')
+    each = _cents(frame['price_each'])
+    # List price comes from the product as it is today (it isn't stored on the order); lines
+    # whose product is gone, or whose price has since dropped, count as undiscounted
+    listed = np.maximum(np.where(frame['list_price'].isna(), each, _cents(frame['list_price'])), each)
+    discounted = listed > each
+    lines = pd.DataFrame({
+        'day': frame['day'],
+        'category_id': frame['category_id'].fillna(0).astype('int64'),
+        'product_id': frame['product_id'].fillna(0).astype('int64'),
+        'units': units,
+        'gross': listed * units,
+        'revenue': each * units,
+        'discounted_units': np.where(discounted, units, 0),
+        'discounted_revenue': np.where(discounted, each * units, 0),
+    })
+    categories = lines.groupby(['day', 'category_id'], sort=False)[
+        ['units', 'gross', 'revenue', 'discounted_units', 'discounted_revenue']].sum()
+    products = lines.groupby(['day', 'product_id'], sort=False)[['units', 'gross', 'revenue']].sum()
+    return categories, products
+
+
+def _records(frame, money_columns):
+    if frame.empty:
+        return []
+    frame = frame.reset_index()
+    frame['day'] = frame['day'].dt.date
+    records = frame.to_dict('records')
+    for record in records:
+        for column, value in record.items():
+            if column in money_columns:
+                record[column] = _money(value)
+            elif isinstance(value, np.integer):
+                record[column] = int(value)
+    return records
+
+
+def refresh(session, full=False, chunksize=DEFAULT_CHUNKSIZE, open_window=DEFAULT_OPEN_WINDOW,
+            settle=DEFAULT_SETTLE):
+    """Bring the daily sales summaries up to date and commit.
+
+    Only orders past the stored ``Order.id`` watermark are read, plus those that
+    were still open at the previous refresh (their status may have changed).
+    Whole days are recomputed from the first such order, so the summaries never
+    need to know what an order used to look like. ``full`` rebuilds everything.
+    Orders younger than ``settle`` are summarised but left past the watermark,
+    so the next refresh reads them, and any id committed late, again.
+    """
+    state = session.get(AnalyticsState, STATE_KEY)
+    if state is None:
+        state = AnalyticsState(name=STATE_KEY, last_order_id=0)
+        session.add(state)
+    start_id = 1 if full else state.last_order_id + 1
+    if not full and state.reopen_order_id is not None:
+        start_id = min(start_id, state.reopen_order_id)
+
+    since = session.execute(select(func.min(Order.created_at)).where(Order.id >= start_id)).scalar()
+    if since is None:
+        if full:
+            for table in SUMMARY_TABLES:
+                session.execute(delete(table))
+        state.refreshed_at = datetime.utcnow()
+        session.commit()
+        return RefreshResult(None, 0, 0, state.last_order_id)
+    since = datetime.combine(since.date(), datetime.min.time())
+
+    connection = session.connection()
+    order_parts, open_ids, last_id, n_orders = [], [], state.last_order_id, 0
+    now = datetime.utcnow()
+    open_after, settled_before = pd.Timestamp(now - open_window), pd.Timestamp(now - settle)
+    for frame in _order_frames(connection, since, chunksize):
+        frame = _normalise(frame)
+        n_orders += len(frame)
+        settled = pd.to_datetime(frame['created_at']) < settled_before
+        if settled.any():
+            last_id = max(last_id, int(frame.loc[settled, 'id'].max()))
+        still_open = (~frame['status'].str.upper().isin(TERMINAL_STATUSES)
+                      & (pd.to_datetime(frame['created_at']) >= open_after))
+        if still_open.any():
+            open_ids.append(int(frame.loc[still_open, 'id'].min()))
+        order_parts.append(_summarise_orders(frame))
+
+    category_parts, product_parts, n_items = [], [], 0
+    for frame in _item_frames(connection, since, chunksize):
+        n_items += len(frame)
+        categories, products = _summarise_items(_normalise(frame))
+        category_parts.append(categories)
+        product_parts.append(products)
+
+    for table in SUMMARY_TABLES:
+        stmt = delete(table)
+        session.execute(stmt if full else stmt.where(table.day >= since.date()))
+    for table, parts, keys, money in (
+        (AnalyticsOrdersDaily, order_parts, ['day', 'payment_method', 'status'], {'revenue'}),
+        (AnalyticsCategoriesDaily, category_parts, ['day', 'category_id'],
+         {'gross', 'revenue', 'discounted_revenue'}),
+        (AnalyticsProductsDaily, product_parts, ['day', 'product_id'], {'gross', 'revenue'}),
+    ):
+        records = _records(_combine(parts, keys), money)
+        if records:
+            session.execute(insert(table), records)
+
+    state.last_order_id = last_id
+    state.reopen_order_id = min(open_ids) if open_ids else None
+    state.refreshed_at = datetime.utcnow()
+    session.commit()
+    return RefreshResult(since.date(), n_orders, n_items, last_id)
+
+
+class SalesReport:
+    def __init__(self, by_day, by_payment_method, by_category, top_products, discounts, cancellation, refreshed_at):
+        self.by_day = by_day                        # [(day, orders, revenue)]
+        self.by_payment_method = by_payment_method  # [(method, orders, revenue)]
+        self.by_category = by_category              # [(category name, units, revenue)]
+        self.top_products = top_products            # [(product id, name, units, revenue)]
+        self.discounts = discounts                  # dict of gross/revenue/discount totals
+        self.cancellation = cancellation            # (cancelled orders, all orders, rate)
+        self.refreshed_at = refreshed_at
+
+
+def report(session, date_from, date_to, top=10):
+    """Read the dashboard numbers for ``date_from``..``date_to`` (inclusive) from the summary tables."""
+    orders_in = (AnalyticsOrdersDaily.day >= date_from, AnalyticsOrdersDaily.day <= date_to)
+    kept = AnalyticsOrdersDaily.status != CANCELLED
+
+    by_day = session.execute(
+        select(AnalyticsOrdersDaily.day, func.sum(AnalyticsOrdersDaily.orders), func.sum(AnalyticsOrdersDaily.revenue))
+        .where(*orders_in, kept).group_by(AnalyticsOrdersDaily.day).order_by(AnalyticsOrdersDaily.day)
+    ).all()
+    by_payment_method = session.execute(
+        select(AnalyticsOrdersDaily.payment_method, func.sum(AnalyticsOrdersDaily.orders),
+               func.sum(AnalyticsOrdersDaily.revenue))
+        .where(*orders_in, kept).group_by(AnalyticsOrdersDaily.payment_method)
+        .order_by(func.sum(AnalyticsOrdersDaily.revenue).desc())
+    ).all()
+    cancelled, total = session.execute(
+        select(func.coalesce(func.sum(case((kept, 0), else_=AnalyticsOrdersDaily.orders)), 0),
+               func.coalesce(func.sum(AnalyticsOrdersDaily.orders), 0))
+        .where(*orders_in)
+    ).one()
+
+    categories_in = (AnalyticsCategoriesDaily.day >= date_from, AnalyticsCategoriesDaily.day <= date_to)
+    by_category = session.execute(
+        select(func.coalesce(Category.name, 'Uncategorised'), func.sum(AnalyticsCategoriesDaily.units),
+               func.sum(AnalyticsCategoriesDaily.revenue))
+        .outerjoin(Category, Category.id == AnalyticsCategoriesDaily.category_id)
+        .where(*categories_in)
+        .group_by(AnalyticsCategoriesDaily.category_id, Category.name)
+        .order_by(func.sum(AnalyticsCategoriesDaily.revenue).desc())
+    ).all()
+    gross, revenue, discounted_units, discounted_revenue, units = session.execute(
+        select(func.coalesce(func.sum(AnalyticsCategoriesDaily.gross), 0),
+               func.coalesce(func.sum(AnalyticsCategoriesDaily.revenue), 0),
+               func.coalesce(func.sum(AnalyticsCategoriesDaily.discounted_units), 0),
+               func.coalesce(func.sum(AnalyticsCategoriesDaily.discounted_revenue), 0),
+               func.coalesce(func.sum(AnalyticsCategoriesDaily.units), 0))
+        .where(*categories_in)
+    ).one()
+
+    revenue_sum = func.sum(AnalyticsProductsDaily.revenue)
+    top_products = session.execute(
+        select(AnalyticsProductsDaily.product_id, Product.name, func.sum(AnalyticsProductsDaily.units), revenue_sum)
+        .outerjoin(Product, Product.id == AnalyticsProductsDaily.product_id)
+        .where(AnalyticsProductsDaily.day >= date_from, AnalyticsProductsDaily.day <= date_to)
+        .group_by(AnalyticsProductsDaily.product_id, Product.name)
+        .order_by(revenue_sum.desc())
+        .limit(top)
+    ).all()
+
+    state = session.get(AnalyticsState, STATE_KEY)
+    gross, revenue, discounted_revenue = _decimal(gross), _decimal(revenue), _decimal(discounted_revenue)
+    discounts = {
+        'gross': gross,
+        'revenue': revenue,
+        'discount': gross - revenue,
+        'discount_rate': float((gross - revenue) / gross) if gross else 0.0,
+        'units': units,
+        'discounted_units': discounted_units,
+        'discounted_revenue': discounted_revenue,
+        'discounted_share': float(discounted_revenue / revenue) if revenue else 0.0,
+    }
+    return SalesReport(
+        by_day=by_day,
+        by_payment_method=by_payment_method,
+        by_category=by_category,
+        top_products=top_products,
+        discounts=discounts,
+        cancellation=(cancelled, total, cancelled / total if total else 0.0),
+        refreshed_at=state.refreshed_at if state else None,
+    )
+
+
+def default_range(today=None):
+    today = today or date.today()
+    return today - timedelta(days=29), today
@@ -0,0 +1,106 @@
+"""Query count and latency of /category/<id> over a deep category tree.
+
+Seeds a throwaway SQLite database with a 6-level, 5k-category tree and a
+product set spread over every level, then requests categories at each depth
+with both the inline id list and the recursive CTE path. The page cache is
+swapped for one that keeps nothing, so every request runs the view.
+
+    python benchmarks/bench_category_tree.py [--categories 5000] [--products 20000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--categories", type=int, default=5000)
+    parser.add_argument("--depth", type=int, default=6)
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=20)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["DB_URI"] = "sqlite:///" + db_path
+    os.environ.setdefault("secret_key", "bench")
+    sys.path.insert(0, ROOT)
+
+    import main as shop
+    from cache import LRUCache
+    from create_db import Category, Product
+    from sqlalchemy import event, insert
+
+    app, db = shop.app, shop.db
+    rng = random.Random(42)
+    # Branching factor that spreads the requested count over the requested depth
+    branching = 2
+    while sum(branching ** d for d in range(1, args.depth + 1)) < args.categories:
+        branching += 1
+
+    with app.app_context():
+        levels = [[None]]
+        next_id = 1
+        rows = []
+        for depth in range(args.depth):
+            level = []
+            for parent in levels[-1]:
+                for _ in range(branching):
+                    if next_id > args.categories:
+                        break
+                    rows.append({"id": next_id, "name": "cat-%d" % next_id, "parent_id": parent})
+                    level.append(next_id)
+                    next_id += 1
+            levels.append(level)
+        db.session.execute(insert(Category), rows)
+        db.session.execute(insert(Product), [
+            {"name": "product-%d" % i, "description": "bench", "price": 10, "discount": 0,
+             "stock_quantity": 10, "image_url": "", "category_id": rng.randint(1, next_id - 1)}
+            for i in range(args.products)
+        ])
+        db.session.commit()
+        shop.category_cache.invalidate()
+
+        queries = []
+        event.listen(db.engine, "before_cursor_execute",
+                     lambda conn, cursor, statement, *rest: queries.append(statement))
+    # Anonymous pages would otherwise be served from the page cache, whose key doesn't change
+    # with MAX_INLINE_CATEGORY_IDS, so the second pass would never reach the CTE
+    shop.page_cache.backend = LRUCache(max_entries=0)
+
+    client = app.test_client()
+    print("categories=%d depth=%d branching=%d products=%d" % (next_id - 1, args.depth, branching, args.products))
+    print("%-6s %-7s %9s %10s %6s %12s" % ("depth", "path", "subtree", "queries", "cte", "ms/request"))
+    inline_limit = shop.MAX_INLINE_CATEGORY_IDS
+    recursive = {}  # path -> requests whose queries used the recursive CTE
+    for limit, path in ((inline_limit, "inline"), (0, "cte")):
+        shop.MAX_INLINE_CATEGORY_IDS = limit
+        recursive[path] = 0
+        for depth in range(1, args.depth + 1):
+            category_id = levels[depth][0]
+            with app.app_context():
+                subtree = len(shop.category_cache.get(db.session).subtree_ids(category_id))
+            if path == "inline" and subtree > inline_limit:
+                continue  # too big to inline; the view takes the CTE path here anyway
+            client.get("/category/%d" % category_id)  # warm the tree cache
+            counts, with_cte = [], 0
+            start = time.perf_counter()
+            for _ in range(args.requests):
+                del queries[:]
+                assert client.get("/category/%d" % category_id).status_code == 200
+                counts.append(len(queries))
+                with_cte += any("RECURSIVE" in statement.upper() for statement in queries)
+            elapsed = (time.perf_counter() - start) * 1000 / args.requests
+            recursive[path] += with_cte
+            print("%-6d %-7s %9d %10s %6d %12.2f" % (depth, path, subtree, "%d-%d" % (min(counts), max(counts)),
+                                                    with_cte, elapsed))
+    if recursive["inline"] or recursive["cte"] == 0:
+        sys.exit("the passes did not take different paths: %r" % recursive)
+
+
+if __name__ == "__main__":
+    main()
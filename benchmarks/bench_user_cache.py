@@ -0,0 +1,83 @@
+"""Per-request DB cost of authenticated page views with and without the principal cache.
+
+Logs in a user with a populated cart and requests a few authenticated pages,
+reading query count and DB time from each response's Server-Timing header.
+
+    python benchmarks/bench_user_cache.py [--requests 500]
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_TIMING_RE = re.compile(r'db;dur=([\d.]+);desc="(\d+) queries"')
+PAGES = ("/my_orders", "/cart", "/order_summary/1")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--cart-lines", type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ["DB_URI"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ.setdefault("secret_key", "bench")
+    sys.path.insert(0, ROOT)
+
+    import main as shop
+    from create_db import User, Category, Product, CartItem, Address, Order, OrderItem
+
+    app, db = shop.app, shop.db
+    with app.app_context():
+        user = User(name="bench", email="bench@bench.test", password=shop.generate_password_hash("bench"))
+        category = Category(name="bench")
+        db.session.add_all([user, category])
+        db.session.flush()
+        address = Address(user_id=user.id, full_name="bench", street="1", city="x", zip_code="0", country="x", phone="0")
+        db.session.add(address)
+        db.session.flush()
+        order = Order(user_id=user.id, status="pending", total_amount=0, address_id=address.id, payment_method="cod")
+        db.session.add(order)
+        db.session.flush()
+        for i in range(args.cart_lines):
+            product = Product(name="p%d" % i, description="bench", price=10, discount=0, stock_quantity=100,
+                              image_url="", category_id=category.id)
+            db.session.add(product)
+            db.session.flush()
+            db.session.add(CartItem(user_id=user.id, product_id=product.id, quantity=1))
+            db.session.add(OrderItem(order_id=order.id, product_id=product.id, quantity=1, price_each=10))
+        db.session.commit()
+
+    client = app.test_client()
+    client.post("/login", data={"email": "bench@bench.test", "password": "bench"})
+
+    print("%-10s %-18s %8s %12s %12s" % ("cache", "page", "queries", "db ms/req", "wall ms/req"))
+    results = {}
+    for label, ttl in (("disabled", 0), ("enabled", 60)):
+        shop.principal_cache.ttl = ttl
+        shop.principal_cache.backend.clear()
+        for page in PAGES:
+            client.get(page)  # warm the category tree and principal caches
+            db_ms = 0.0
+            queries = 0
+            start = time.perf_counter()
+            for _ in range(args.requests):
+                response = client.get(page)
+                match = SERVER_TIMING_RE.search(response.headers.get("Server-Timing", ""))
+                db_ms += float(match.group(1))
+                queries += int(match.group(2))
+            wall_ms = (time.perf_counter() - start) * 1000 / args.requests
+            results[(label, page)] = db_ms / args.requests
+            print("%-10s %-18s %8.1f %12.3f %12.3f" % (label, page, queries / args.requests,
+                                                     db_ms / args.requests, wall_ms))
+
+    for page in PAGES:
+        saved = results[("disabled", page)] - results[("enabled", page)]
+        print("%s: %.3f ms of DB time saved per request" % (page, saved))
+
+
+if __name__ == "__main__":
+    main()
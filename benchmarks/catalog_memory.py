@@ -0,0 +1,134 @@
+"""Memory a worker spends holding the catalog: ORM objects versus the shared catalog snapshot.
+
+    python benchmarks/catalog_memory.py                    # 50k products in a throwaway SQLite
+    python benchmarks/catalog_memory.py --products 200000 --workers 8
+
+Each side runs in fresh processes against the same database. The ORM side
+loads every Product with its Category, as a worker caching the catalog in
+process would. The snapshot side maps the snapshot file and reads every
+column, which faults in all of its pages. Memory is read from
+/proc/self/smaps_rollup (Linux): "private" pages belong to one process,
+while the snapshot's file-backed pages are shared by every process mapping
+the file, so they are paid once per host rather than once per worker.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, sys
+def memory():
+    fields = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == 'kB':
+                    fields[parts[0].rstrip(':')] = int(parts[1])
+    except OSError:
+        pass
+    private = fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+    return {'rss_kb': fields.get('Rss', 0), 'private_kb': private, 'pss_kb': fields.get('Pss', 0)}
+
+import main
+from create_db import Product
+from sqlalchemy.orm import joinedload
+mode = sys.argv[1]
+with main.app.app_context():
+    main.db.session.execute(main.db.select(Product.id).limit(1)).all()  # connect before measuring
+    before = memory()
+    if mode == 'orm':
+        held = main.db.session.execute(main.db.select(Product).options(joinedload(Product.category))).scalars().all()
+        count = len(held)
+    else:
+        held = main.catalog_snapshots.get(main.db.session)
+        count = len(held)
+        for name in ('id', 'price', 'effective_price', 'discount', 'stock', 'category_id', 'created_at', 'name',
+                     'description', 'image_url', 'by_created', 'by_price', 'group_by_created', 'group_by_price',
+                     'string_offsets', 'strings'):
+            sum(getattr(held, name))
+    after = memory()
+    if len(sys.argv) > 2:
+        sys.stdout.write(json.dumps({'ready': True}) + '\\n'); sys.stdout.flush()
+        sys.stdin.readline()  # hold the mapping while the other workers measure
+        after = memory()
+print(json.dumps({'count': count, 'before': before, 'after': after,
+                  'snapshot_bytes': getattr(held, 'size', 0)}))
+"""
+
+
+def seed(env, products):
+    sys.path.insert(0, ROOT)
+    os.environ.update(env)
+    import main as shop
+    from create_db import Category, Product
+    from sqlalchemy import insert
+
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    with shop.app.app_context():
+        shop.db.session.execute(insert(Category), [{"id": i, "name": "category %d" % i} for i in range(1, 201)])
+        shop.db.session.execute(insert(Product), [
+            {"name": "product %d %s" % (i, rng.choice(("red", "blue", "steel", "linen", "oak"))),
+             "description": "Synthetic benchmark product number %d." % i,
+             "price": Decimal(rng.randint(100, 50000)) / 100, "discount": rng.choice((0, 0, 10, 25)),
+             "stock_quantity": rng.randint(0, 100), "image_url": "https://img.example/%d.jpg" % (i % 5000),
+             "category_id": rng.randint(1, 200), "created_at": now - timedelta(minutes=i)}
+            for i in range(products)
+        ])
+        shop.db.session.commit()
+        # Built here so the workers only map it; building is a one-off cost per catalog version
+        shop.catalog_snapshots.get(shop.db.session)
+
+
+def delta(result, field):
+    return (result["after"][field] - result["before"][field]) / 1024
+
+
+def run_workers(env, mode, workers):
+    """Start ``workers`` processes, let each load the catalog, then measure them all at once."""
+    procs = [subprocess.Popen([sys.executable, "-c", PROBE, mode, "hold"], cwd=ROOT, env=env, text=True,
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE) for _ in range(workers)]
+    for proc in procs:
+        proc.stdout.readline()
+    results = []
+    for proc in procs:
+        out, _ = proc.communicate("\n")
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=50000)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ, DB_URI="sqlite:///" + os.path.join(workdir, "memory.db"),
+               CATALOG_SNAPSHOT_DIR=os.path.join(workdir, "snapshots"))
+    env.setdefault("secret_key", "bench")
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    seed(env, args.products)
+
+    print("%d products, %d workers" % (args.products, args.workers))
+    print("%-9s %14s %14s %14s" % ("", "private/worker", "PSS/worker", "host total"))
+    for mode in ("orm", "snapshot"):
+        results = run_workers(env, mode, args.workers)
+        private = sum(delta(r, "private_kb") for r in results) / len(results)
+        pss = sum(delta(r, "pss_kb") for r in results) / len(results)
+        print("%-9s %12.1fMB %12.1fMB %12.1fMB" % (mode, private, pss, pss * len(results)))
+        if mode == "snapshot":
+            print("snapshot file: %.1fMB, mapped once per host" % (results[0]["snapshot_bytes"] / 1024 / 1024))
+
+
+if __name__ == "__main__":
+    main()
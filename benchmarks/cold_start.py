@@ -0,0 +1,147 @@
+"""Cold-start benchmark: how long a fresh interpreter takes to import the app and serve its first request.
+
+    python benchmarks/cold_start.py                         # throwaway SQLite, 5 runs, budget check
+    python benchmarks/cold_start.py --runs 10 --path /category/1 --budget-ms 400 --save cold.json
+    python benchmarks/cold_start.py --importtime 25         # also show the slowest imports under main
+
+Every run is a new process started with SCHEMA_ON_STARTUP=0, the way a
+serverless instance boots after `flask db-init` has run at deploy time. The
+database is initialised once up front. "import" is the time to `import main`;
+"first response" adds building a test client and serving --path. The run
+exits 1 when the median first response is over --budget-ms.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Import plus the first catalog page on SQLite. About 550ms on a laptop-class CPU once pandas
+# and Pillow stopped loading at import (they alone added ~270ms); the rest is headroom
+DEFAULT_BUDGET_MS = 750
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+response = main.app.test_client().get(sys.argv[1])
+served = time.perf_counter()
+print(json.dumps({"import_ms": (imported - started) * 1000, "first_response_ms": (served - started) * 1000,
+                  "status": response.status_code, "heavy": sorted(m for m in ("pandas", "PIL.Image", "admin_forms")
+                                                                 if m in sys.modules)}))
+"""
+
+IMPORTTIME_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def environment(db_uri):
+    env = dict(os.environ, DB_URI=db_uri, SCHEMA_ON_STARTUP="0")
+    env.setdefault("secret_key", "cold-start")
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env.pop("PYTHONDONTWRITEBYTECODE", None)  # measure with warm .pyc files, as a deployed image has
+    return env
+
+
+def init_database(env):
+    subprocess.run([sys.executable, "-m", "flask", "--app", "main", "db-init"], cwd=ROOT, env=env,
+                   check=True, stdout=subprocess.DEVNULL)
+
+
+def probe(env, path):
+    output = subprocess.run([sys.executable, "-c", PROBE, path], cwd=ROOT, env=env,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def import_breakdown(env, top):
+    """Slowest modules imported while importing main, by cumulative time, from `python -X importtime`."""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=ROOT, env=env,
+                            check=True, capture_output=True, text=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((int(cumulative_us) / 1000, int(self_us) / 1000, len(indent) // 2, name))
+    # Only what main pulls in directly: those totals add up to main's own without double counting
+    direct = [row for row in rows if row[2] == 1]
+    main_row = next((row for row in rows if row[3] == "main"), None)
+    return main_row, sorted(direct, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-uri", help="initialised database to boot against (default: a temp SQLite file)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/", help="first request to serve")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help="fail if the median first response is slower (default %(default)s)")
+    parser.add_argument("--importtime", type=int, metavar="N", default=0,
+                        help="also print the N slowest direct imports of main")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    db_uri = args.db_uri or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "cold.db")
+    env = environment(db_uri)
+    init_database(env)
+    probe(env, args.path)  # compile .pyc files so the measured runs start like a deployed image
+
+    runs = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        result = probe(env, args.path)
+        result["process_ms"] = (time.perf_counter() - started) * 1000
+        runs.append(result)
+        if result["status"] >= 500:
+            sys.exit("%s returned HTTP %d" % (args.path, result["status"]))
+
+    summary = {key: statistics.median(run[key] for run in runs)
+               for key in ("import_ms", "first_response_ms", "process_ms")}
+    print("%-18s %10s %10s %10s" % ("", "median", "min", "max"))
+    for key, label in (("import_ms", "import main"), ("first_response_ms", "first response"),
+                       ("process_ms", "whole process")):
+        values = [run[key] for run in runs]
+        print("%-18s %8.1fms %8.1fms %8.1fms" % (label, statistics.median(values), min(values), max(values)))
+    if runs[-1]["heavy"]:
+        print("loaded on the first request:", ", ".join(runs[-1]["heavy"]))
+
+    breakdown = []
+    if args.importtime:
+        main_row, direct = import_breakdown(env, args.importtime)
+        if main_row:
+            print("\nimport main: %.1fms cumulative, %.1fms in main itself" % (main_row[0], main_row[1]))
+        print("%10s  %s" % ("cumulative", "module imported by main"))
+        for cumulative, _, _, name in direct:
+            print("%8.1fms  %s" % (cumulative, name))
+            breakdown.append({"module": name, "cumulative_ms": cumulative})
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({
+                "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "path": args.path,
+                "budget_ms": args.budget_ms,
+                "median": summary,
+                "runs": runs,
+                "imports": breakdown,
+            }, f, indent=2, sort_keys=True)
+
+    if summary["first_response_ms"] > args.budget_ms:
+        print("\nFAIL: median first response %.1fms is over the %.0fms budget"
+              % (summary["first_response_ms"], args.budget_ms))
+        sys.exit(1)
+    print("\nok: median first response %.1fms within the %.0fms budget" % (summary["first_response_ms"], args.budget_ms))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Synthetic shop data for the benchmark suite, generated from a seed so runs are comparable.
+
+``seed(shop, scale)`` fills the database behind ``shop`` (the imported ``main``
+module) and returns a manifest: the ids and logins the load generator needs.
+Everything is bulk-inserted with precomputed ids, so a 100k-product catalog
+takes seconds; seeding an existing database appends after its current rows.
+"""
+import random
+from datetime import datetime, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+PASSWORD = "bench"
+
+DEFAULT_SCALE = {
+    "users": 200,
+    "categories": 300,
+    "depth": 4,
+    "products": 20000,
+    "orders_per_user": 10,
+    "items_per_order": 3,
+    "cart_lines": 5,
+    "seed": 42,
+}
+
+# Large enough that repeated checkouts in a run never empty a product
+BENCH_STOCK = 1000000
+
+
+def _category_rows(count, depth, start_id):
+    branching = 2
+    while sum(branching ** d for d in range(1, depth + 1)) < count:
+        branching += 1
+    levels = [[None]]
+    rows = []
+    next_id = start_id
+    for _ in range(depth):
+        level = []
+        for parent in levels[-1]:
+            for _ in range(branching):
+                if next_id - start_id >= count:
+                    break
+                rows.append({"id": next_id, "name": "bench-cat-%d" % next_id, "parent_id": parent})
+                level.append(next_id)
+                next_id += 1
+        levels.append(level)
+    return rows, levels[1:]
+
+
+def _next_id(db, model):
+    return (db.session.execute(db.select(db.func.max(model.id))).scalar() or 0) + 1
+
+
+def seed(shop, scale=None, progress=print):
+    from create_db import User, Category, Product, CartItem, Address, Order, OrderItem
+    import versions
+
+    scale = dict(DEFAULT_SCALE, **(scale or {}))
+    rng = random.Random(scale["seed"])
+    app, db = shop.app, shop.db
+    password = shop.generate_password_hash(PASSWORD)
+    run = "%x" % rng.getrandbits(32)
+
+    with app.app_context():
+        category_rows, levels = _category_rows(scale["categories"], scale["depth"], _next_id(db, Category))
+        db.session.execute(db.insert(Category), category_rows)
+        category_ids = [row["id"] for row in category_rows]
+        progress("categories: %d over %d levels" % (len(category_rows), len(levels)))
+
+        first_product = _next_id(db, Product)
+        now = datetime.utcnow()
+        products = []
+        for i in range(scale["products"]):
+            products.append({
+                "id": first_product + i,
+                "name": "bench product %d %s" % (i, rng.choice(("red", "blue", "steel", "linen", "oak"))),
+                "description": "Synthetic benchmark product number %d." % i,
+                "price": Decimal(rng.randint(100, 50000)) / 100,
+                "discount": rng.choice((0, 0, 0, 5, 10, 25)),
+                "stock_quantity": BENCH_STOCK,
+                "image_url": "",
+                "category_id": rng.choice(category_ids),
+                "created_at": now - timedelta(minutes=scale["products"] - i),
+            })
+        for start in range(0, len(products), 5000):
+            db.session.execute(db.insert(Product), products[start:start + 5000])
+        shop.search_index.index_products(db.session, [SimpleNamespace(**p) for p in products])
+        progress("products: %d" % len(products))
+
+        first_user = _next_id(db, User)
+        users = [{"id": first_user + i, "name": "bench user %d" % i,
+                  "email": "bench%d-%s@bench.test" % (i, run), "password": password, "is_admin": False}
+                 for i in range(scale["users"])]
+        db.session.execute(db.insert(User), users)
+        first_address = _next_id(db, Address)
+        db.session.execute(db.insert(Address), [
+            {"id": first_address + i, "user_id": u["id"], "full_name": u["name"], "street": "1 Bench St",
+             "city": "Bench", "zip_code": "00000", "country": "Bench", "phone": "0"}
+            for i, u in enumerate(users)
+        ])
+
+        first_order = _next_id(db, Order)
+        orders, items, carts = [], [], []
+        for i, user in enumerate(users):
+            for n in range(scale["orders_per_user"]):
+                order_id = first_order + len(orders)
+                lines = rng.sample(products, scale["items_per_order"])
+                total = Decimal(0)
+                for product in lines:
+                    quantity = rng.randint(1, 3)
+                    each = (product["price"] * (100 - product["discount"]) / 100).quantize(Decimal("0.01"))
+                    items.append({"order_id": order_id, "product_id": product["id"],
+                                  "quantity": quantity, "price_each": each})
+                    total += each * quantity
+                orders.append({
+                    "id": order_id, "user_id": user["id"], "address_id": first_address + i,
+                    "status": rng.choice(("pending", "Paid", "Delivered", "Delivered", "Cancelled")),
+                    "payment_method": rng.choice(("cod", "card", "paypal")), "total_amount": total,
+                    "created_at": now - timedelta(hours=rng.randint(1, 24 * 365)),
+                })
+            for product in rng.sample(products, scale["cart_lines"]):
+                carts.append({"user_id": user["id"], "product_id": product["id"], "quantity": rng.randint(1, 3)})
+        for start in range(0, len(orders), 5000):
+            db.session.execute(db.insert(Order), orders[start:start + 5000])
+        for start in range(0, len(items), 5000):
+            db.session.execute(db.insert(OrderItem), items[start:start + 5000])
+        if carts:
+            db.session.execute(db.insert(CartItem), carts)
+        progress("users: %d, orders: %d, order items: %d, cart lines: %d"
+                 % (len(users), len(orders), len(items), len(carts)))
+
+        _advance_sequences(db, ("categories", "products", "users", "addresses", "orders"))
+        versions.bump(db.session, shop.CATALOG_VERSION_KEY)
+        versions.bump(db.session, shop.CATEGORY_VERSION_KEY)
+        db.session.commit()
+        shop.category_cache.invalidate()
+
+    orders_by_user = {}
+    for order in orders:
+        orders_by_user.setdefault(order["user_id"], []).append(order["id"])
+    return {
+        "scale": scale,
+        "password": PASSWORD,
+        "users": [{"id": u["id"], "email": u["email"], "address_id": first_address + i,
+                   "orders": orders_by_user.get(u["id"], [])} for i, u in enumerate(users)],
+        "categories": category_ids,
+        "leaf_categories": levels[-1] if levels and levels[-1] else category_ids,
+        "root_categories": levels[0] if levels else [],
+        "products": [first_product, first_product + len(products) - 1],
+    }
+
+
+def _advance_sequences(db, tables):
+    # Rows were written with explicit ids, which Postgres serial sequences don't see
+    if db.engine.dialect.name != "postgresql":
+        return
+    for table in tables:
+        db.session.execute(db.text(
+            "SELECT setval(pg_get_serial_sequence('%s', 'id'), (SELECT max(id) FROM %s))" % (table, table)
+        ))
@@ -0,0 +1,192 @@
+"""Flash-sale load test: far more buyers than units of a single SKU.
+
+1. Every buyer adds the SKU to their cart at the same moment. Holds must never
+   exceed the stock, and every unit should end up held by someone.
+2. A share of the winners abandon their carts. Once their holds expire and the
+   sweeper runs, the buyers who missed out try again and take those units.
+3. Everyone holding stock checks out at once. A hold should mean checkout
+   succeeds, so no holder may be turned away, and nothing may be oversold.
+
+    python benchmarks/flash_sale.py                      # throwaway SQLite file
+    python benchmarks/flash_sale.py --db-uri postgresql://localhost/shop_stress --buyers 200
+
+Point --db-uri at a scratch database: the run adds users, a product and orders to it.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-uri")
+    parser.add_argument("--buyers", type=int, default=64)
+    parser.add_argument("--stock", type=int, default=20)
+    parser.add_argument("--quantity", type=int, default=1, help="units each buyer tries to hold")
+    parser.add_argument("--abandon", type=float, default=0.25, help="share of winners who walk away")
+    parser.add_argument("--hold-seconds", type=int, default=2)
+    args = parser.parse_args()
+
+    os.environ["DB_URI"] = args.db_uri or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "flash.db")
+    os.environ["CART_HOLD_SECONDS"] = str(args.hold_seconds)
+    os.environ.setdefault("secret_key", "flash-sale")
+    # Every buyer signs in from the same test client address; this measures checkout, not the throttle
+    for name in ("RATE_LIMIT_LOGIN_IP", "RATE_LIMIT_LOGIN_EMAIL", "RATE_LIMIT_SIGNUP_IP", "RATE_LIMIT_SIGNUP_EMAIL"):
+        os.environ.setdefault(name, "off")
+    sys.path.insert(0, ROOT)
+
+    import main as shop
+    import inventory
+    from create_db import User, Category, Product, Address, OrderItem, CartItem, StockReservation
+    from sqlalchemy import func
+
+    app, db = shop.app, shop.db
+    app.config["WTF_CSRF_ENABLED"] = False
+    run = uuid.uuid4().hex[:8]
+    password = shop.generate_password_hash("flash")
+
+    with app.app_context():
+        category = Category(name="flash-%s" % run)
+        db.session.add(category)
+        db.session.flush()
+        product = Product(name="flash-%s" % run, description="flash sale", price=10, discount=50,
+                          stock_quantity=args.stock, image_url="", category_id=category.id)
+        db.session.add(product)
+        db.session.flush()
+        product_id = product.id
+        buyers = []
+        for i in range(args.buyers):
+            user = User(name="buyer %d" % i, email="flash%d-%s@stress.test" % (i, run), password=password)
+            db.session.add(user)
+            db.session.flush()
+            address = Address(user_id=user.id, full_name=user.name, street="1 Test St", city="Test",
+                              zip_code="00000", country="Test", phone="0")
+            db.session.add(address)
+            db.session.flush()
+            buyers.append((user.id, user.email, address.id))
+        db.session.commit()
+
+    clients = {}
+    for user_id, email, _ in buyers:
+        client = app.test_client()
+        response = client.post("/login", data={"email": email, "password": "flash"})
+        # A failed login re-renders the form; every later phase would then blame holds or checkout
+        if response.status_code != 302 or "/login" in response.headers.get("Location", ""):
+            sys.exit("could not log in as %s (HTTP %d)" % (email, response.status_code))
+        clients[user_id] = client
+
+    def holders():
+        with app.app_context():
+            rows = db.session.execute(
+                db.select(StockReservation.user_id, StockReservation.quantity).filter_by(product_id=product_id)
+            ).all()
+            counter = inventory.available(db.session, [product_id])[product_id]
+        return dict(rows), counter
+
+    def stampede(user_ids, action):
+        barrier = threading.Barrier(len(user_ids))
+        latencies, errors = [], []
+
+        def worker(user_id):
+            barrier.wait()
+            start = time.perf_counter()
+            try:
+                response = action(user_id)
+                if response.status_code >= 500:
+                    errors.append(response.status_code)
+            except Exception as exc:  # noqa: BLE001 - reported below
+                errors.append(repr(exc))
+            latencies.append(time.perf_counter() - start)
+
+        threads = [threading.Thread(target=worker, args=(user_id,)) for user_id in user_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return latencies, errors
+
+    def add_to_cart(user_id):
+        return clients[user_id].post("/add-to-cart/%d" % product_id, data={"quantity": args.quantity})
+
+    def report(phase, latencies, errors):
+        print("%-10s requests=%d p50=%.1fms p99=%.1fms max=%.1fms errors=%d" % (
+            phase, len(latencies), percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000,
+            max(latencies or [0]) * 1000, len(errors)))
+        if errors:
+            print("  errors:", errors[:5])
+
+    failures = []
+    expected_held = min(args.stock // args.quantity, args.buyers) * args.quantity
+
+    latencies, errors = stampede([b[0] for b in buyers], add_to_cart)
+    report("hold", latencies, errors)
+    held, left = holders()
+    print("  held=%d by %d buyers, available=%d" % (sum(held.values()), len(held), left))
+    if sum(held.values()) != expected_held or left != args.stock - expected_held or errors:
+        failures.append("first rush")
+
+    # Some winners walk away; their holds lapse and go back on sale
+    winners = sorted(held)
+    quitters = winners[:int(len(winners) * args.abandon)]
+    with app.app_context():
+        db.session.execute(db.delete(CartItem).where(CartItem.user_id.in_(quitters),
+                                                     CartItem.product_id == product_id))
+        db.session.commit()
+    time.sleep(args.hold_seconds + 0.5)
+    with app.app_context():
+        # Keep the remaining winners' holds alive past the expiry we just waited out
+        for user_id in winners[len(quitters):]:
+            inventory.hold(db.session, user_id, product_id, held[user_id], shop.CART_HOLD * 30)
+        db.session.commit()
+        swept = inventory.sweep(db.session)
+    print("  %d winners abandoned, sweeper released %d holds" % (len(quitters), swept))
+
+    losers = [b[0] for b in buyers if b[0] not in held]
+    if losers:
+        latencies, errors = stampede(losers, add_to_cart)
+        report("retry", latencies, errors)
+    held, left = holders()
+    print("  held=%d by %d buyers, available=%d" % (sum(held.values()), len(held), left))
+    if sum(held.values()) != expected_held:
+        failures.append("second rush")
+
+    address_of = {user_id: address_id for user_id, _, address_id in buyers}
+    latencies, errors = stampede(sorted(held), lambda user_id: clients[user_id].post(
+        "/checkout", data={"address_id": address_of[user_id], "payment_method": "cod"}))
+    report("checkout", latencies, errors)
+
+    with app.app_context():
+        stock = db.session.get(Product, product_id).stock_quantity
+        buyers_served = dict(db.session.execute(
+            db.select(OrderItem.order_id, func.sum(OrderItem.quantity)).filter_by(product_id=product_id)
+            .group_by(OrderItem.order_id)
+        ).all())
+        sold = sum(buyers_served.values())
+        remaining_holds = db.session.execute(
+            db.select(func.count()).select_from(StockReservation).filter_by(product_id=product_id)
+        ).scalar()
+    print("  sold=%d in %d orders, stock left=%d, holds left=%d" % (sold, len(buyers_served), stock, remaining_holds))
+    if sold != expected_held or len(buyers_served) != len(held) or stock != args.stock - sold or stock < 0:
+        failures.append("checkout")
+
+    if failures:
+        print("FAIL:", ", ".join(failures))
+        sys.exit(1)
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
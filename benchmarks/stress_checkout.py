@@ -0,0 +1,169 @@
+"""Concurrent checkout stress test: many buyers racing for one SKU.
+
+Each thread logs in as its own user, puts the contested product in its cart
+and checks out at the same moment as everyone else. Afterwards the script
+checks that units sold never exceed the starting stock, that stock never went
+negative and that every order total matches its line items.
+
+    python benchmarks/stress_checkout.py                      # throwaway SQLite file
+    python benchmarks/stress_checkout.py --db-uri postgresql://localhost/shop_stress
+
+Point --db-uri at a scratch database: its tables are created if missing and
+the run adds users, a category, a product and orders to it. A buyer whose
+login fails is reported as such and fails the round without being counted
+against checkout. tests/test_checkout_stress.py runs a smaller race under pytest.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def logged_in(response):
+    """The login view redirects on success; a failed login re-renders the form (200) or is throttled (429)."""
+    return response.status_code == 302 and "/login" not in response.headers.get("Location", "")
+
+
+def stress(shop, buyers=32, stock=20, quantity=1, rounds=5, report=print):
+    """Race ``buyers`` for one product of ``stock`` units, ``rounds`` times, against the imported app module.
+
+    Returns one dict per round; ``ok`` is False on an oversell, a bad order total,
+    a server error or a buyer who could not log in.
+    """
+    from create_db import User, Category, Product, Address, Order, OrderItem, CartItem
+    from sqlalchemy import func
+
+    app, db = shop.app, shop.db
+    app.config["WTF_CSRF_ENABLED"] = False
+    run = uuid.uuid4().hex[:8]
+    password = shop.generate_password_hash("stress")
+
+    with app.app_context():
+        category = Category(name="stress-%s" % run)
+        db.session.add(category)
+        db.session.flush()
+        category_id = category.id
+        accounts = []
+        for i in range(buyers):
+            user = User(name="buyer %d" % i, email="buyer%d-%s@stress.test" % (i, run), password=password)
+            db.session.add(user)
+            db.session.flush()
+            address = Address(user_id=user.id, full_name=user.name, street="1 Test St", city="Test",
+                              zip_code="00000", country="Test", phone="0")
+            db.session.add(address)
+            db.session.flush()
+            accounts.append((user.email, address.id))
+        db.session.commit()
+
+    results = []
+    for round_number in range(1, rounds + 1):
+        with app.app_context():
+            product = Product(name="contested-%s-%d" % (run, round_number), description="stress", price=10,
+                              discount=0, stock_quantity=stock, image_url="", category_id=category_id)
+            db.session.add(product)
+            db.session.commit()
+            product_id = product.id
+
+        barrier = threading.Barrier(buyers)
+        errors, auth_failures = [], []
+
+        def buy(email, address_id):
+            client = app.test_client()
+            signed_in = False
+            try:
+                response = client.post("/login", data={"email": email, "password": "stress"})
+                signed_in = logged_in(response)
+                if signed_in:
+                    client.post("/add-to-cart/%d" % product_id, data={"quantity": quantity})
+                else:
+                    auth_failures.append(response.status_code)
+            except Exception as exc:  # noqa: BLE001 - reported below
+                errors.append(repr(exc))
+            # Everyone reaches the barrier, or the buyers who did log in would wait forever
+            barrier.wait()
+            if not signed_in:
+                return
+            try:
+                response = client.post("/checkout", data={"address_id": address_id, "payment_method": "cod"})
+                if response.status_code >= 500:
+                    errors.append(response.status_code)
+            except Exception as exc:  # noqa: BLE001 - reported below
+                errors.append(repr(exc))
+
+        threads = [threading.Thread(target=buy, args=account) for account in accounts]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        with app.app_context():
+            left = db.session.get(Product, product_id).stock_quantity
+            sold = db.session.execute(
+                db.select(func.coalesce(func.sum(OrderItem.quantity), 0)).filter_by(product_id=product_id)
+            ).scalar()
+            orders = db.session.execute(
+                db.select(Order).join(OrderItem).filter(OrderItem.product_id == product_id)
+            ).unique().scalars().all()
+            bad_totals = [o.id for o in orders
+                          if o.total_amount != sum(i.price_each * i.quantity for i in o.items)]
+            db.session.execute(db.delete(CartItem).filter_by(product_id=product_id))
+            db.session.commit()
+
+        expected_sold = min(stock // quantity, buyers) * quantity
+        consistent = sold <= stock and left >= 0 and left + sold == stock and not bad_totals
+        ok = consistent and sold == expected_sold and not errors and not auth_failures
+        results.append({"round": round_number, "sold": sold, "left": left, "orders": len(orders),
+                        "expected_sold": expected_sold, "consistent": consistent, "bad_totals": bad_totals,
+                        "errors": errors, "auth_failures": auth_failures, "ok": ok})
+        report("round %d: buyers=%d stock=%d sold=%d left=%d orders=%d errors=%d %.2fs %s" % (
+            round_number, buyers, stock, sold, left, len(orders), len(errors), elapsed, "ok" if ok else "FAIL"))
+        if auth_failures:
+            # Not a checkout problem: those buyers never got to check out
+            report("  %d buyers could not log in (HTTP %s)" % (
+                len(auth_failures), ", ".join(sorted({str(code) for code in auth_failures}))))
+        if errors:
+            report("  errors:", errors[:5])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-uri")
+    parser.add_argument("--buyers", type=int, default=32)
+    parser.add_argument("--stock", type=int, default=20)
+    parser.add_argument("--quantity", type=int, default=1, help="units each buyer tries to purchase")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ["DB_URI"] = args.db_uri or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "stress.db")
+    os.environ.setdefault("secret_key", "stress")
+    # Every buyer signs in from the same test client address; this measures checkout, not the throttle
+    for name in ("RATE_LIMIT_LOGIN_IP", "RATE_LIMIT_LOGIN_EMAIL", "RATE_LIMIT_SIGNUP_IP", "RATE_LIMIT_SIGNUP_EMAIL"):
+        os.environ.setdefault(name, "off")
+    sys.path.insert(0, ROOT)
+
+    import main as shop
+
+    results = stress(shop, args.buyers, args.stock, args.quantity, args.rounds)
+    if any(r["auth_failures"] for r in results):
+        print("login failed in rounds", [r["round"] for r in results if r["auth_failures"]])
+    inconsistent = [r["round"] for r in results if not r["consistent"]]
+    if inconsistent:
+        print("oversell or inconsistency detected in rounds", inconsistent)
+    undersold = [r["round"] for r in results
+                 if r["consistent"] and not r["auth_failures"] and r["sold"] != r["expected_sold"]]
+    if undersold:
+        print("fewer units sold than buyers could take in rounds", undersold)
+    if not all(r["ok"] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+"""Route benchmark suite: seed a synthetic shop, load it, save and compare baselines.
+
+    python benchmarks/suite.py run --save baseline.json            # throwaway SQLite, in-process
+    python benchmarks/suite.py run --concurrency 16 --requests 500 --save after.json
+    python benchmarks/suite.py compare baseline.json after.json     # exits 1 on a regression
+
+Against a real server (gunicorn, the dev server, ...) seed its database first,
+then point the load generator at it over HTTP:
+
+    DB_URI=postgresql://localhost/shop_bench python benchmarks/suite.py seed --manifest bench.json
+    python benchmarks/suite.py run --manifest bench.json --url http://127.0.0.1:8000 --save pg.json
+
+Each route is warmed up, then requested --requests times spread over
+--concurrency virtual users, each logged in as its own seeded customer (the
+catalog routes are requested anonymously, as most catalog traffic is). Latency
+is measured around the request; query counts and DB time come from the
+Server-Timing header that sql_instrumentation adds to every response.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_TIMING_RE = re.compile(r'db;dur=([\d.]+);desc="(\d+) queries"')
+
+# Metrics where a higher value in the new run is a regression, with the relative change tolerated
+COMPARED = {"p50_ms": 0.15, "p95_ms": 0.15, "p99_ms": 0.25, "queries_avg": 0.0, "errors": 0.0}
+
+
+class TestClientSession:
+    """One virtual user driving the app in-process through Flask's test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code, response.headers.get("Server-Timing", "")
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpSession:
+    """One virtual user talking to a running server; keeps its own cookies and doesn't follow redirects."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(req, timeout=60) as response:
+                response.read()
+                return response.status, response.headers.get("Server-Timing", "")
+        except urllib.error.HTTPError as exc:
+            exc.read()
+            return exc.code, exc.headers.get("Server-Timing", "")
+
+
+class Route:
+    def __init__(self, name, anonymous, build, setup=None):
+        self.name = name
+        self.anonymous = anonymous
+        self.build = build  # (user, rng) -> (method, path, data)
+        self.setup = setup  # (session, user, rng) -> None, run untimed before each request
+
+
+def routes(manifest):
+    first_product, last_product = manifest["products"]
+    categories = manifest["categories"]
+
+    def add_to_cart(session, user, rng):
+        session.request("POST", "/add-to-cart/%d" % rng.randint(first_product, last_product), {"quantity": 1})
+
+    return [
+        Route("products", True, lambda user, rng: ("GET", rng.choice(("/", "/?sort=oldest")), None)),
+        Route("category_products", True,
+              lambda user, rng: ("GET", "/category/%d" % rng.choice(categories), None)),
+        Route("view_cart", False, lambda user, rng: ("GET", "/cart", None)),
+        Route("checkout", False, lambda user, rng: ("GET", "/checkout", None), setup=add_to_cart),
+        Route("checkout_submit", False,
+              lambda user, rng: ("POST", "/checkout", {"address_id": user["address_id"], "payment_method": "cod"}),
+              setup=add_to_cart),
+        Route("my_orders", False, lambda user, rng: ("GET", "/my_orders", None)),
+        Route("order_summary", False,
+              lambda user, rng: ("GET", "/order_summary/%d" % rng.choice(user["orders"]), None)),
+    ]
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def measure(route, sessions, users, requests, warmup, seed):
+    """Run one route and summarise it. ``sessions[i]`` is logged in as ``users[i]`` (or anonymous)."""
+    samples, errors, lock = [], [], threading.Lock()
+    per_user = [requests // len(sessions) + (1 if i < requests % len(sessions) else 0) for i in range(len(sessions))]
+
+    def worker(index, count, record):
+        rng = random.Random("%s-%s-%d-%s" % (seed, route.name, index, record))
+        session, user = sessions[index], users[index]
+        for _ in range(count):
+            if route.setup:
+                route.setup(session, user, rng)
+            method, path, data = route.build(user, rng)
+            start = time.perf_counter()
+            try:
+                status, timing = session.request(method, path, data)
+            except Exception as exc:  # noqa: BLE001 - counted as an error
+                status, timing = None, ""
+                error = repr(exc)
+            else:
+                error = status if status >= 500 else None
+            elapsed = time.perf_counter() - start
+            if record:
+                match = SERVER_TIMING_RE.search(timing)
+                with lock:
+                    samples.append((elapsed, int(match.group(2)) if match else None,
+                                    float(match.group(1)) if match else None))
+                    if error is not None:
+                        errors.append(error)
+
+    def run(counts, record):
+        threads = [threading.Thread(target=worker, args=(i, n, record)) for i, n in enumerate(counts) if n]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+    run([min(warmup, n) for n in per_user], record=False)
+    wall = run(per_user, record=True)
+
+    latencies = [s[0] for s in samples]
+    queries = [s[1] for s in samples if s[1] is not None]
+    db_ms = [s[2] for s in samples if s[2] is not None]
+    return {
+        "requests": len(samples),
+        "errors": len(errors),
+        "error_samples": [str(e) for e in errors[:5]],
+        "throughput_rps": len(samples) / wall if wall else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies or [0]) * 1000,
+        "queries_avg": sum(queries) / len(queries) if queries else None,
+        "queries_max": max(queries) if queries else None,
+        "db_ms_avg": sum(db_ms) / len(db_ms) if db_ms else None,
+    }
+
+
+def import_app(db_uri):
+    if db_uri:
+        os.environ["DB_URI"] = db_uri
+    os.environ.setdefault("secret_key", "bench")
+    sys.path.insert(0, ROOT)
+    import main as shop
+    shop.app.config["WTF_CSRF_ENABLED"] = False
+    return shop
+
+
+def scale_from(args):
+    return {key: getattr(args, key) for key in ("users", "categories", "depth", "products",
+                                                "orders_per_user", "items_per_order", "cart_lines", "seed")}
+
+
+def cmd_seed(args):
+    from dataset import seed
+    shop = import_app(args.db_uri)
+    manifest = seed(shop, scale_from(args))
+    with open(args.manifest, "w") as f:
+        json.dump(manifest, f)
+    print("manifest written to %s" % args.manifest)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def cmd_run(args):
+    if args.manifest:
+        with open(args.manifest) as f:
+            manifest = json.load(f)
+        shop = None if args.url else import_app(args.db_uri)
+    else:
+        if args.url:
+            sys.exit("--url needs --manifest from a 'seed' run against the server's database")
+        from dataset import seed
+        shop = import_app(args.db_uri or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"))
+        manifest = seed(shop, scale_from(args))
+
+    def new_session():
+        return HttpSession(args.url) if args.url else TestClientSession(shop.app)
+
+    users = manifest["users"][:args.concurrency]
+    if len(users) < args.concurrency:
+        sys.exit("the dataset only has %d users; seed more or lower --concurrency" % len(users))
+    customers = []
+    for user in users:
+        session = new_session()
+        status, _ = session.request("POST", "/login", {"email": user["email"], "password": manifest["password"]})
+        if status >= 400:
+            sys.exit("could not log in as %s (HTTP %d)" % (user["email"], status))
+        customers.append(session)
+    visitors = [new_session() for _ in users]
+
+    selected = [r for r in routes(manifest) if not args.routes or r.name in args.routes]
+    results = {}
+    print("%-18s %8s %8s %9s %9s %9s %9s %8s %7s" % (
+        "route", "requests", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms", "queries", "db ms"))
+    for route in selected:
+        sessions = visitors if route.anonymous else customers
+        result = measure(route, sessions, users, args.requests, args.warmup, manifest["scale"]["seed"])
+        results[route.name] = result
+        print("%-18s %8d %8d %9.1f %9.2f %9.2f %9.2f %8s %7s" % (
+            route.name, result["requests"], result["errors"], result["throughput_rps"], result["p50_ms"],
+            result["p95_ms"], result["p99_ms"],
+            "-" if result["queries_avg"] is None else "%.1f" % result["queries_avg"],
+            "-" if result["db_ms_avg"] is None else "%.2f" % result["db_ms_avg"]))
+        for sample in result["error_samples"]:
+            print("    error: %s" % sample)
+
+    if args.save:
+        baseline = {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "target": args.url or "in-process (%s)" % shop.app.config["SQLALCHEMY_DATABASE_URI"].split(":")[0],
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "scale": manifest["scale"],
+            "routes": results,
+        }
+        with open(args.save, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print("baseline saved to %s" % args.save)
+    if any(r["errors"] for r in results.values()):
+        sys.exit(1)
+
+
+def cmd_compare(args):
+    with open(args.baseline) as f:
+        before = json.load(f)
+    with open(args.current) as f:
+        after = json.load(f)
+    for key in ("scale", "concurrency", "requests", "target"):
+        if before.get(key) != after.get(key):
+            print("warning: runs differ in %s (%s vs %s)" % (key, before.get(key), after.get(key)))
+
+    tolerance = {metric: allowed * args.tolerance_scale for metric, allowed in COMPARED.items()}
+    regressions = []
+    print("%-18s %-12s %10s %10s %9s" % ("route", "metric", "before", "after", "change"))
+    for route in sorted(set(before["routes"]) | set(after["routes"])):
+        old, new = before["routes"].get(route), after["routes"].get(route)
+        if old is None or new is None:
+            print("%-18s only in %s" % (route, "current" if old is None else "baseline"))
+            continue
+        for metric in ("throughput_rps",) + tuple(COMPARED):
+            a, b = old.get(metric), new.get(metric)
+            if a is None or b is None:
+                continue
+            change = (b - a) / a if a else (0.0 if b == a else float("inf"))
+            regressed = metric in tolerance and b > a and change > tolerance[metric]
+            if regressed:
+                regressions.append((route, metric))
+            print("%-18s %-12s %10.2f %10.2f %8.1f%%%s" % (route, metric, a, b, change * 100,
+                                                          "  REGRESSION" if regressed else ""))
+    if regressions:
+        print("%d regressions: %s" % (len(regressions), ", ".join("%s %s" % r for r in regressions)))
+        sys.exit(1)
+    print("no regressions")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_scale(p):
+        p.add_argument("--db-uri", help="defaults to $DB_URI ('run' without --manifest uses a temp SQLite file)")
+        p.add_argument("--users", type=int, default=200)
+        p.add_argument("--categories", type=int, default=300)
+        p.add_argument("--depth", type=int, default=4)
+        p.add_argument("--products", type=int, default=20000)
+        p.add_argument("--orders-per-user", type=int, default=10)
+        p.add_argument("--items-per-order", type=int, default=3)
+        p.add_argument("--cart-lines", type=int, default=5)
+        p.add_argument("--seed", type=int, default=42)
+
+    seed_parser = commands.add_parser("seed", help="fill a database and write a manifest for 'run'")
+    add_scale(seed_parser)
+    seed_parser.add_argument("--manifest", default="bench-dataset.json")
+    seed_parser.set_defaults(func=cmd_seed)
+
+    run_parser = commands.add_parser("run", help="load every route and report latency, throughput and queries")
+    add_scale(run_parser)
+    run_parser.add_argument("--manifest", help="dataset seeded earlier; without it a fresh one is created")
+    run_parser.add_argument("--url", help="drive a running server over HTTP instead of the in-process test client")
+    run_parser.add_argument("--concurrency", type=int, default=8)
+    run_parser.add_argument("--requests", type=int, default=200, help="per route")
+    run_parser.add_argument("--warmup", type=int, default=2, help="untimed requests per virtual user")
+    run_parser.add_argument("--routes", nargs="*", help="only these routes")
+    run_parser.add_argument("--save", help="write the results as a JSON baseline")
+    run_parser.set_defaults(func=cmd_run)
+
+    compare_parser = commands.add_parser("compare", help="diff two baselines; exit 1 on regressions")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--tolerance-scale", type=float, default=1.0,
+                                help="multiply the allowed latency increases (noisy machines)")
+    compare_parser.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+
+class LRUCache:
+    """Thread-safe in-process cache that evicts the least recently used entry past ``max_entries``.
+
+    With ``ttl`` (seconds) entries also expire on their own; ``None`` keeps them until evicted.
+    """
+
+    shared = False  # visible to this process only
+
+    def __init__(self, max_entries=1024, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class RedisCache:
+    """Same interface as LRUCache, shared between workers through a Redis-compatible server.
+
+    Values must be JSON-serialisable. Eviction is left to the server's maxmemory policy.
+    """
+
+    shared = True
+
+    def __init__(self, url, prefix="ecommerce:", ttl=None):
+        try:
+            import redis
+        except ImportError as exc:
+            raise RuntimeError("a redis:// cache URL needs the 'redis' package installed") from exc
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        raw = self.client.get(self.prefix + str(key))
+        return default if raw is None else json.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        self.client.set(self.prefix + str(key), json.dumps(value), ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + str(key))
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+
+def cache_from_url(url, prefix="ecommerce:", max_entries=1024, ttl=None):
+    """Build a cache from ``memory://?max_entries=N&ttl=S`` or ``redis://host:port/db?ttl=S``."""
+    parsed = urlparse(url or "memory://")
+    options = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+    ttl = float(options.pop("ttl", ttl)) if options.get("ttl", ttl) is not None else None
+    if parsed.scheme == "memory":
+        return LRUCache(max_entries=int(options.get("max_entries", max_entries)), ttl=ttl)
+    if parsed.scheme in ("redis", "rediss", "unix"):
+        return RedisCache(parsed._replace(query="").geturl(), prefix=prefix, ttl=ttl)
+    raise ValueError("unsupported cache URL %r" % url)
@@ -0,0 +1,72 @@
+from decimal import Decimal
+
+from sqlalchemy import select, delete
+from sqlalchemy.orm import contains_eager, joinedload
+
+from create_db import CartItem, Product
+from money import discounted_unit_price, HUNDRED
+
+
+class CartLine:
+    __slots__ = ('item', 'product', 'quantity', 'unit_price', 'discount',
+                 'unit_final_price', 'subtotal', 'discount_amount', 'final_price')
+
+    def __init__(self, item, product):
+        self.item = item
+        self.product = product
+        self.quantity = item.quantity or 0
+        self.unit_price = Decimal(product.price or 0)
+        # effective_price already includes any running sale (see pricing.py)
+        if product.effective_price is not None:
+            self.unit_final_price = Decimal(product.effective_price)
+        else:
+            self.unit_final_price = discounted_unit_price(product.price, product.discount)
+        if self.unit_price and self.unit_final_price < self.unit_price:
+            self.discount = int(((self.unit_price - self.unit_final_price) * HUNDRED / self.unit_price).to_integral_value())
+        else:
+            self.discount = 0
+        self.subtotal = self.unit_price * self.quantity
+        self.final_price = self.unit_final_price * self.quantity
+        self.discount_amount = self.subtotal - self.final_price
+
+
+class CartPricing:
+    def __init__(self, lines, removed):
+        self.lines = lines
+        self.removed = removed  # cart rows deleted because their product no longer exists
+        self.subtotal = sum((line.subtotal for line in lines), Decimal('0'))
+        self.discount_total = sum((line.discount_amount for line in lines), Decimal('0'))
+        self.total = sum((line.final_price for line in lines), Decimal('0'))
+        self.item_count = sum(line.quantity for line in lines)
+
+    def __bool__(self):
+        return bool(self.lines)
+
+
+def price_cart(session, user_id):
+    """Load a user's cart with its products in one query and price every line.
+
+    Rows whose product has been deleted are removed with one bulk DELETE.
+    """
+    items = session.execute(
+        select(CartItem)
+        .outerjoin(CartItem.product)
+        .options(contains_eager(CartItem.product).joinedload(Product.category))
+        .filter(CartItem.user_id == user_id)
+        .order_by(CartItem.id)
+    ).unique().scalars().all()
+
+    lines = []
+    orphans = []
+    for item in items:
+        if item.product is None:
+            orphans.append(item.id)
+        else:
+            lines.append(CartLine(item, item.product))
+
+    if orphans:
+        # Cleaned up on a separate connection so committing it doesn't expire
+        # the objects just loaded into the caller's session
+        with session.get_bind(CartItem).begin() as conn:
+            conn.execute(delete(CartItem).where(CartItem.id.in_(orphans)))
+    return CartPricing(lines, len(orphans))
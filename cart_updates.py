@@ -0,0 +1,192 @@
+"""Batched cart changes for the JSON cart API: many lines, one transaction, one bulk write.
+
+A batch is a list of ``{"product_id": 3, "delta": 1}`` or
+``{"product_id": 3, "quantity": 0}`` entries. Entries for the same product are
+folded together in order, the stock holds of every product are adjusted in one
+batch (inventory.hold_many), and the cart rows are written with a single upsert
+plus a single DELETE for lines that dropped to zero, so a batch costs the same
+number of queries however many lines it has. An optional idempotency token
+makes a retried batch a no-op.
+"""
+import re
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, insert, update, delete, bindparam
+from sqlalchemy.dialects import postgresql, sqlite
+
+from create_db import CartItem, CartUpdateToken, Product
+import inventory
+
+MAX_CHANGES = 100
+MAX_QUANTITY = 10000
+TOKEN_TTL = timedelta(days=1)
+_TOKEN = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+
+
+class LineResult:
+    __slots__ = ('product_id', 'requested', 'quantity', 'error')
+
+    def __init__(self, product_id, requested=None, quantity=None, error=None):
+        self.product_id = product_id
+        self.requested = requested  # what the batch asked for
+        self.quantity = quantity    # what the cart now holds; less than requested when stock ran short
+        self.error = error
+
+    @property
+    def limited(self):
+        return self.quantity is not None and self.quantity < self.requested
+
+    def as_dict(self):
+        if self.error:
+            return {'product_id': self.product_id, 'error': self.error}
+        return {'product_id': self.product_id, 'requested': self.requested, 'quantity': self.quantity,
+                'limited': self.limited}
+
+
+def _integer(value, name):
+    # bool is an int subclass, and JSON floats such as 1.5 must not be truncated silently
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError("%s must be an integer" % name)
+    return value
+
+
+def parse(payload, token=None):
+    """Validate a request body. Returns ``({product_id: (quantity or None, delta)}, token)``.
+
+    ``token`` (e.g. an Idempotency-Key header) wins over a ``"token"`` in the body.
+    Raises ValueError with a message fit for the client.
+    """
+    if not isinstance(payload, dict) or not isinstance(payload.get('changes'), list):
+        raise ValueError("expected a JSON object with a 'changes' list")
+    entries = payload['changes']
+    if len(entries) > MAX_CHANGES:
+        raise ValueError("at most %d changes per request" % MAX_CHANGES)
+    token = token or payload.get('token')
+    if token is not None and (not isinstance(token, str) or not _TOKEN.match(token)):
+        raise ValueError("token must be 1-64 letters, digits or ._:-")
+
+    changes = {}
+    for entry in entries:
+        if not isinstance(entry, dict) or 'product_id' not in entry or ('delta' in entry) == ('quantity' in entry):
+            raise ValueError("each change needs a product_id and exactly one of delta or quantity")
+        product_id = _integer(entry['product_id'], 'product_id')
+        quantity, delta = changes.get(product_id, (None, 0))
+        if 'quantity' in entry:
+            quantity, delta = _integer(entry['quantity'], 'quantity'), 0
+            if not 0 <= quantity <= MAX_QUANTITY:
+                raise ValueError("quantity must be between 0 and %d" % MAX_QUANTITY)
+        else:
+            delta += _integer(entry['delta'], 'delta')
+            if abs(delta) > MAX_QUANTITY:
+                raise ValueError("delta must be between -%d and %d" % (MAX_QUANTITY, MAX_QUANTITY))
+        changes[product_id] = (quantity, delta)
+    return changes, token
+
+
+def _claim(session, user_id, token):
+    """Record ``token`` as used; False when an earlier batch already used it."""
+    values = {'user_id': user_id, 'token': token, 'created_at': datetime.utcnow()}
+    dialect = session.get_bind(CartUpdateToken).dialect
+    if dialect.name in ('sqlite', 'postgresql'):
+        dialect_insert = sqlite.insert if dialect.name == 'sqlite' else postgresql.insert
+        result = session.execute(dialect_insert(CartUpdateToken).values(values).on_conflict_do_nothing(
+            index_elements=['user_id', 'token']))
+        return bool(result.rowcount)
+    if session.get(CartUpdateToken, (user_id, token)) is not None:
+        return False
+    session.execute(insert(CartUpdateToken), values)
+    return True
+
+
+def _write(session, user_id, quantities, existing, removed):
+    if quantities:
+        rows = [{'user_id': user_id, 'product_id': product_id, 'quantity': quantity, 'created_at': datetime.utcnow()}
+                for product_id, quantity in sorted(quantities.items())]
+        dialect = session.get_bind(CartItem).dialect
+        if dialect.name in ('sqlite', 'postgresql'):
+            dialect_insert = sqlite.insert if dialect.name == 'sqlite' else postgresql.insert
+            stmt = dialect_insert(CartItem)
+            session.execute(stmt.on_conflict_do_update(index_elements=['user_id', 'product_id'],
+                                                       set_={'quantity': stmt.excluded.quantity}), rows)
+        else:
+            table = CartItem.__table__
+            changed = [row for row in rows if row['product_id'] in existing]
+            if changed:
+                session.execute(
+                    update(table).where(table.c.user_id == bindparam('line_user_id'),
+                                        table.c.product_id == bindparam('line_product_id'))
+                    .values(quantity=bindparam('line_quantity')),
+                    [{'line_user_id': user_id, 'line_product_id': row['product_id'],
+                      'line_quantity': row['quantity']} for row in changed])
+            added = [row for row in rows if row['product_id'] not in existing]
+            if added:
+                session.execute(insert(table), added)
+    if removed:
+        session.execute(delete(CartItem).where(CartItem.user_id == user_id, CartItem.product_id.in_(removed)))
+
+
+def apply(session, user_id, changes, token=None, hold_ttl=inventory.DEFAULT_HOLD):
+    """Apply parsed ``changes`` to the user's cart inside the caller's transaction.
+
+    A line that would need more stock than can be held is raised as far as
+    stock allows instead; it is never lowered because stock ran short.
+    Returns ``(results, replayed)``; ``replayed`` means ``token`` was used
+    before and nothing was changed.
+    """
+    if token is not None and not _claim(session, user_id, token):
+        return [], True
+    product_ids = sorted(changes)
+    if not product_ids:
+        return [], False
+    known = set(session.execute(select(Product.id).where(Product.id.in_(product_ids))).scalars())
+    # Locked so two batches for the same cart can't both start from the same quantity
+    current = dict(session.execute(
+        select(CartItem.product_id, CartItem.quantity)
+        .where(CartItem.user_id == user_id, CartItem.product_id.in_(product_ids))
+        .with_for_update()
+    ).all())
+
+    have, wanted = {}, {}
+    for product_id in product_ids:
+        if product_id in known:
+            have[product_id] = current.get(product_id) or 0
+            base, delta = changes[product_id]
+            wanted[product_id] = min(max((have[product_id] if base is None else base) + delta, 0), MAX_QUANTITY)
+
+    # Every line's hold moves in one batch; lines that stock can only partly cover get a second
+    # batch for what is left. hold_many locks the counters in product order, as hold() does
+    granted = dict(have)
+    holds = inventory.hold_many(session, user_id, {p: wanted[p] for p in wanted if wanted[p] != have[p]},
+                                hold_ttl)
+    partial = {}
+    for product_id, (held, left) in holds.items():
+        if held:
+            granted[product_id] = wanted[product_id]
+        elif left > have[product_id]:
+            partial[product_id] = left
+    for product_id, (held, _) in inventory.hold_many(session, user_id, partial, hold_ttl).items():
+        if held:
+            granted[product_id] = partial[product_id]
+
+    results, quantities, removed = [], {}, []
+    for product_id in product_ids:
+        if product_id not in known:
+            results.append(LineResult(product_id, error='not found'))
+            continue
+        quantity = granted[product_id]
+        if quantity != have[product_id]:
+            if quantity:
+                quantities[product_id] = quantity
+            elif product_id in current:
+                removed.append(product_id)
+        results.append(LineResult(product_id, wanted[product_id], quantity))
+
+    _write(session, user_id, quantities, set(current), removed)
+    return results, False
+
+
+def prune_tokens(session, older_than=TOKEN_TTL):
+    """Forget idempotency tokens older than ``older_than``; clients only retry for seconds. Doesn't commit."""
+    return session.execute(
+        delete(CartUpdateToken).where(CartUpdateToken.created_at < datetime.utcnow() - older_than)
+    ).rowcount
@@ -0,0 +1,233 @@
+import csv
+import io
+import json
+from types import SimpleNamespace
+
+from sqlalchemy import select, insert, update, text
+from sqlalchemy.dialects import postgresql, sqlite
+from werkzeug.datastructures import MultiDict
+
+from create_db import Product, Category
+
+FIELDS = ('id', 'name', 'description', 'price', 'discount', 'stock_quantity', 'image_url', 'category')
+FORMATS = ('csv', 'jsonl')
+DEFAULT_BATCH_SIZE = 1000
+
+
+class ImportReport:
+    def __init__(self):
+        self.read = 0
+        self.inserted = 0
+        self.updated = 0
+        self.errors = []  # (line number, messages), capped at max_errors
+        self.failed = 0
+        self.max_errors = 1000
+
+    def add_error(self, line, messages):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line, messages))
+
+    def as_dict(self):
+        return {
+            'read': self.read,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'failed': self.failed,
+            'errors': [{'line': line, 'errors': messages} for line, messages in self.errors],
+        }
+
+
+def read_rows(stream, fmt):
+    """Yield ``(line_number, row_dict)`` from a text stream without loading it all."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                yield line_number, {'__error__': 'invalid JSON: %s' % exc}
+                continue
+            yield line_number, row if isinstance(row, dict) else {'__error__': 'expected a JSON object'}
+    else:
+        raise ValueError('format must be one of %s' % ', '.join(FORMATS))
+
+
+def category_lookup(session):
+    """Map lower-cased category names (and ids as strings) to ids, flagging names used twice."""
+    by_name = {}
+    for id, name in session.execute(select(Category.id, Category.name)):
+        key = (name or '').strip().lower()
+        by_name[key] = None if key in by_name else id
+        by_name[str(id)] = id
+    return by_name
+
+
+class RowValidator:
+    """Validates import rows with the admin ProductForm so bulk loads obey the same rules."""
+
+    def __init__(self, form_class, categories):
+        self.form_class = form_class
+        self.categories = categories
+        self.choices = [(id, str(id)) for key, id in categories.items() if id is not None and key == str(id)]
+
+    def __call__(self, row):
+        if '__error__' in row:
+            return None, [row['__error__']]
+        category = str(row.get('category') or row.get('category_id') or '').strip()
+        category_id = self.categories.get(category.lower())
+        if category and category.lower() in self.categories and category_id is None:
+            return None, ['category %r matches more than one category' % category]
+        if category_id is None:
+            return None, ['unknown category %r' % category]
+
+        data = MultiDict({k: '' if row.get(k) is None else str(row.get(k))
+                          for k in ('name', 'description', 'price', 'discount', 'stock_quantity', 'image_url')})
+        data['category_id'] = str(category_id)
+        form = self.form_class(formdata=data, meta={'csrf': False})
+        form.category_id.choices = self.choices
+        if not form.validate():
+            return None, ['%s: %s' % (field, '; '.join(messages)) for field, messages in form.errors.items()]
+
+        values = {
+            'name': form.name.data,
+            'description': form.description.data,
+            'price': form.price.data,
+            'discount': form.discount.data,
+            'stock_quantity': form.stock_quantity.data,
+            'image_url': form.image_url.data,
+            'category_id': category_id,
+        }
+        raw_id = str(row.get('id') or '').strip()
+        if raw_id:
+            try:
+                values['id'] = int(raw_id)
+            except ValueError:
+                return None, ['id must be an integer, got %r' % raw_id]
+        return values, []
+
+
+def _upsert(session, rows):
+    """Write one batch; returns (inserted, updated, products written with their ids)."""
+    dialect = session.get_bind(Product).dialect
+    table = Product.__table__
+    keyed = [r for r in rows if 'id' in r]
+    fresh = [r for r in rows if 'id' not in r]
+    written = []
+    updated = 0
+
+    if keyed:
+        existing = set(session.execute(
+            select(table.c.id).where(table.c.id.in_([r['id'] for r in keyed]))
+        ).scalars())
+        updated = len(existing)
+        if dialect.name in ('sqlite', 'postgresql'):
+            dialect_insert = sqlite.insert if dialect.name == 'sqlite' else postgresql.insert
+            stmt = dialect_insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.id],
+                set_={c: stmt.excluded[c] for c in rows[0] if c != 'id'},
+            )
+            session.execute(stmt, keyed)
+        else:
+            to_update = [r for r in keyed if r['id'] in existing]
+            if to_update:
+                session.execute(update(Product), to_update)
+            to_insert = [r for r in keyed if r['id'] not in existing]
+            if to_insert:
+                session.execute(insert(table), to_insert)
+        written.extend(keyed)
+
+    if keyed and dialect.name == 'postgresql':
+        # Explicit ids don't advance the serial sequence; move it past them
+        session.execute(text(
+            "SELECT setval(pg_get_serial_sequence('products', 'id'), (SELECT max(id) FROM products))"
+        ))
+
+    if fresh:
+        if dialect.insert_executemany_returning_sort_by_parameter_order:
+            ids = session.execute(
+                insert(table).returning(table.c.id, sort_by_parameter_order=True), fresh
+            ).scalars().all()
+        else:
+            ids = [session.execute(insert(table), row).inserted_primary_key[0] for row in fresh]
+        for row, id in zip(fresh, ids):
+            written.append(dict(row, id=id))
+
+    return len(rows) - updated, updated, [SimpleNamespace(**r) for r in written]
+
+
+def import_products(session, rows, form_class, batch_size=DEFAULT_BATCH_SIZE, on_batch=None, on_progress=None,
+                    on_error=None):
+    """Validate and upsert products from ``read_rows`` output in batched transactions.
+
+    Rows with an ``id`` update that product (or create it with that id); rows
+    without one are inserted. Each batch is committed on its own, after
+    ``on_batch(session, products)`` has run inside its transaction so callers
+    can keep search indexes and cache versions in step. ``on_error(line, row,
+    messages)`` sees every rejected row; the report only keeps the first ones.
+    """
+    report = ImportReport()
+    validate = RowValidator(form_class, category_lookup(session))
+    batch = []
+
+    def flush():
+        inserted, updated, written = _upsert(session, batch)
+        if on_batch:
+            on_batch(session, written)
+        session.commit()
+        report.inserted += inserted
+        report.updated += updated
+        del batch[:]
+        if on_progress:
+            on_progress(report)
+
+    for line, row in rows:
+        report.read += 1
+        values, errors = validate(row)
+        if errors:
+            report.add_error(line, errors)
+            if on_error:
+                on_error(line, row, errors)
+            continue
+        batch.append(values)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return report
+
+
+def export_products(session, fmt, chunk_rows=DEFAULT_BATCH_SIZE):
+    """Yield the catalog as CSV or JSON Lines text chunks, streamed from a server-side cursor."""
+    if fmt not in FORMATS:
+        raise ValueError('format must be one of %s' % ', '.join(FORMATS))
+    result = session.execute(
+        select(Product.id, Product.name, Product.description, Product.price, Product.discount,
+               Product.stock_quantity, Product.image_url, Category.name)
+        .outerjoin(Category, Product.category_id == Category.id)
+        .order_by(Product.id)
+        .execution_options(yield_per=chunk_rows)
+    )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == 'csv':
+        writer.writerow(FIELDS)
+    for partition in result.partitions():
+        for row in partition:
+            values = list(row)
+            values[3] = None if values[3] is None else str(values[3])
+            if fmt == 'csv':
+                writer.writerow(values)
+            else:
+                buffer.write(json.dumps(dict(zip(FIELDS, values))) + '\n')
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,359 @@
+"""Read-only catalog snapshot in a memory-mapped file shared by every worker process on a host.
+
+Products are stored column by column as flat integer arrays (money in cents,
+times in microseconds) plus one table of interned strings, and are ordered
+ahead of time by (created_at, id) and (effective_price, id), overall and per
+category. Workers map the file read-only, so the pages are shared through the
+OS page cache instead of every worker holding its own ORM copies; rows only
+become Python objects when a page of them is rendered.
+
+One file is written per (catalog, category) version pair, to a temporary name
+and then renamed, so a worker maps either a complete old snapshot or a
+complete new one. The file uses native byte order and is only meant for the
+host that wrote it; a tmpfs directory such as /dev/shm keeps it in memory.
+"""
+import bisect
+import glob
+import heapq
+import io
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR
+
+from sqlalchemy import select
+
+from create_db import Product, Category
+from category_tree import VERSION_KEY as CATEGORY_VERSION_KEY
+from pagination import Page, clamp_per_page, decode_cursor, encode_cursor
+from response_cache import CATALOG_VERSION_KEY
+import versions
+
+MAGIC = b'CATSNAP1'
+EPOCH = datetime(1970, 1, 1)
+NULL = -1             # a missing string, or a missing price (prices are never negative)
+NULL_TIME = -2 ** 62  # missing created_at sorts first, as NULL does on SQLite
+# Snapshots superseded this long ago are deleted; any worker still mapping one keeps its pages
+PRUNE_AFTER = 600
+# Marks a snapshot as replaced by a newer one; the marker's mtime is when that happened
+SUPERSEDED = '.superseded'
+OPEN_ATTEMPTS = 3
+
+
+class SnapshotCategory:
+    __slots__ = ('id', 'name')
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+class SnapshotProduct:
+    """One product row read out of a snapshot, with the attributes the catalog templates use."""
+    __slots__ = ('id', 'name', 'description', 'price', 'discount', 'effective_price', 'stock_quantity',
+                 'image_url', 'category_id', 'category', 'created_at')
+
+
+def _cents(value):
+    return NULL if value is None else int((Decimal(value) * 100).to_integral_value())
+
+
+def _money(cents):
+    return None if cents == NULL else Decimal(cents).scaleb(-2)
+
+
+def _micros(value):
+    return NULL_TIME if value is None else (value - EPOCH) // timedelta(microseconds=1)
+
+
+def _datetime(micros):
+    return None if micros == NULL_TIME else EPOCH + timedelta(microseconds=micros)
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _unlink(*paths):
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass  # another worker pruned it first
+
+
+def _grouped(order, categories):
+    """Rows of ``order`` regrouped by category, keeping their order within each: (ids, offsets, rows)."""
+    rows = sorted(order, key=categories.__getitem__)  # stable, so each group stays in `order` order
+    ids, offsets = array('q'), array('q')
+    for position, row in enumerate(rows):
+        if not ids or ids[-1] != categories[row]:
+            ids.append(categories[row])
+            offsets.append(position)
+    offsets.append(len(rows))
+    return ids, offsets, array('i', rows)
+
+
+def build(session, catalog_version=0, category_version=0):
+    """Serialise the current catalog into snapshot bytes, in one query."""
+    result = session.execute(
+        select(Product.id, Product.name, Product.description, Product.price, Product.discount,
+               Product.effective_price, Product.stock_quantity, Product.image_url, Product.category_id,
+               Product.created_at, Category.name)
+        .outerjoin(Category, Category.id == Product.category_id)
+        .order_by(Product.id)
+    )
+    columns = {name: array(typecode) for name, typecode in (
+        ('id', 'q'), ('price', 'q'), ('effective_price', 'q'), ('discount', 'i'), ('stock', 'q'),
+        ('category_id', 'q'), ('created_at', 'q'), ('name', 'i'), ('description', 'i'), ('image_url', 'i'),
+    )}
+    strings, blob, string_offsets = {}, io.BytesIO(), array('q', [0])
+    category_names = {}
+
+    def intern(value):
+        if value is None:
+            return NULL
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings)
+            blob.write(value.encode('utf-8'))
+            string_offsets.append(blob.tell())
+        return index
+
+    for (id, name, description, price, discount, effective_price, stock, image_url, category_id, created_at,
+         category_name) in result:
+        columns['id'].append(id)
+        columns['price'].append(_cents(price))
+        columns['effective_price'].append(_cents(effective_price if effective_price is not None else price))
+        columns['discount'].append(discount or 0)
+        columns['stock'].append(stock or 0)
+        columns['category_id'].append(category_id or 0)
+        columns['created_at'].append(_micros(created_at))
+        columns['name'].append(intern(name))
+        columns['description'].append(intern(description))
+        columns['image_url'].append(intern(image_url))
+        if category_id is not None:
+            category_names[category_id] = category_name
+
+    ids, created, prices, categories = (columns['id'], columns['created_at'], columns['effective_price'],
+                                        columns['category_id'])
+    by_created = sorted(range(len(ids)), key=lambda row: (created[row], ids[row]))
+    by_price = sorted(range(len(ids)), key=lambda row: (prices[row], ids[row]))
+    columns['by_created'] = array('i', by_created)
+    columns['by_price'] = array('i', by_price)
+    columns['group_ids'], columns['group_offsets'], columns['group_by_created'] = _grouped(by_created, categories)
+    _, _, columns['group_by_price'] = _grouped(by_price, categories)
+    columns['category_ids'] = array('q', sorted(category_names))
+    columns['category_names'] = array('i', (intern(category_names[c]) for c in columns['category_ids']))
+    columns['string_offsets'] = string_offsets
+    columns['strings'] = array('B', blob.getvalue())
+
+    sections, offset, parts = {}, 0, []
+    for name, values in columns.items():
+        data = values.tobytes()
+        # Offsets count from the end of the header; padding keeps every section aligned for cast()
+        sections[name] = [offset, values.typecode, len(values)]
+        parts.append(data + b'\0' * (-len(data) % 8))
+        offset += len(parts[-1])
+    header = json.dumps({'catalog_version': catalog_version, 'category_version': category_version,
+                         'products': len(ids), 'sections': sections}).encode()
+    prefix = MAGIC + struct.pack('<I', len(header)) + header
+    return prefix + b'\0' * (-len(prefix) % 8) + b''.join(parts)
+
+
+class CatalogSnapshot:
+    """A snapshot file mapped read-only. Columns are zero-copy views into the mapping."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError("%s is not a catalog snapshot" % path)
+        (length,) = struct.unpack_from('<I', self._map, len(MAGIC))
+        start = len(MAGIC) + 4
+        header = json.loads(self._map[start:start + length])
+        data = start + length + (-(start + length) % 8)
+        self.path = path
+        self.versions = (header['catalog_version'], header['category_version'])
+        self.size = len(self._map)
+        view = memoryview(self._map)
+        for name, (offset, typecode, count) in header['sections'].items():
+            itemsize = array(typecode).itemsize
+            setattr(self, name, view[data + offset:data + offset + count * itemsize].cast(typecode))
+        self.categories = {id: SnapshotCategory(id, self._string(name))
+                           for id, name in zip(self.category_ids, self.category_names)}
+
+    def __len__(self):
+        return len(self.id)
+
+    def _string(self, index):
+        if index == NULL:
+            return None
+        return str(self.strings[self.string_offsets[index]:self.string_offsets[index + 1]], 'utf-8')
+
+    def product(self, row):
+        product = SnapshotProduct()
+        product.id = self.id[row]
+        product.name = self._string(self.name[row])
+        product.description = self._string(self.description[row])
+        product.price = _money(self.price[row])
+        product.discount = self.discount[row]
+        product.effective_price = _money(self.effective_price[row])
+        product.stock_quantity = self.stock[row]
+        product.image_url = self._string(self.image_url[row])
+        product.category_id = self.category_id[row] or None
+        product.category = self.categories.get(self.category_id[row])
+        product.created_at = _datetime(self.created_at[row])
+        return product
+
+    def _ranges(self, by_price, category_ids):
+        """(rows, lo, hi) slices to read, one per category, each sorted by the chosen key."""
+        if category_ids is None:
+            return [(self.by_price if by_price else self.by_created, 0, len(self.id))]
+        rows = self.group_by_price if by_price else self.group_by_created
+        ranges = []
+        for category_id in category_ids:
+            group = bisect.bisect_left(self.group_ids, category_id)
+            if group < len(self.group_ids) and self.group_ids[group] == category_id:
+                ranges.append((rows, self.group_offsets[group], self.group_offsets[group + 1]))
+        return ranges
+
+    def keyset_page(self, columns, cursor=None, per_page=None, descending=True, category_ids=None,
+                    min_price=None, max_price=None):
+        """Same page, cursor format and filters as pagination.keyset_page over Product with
+        ``Product.category_id.in_(category_ids)`` and effective price bounds, without a query.
+
+        ``columns`` is (Product.created_at, Product.id) or (Product.effective_price, Product.id).
+        """
+        per_page = clamp_per_page(per_page)
+        by_price = columns[0].key == 'effective_price'
+        primary = self.effective_price if by_price else self.created_at
+        ids = self.id
+
+        def key(row):
+            return primary[row], ids[row]
+
+        # Bounds in cents; a product without a price never matches a price filter, as NULL doesn't in SQL
+        low = None if min_price is None else max(int(min_price.scaleb(2).to_integral_value(ROUND_CEILING)), 0)
+        high = None if max_price is None else int(max_price.scaleb(2).to_integral_value(ROUND_FLOOR))
+        if high is not None and low is None:
+            low = 0
+        values = decode_cursor(cursor, columns)
+        after = None
+        if values is not None:
+            after = ((_cents(values[0]) if by_price else _micros(values[0])), values[1])
+
+        streams = []
+        for rows, lo, hi in self._ranges(by_price, category_ids):
+            if by_price and low is not None:
+                lo = bisect.bisect_left(rows, (low, -1), lo, hi, key=key)
+            if by_price and high is not None:
+                hi = bisect.bisect_right(rows, (high, 2 ** 63), lo, hi, key=key)
+            if after is not None:
+                if descending:
+                    hi = bisect.bisect_left(rows, after, lo, hi, key=key)
+                else:
+                    lo = bisect.bisect_right(rows, after, lo, hi, key=key)
+            positions = range(hi - 1, lo - 1, -1) if descending else range(lo, hi)
+            streams.append(map(rows.__getitem__, positions))
+        merged = streams[0] if len(streams) == 1 else heapq.merge(*streams, key=key, reverse=descending)
+
+        found = []
+        prices = self.effective_price
+        for row in merged:
+            if not by_price and low is not None and (prices[row] < low or (high is not None and prices[row] > high)):
+                continue
+            found.append(row)
+            if len(found) > per_page:
+                break
+
+        items = [self.product(row) for row in found[:per_page]]
+        next_cursor = None
+        if len(found) > per_page:
+            last = items[-1]
+            next_cursor = encode_cursor([getattr(last, c.key) for c in columns])
+        return Page(items, next_cursor, per_page)
+
+
+class SnapshotCache:
+    """The current snapshot for this process, swapped when the catalog or category version moves.
+
+    Versions are re-read at most every ``check_interval`` seconds. The first
+    worker to see a new version builds its file; the others map that file.
+    """
+
+    def __init__(self, directory, check_interval=5.0):
+        self.directory = directory
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.checked_at = 0.0
+
+    def path_for(self, catalog_version, category_version):
+        return os.path.join(self.directory, 'catalog-%d-%d.snap' % (catalog_version, category_version))
+
+    def get(self, session):
+        snapshot = self.snapshot
+        if snapshot is not None and time.monotonic() - self.checked_at < self.check_interval:
+            return snapshot
+        with self.lock:
+            for attempt in range(OPEN_ATTEMPTS):
+                stamps = versions.current_many(session, (CATALOG_VERSION_KEY, CATEGORY_VERSION_KEY))
+                wanted = (stamps[CATALOG_VERSION_KEY][0], stamps[CATEGORY_VERSION_KEY][0])
+                if self.snapshot is not None and self.snapshot.versions == wanted:
+                    break
+                path = self.path_for(*wanted)
+                try:
+                    if not os.path.exists(path):
+                        _write_atomic(path, build(session, *wanted))
+                        self._prune(path)
+                    # Requests still holding the old snapshot keep it mapped until they finish
+                    self.snapshot = CatalogSnapshot(path)
+                    break
+                except FileNotFoundError:
+                    # Another worker pruned it between the check and the open; look at the versions again
+                    if attempt == OPEN_ATTEMPTS - 1:
+                        raise
+            self.checked_at = time.monotonic()
+            return self.snapshot
+
+    def invalidate(self):
+        self.snapshot = None
+
+    def _prune(self, keep):
+        """Mark every snapshot but ``keep`` as superseded, and delete those superseded PRUNE_AFTER ago.
+
+        A file's own mtime is when it was written, which says nothing about how
+        long workers may still be switching away from it, so the clock starts
+        when a newer snapshot replaces it.
+        """
+        cutoff = time.time() - PRUNE_AFTER
+        _unlink(keep + SUPERSEDED)  # left over if the versions ever went backwards
+        for path in glob.glob(os.path.join(self.directory, 'catalog-*.snap')):
+            if path == keep:
+                continue
+            marker = path + SUPERSEDED
+            try:
+                superseded_at = os.path.getmtime(marker)
+            except FileNotFoundError:
+                open(marker, 'a').close()  # 'a' leaves an existing marker's time alone
+                continue
+            if superseded_at < cutoff:
+                _unlink(path, marker)
+        for marker in glob.glob(os.path.join(self.directory, 'catalog-*.snap' + SUPERSEDED)):
+            if not os.path.exists(marker[:-len(SUPERSEDED)]):
+                _unlink(marker)
@@ -0,0 +1,119 @@
+import threading
+import time
+
+from sqlalchemy import select
+
+from create_db import Category
+import versions
+
+VERSION_KEY = "categories"
+
+
+class CategoryNode:
+    __slots__ = ("id", "name", "parent_id")
+
+    def __init__(self, id, name, parent_id):
+        self.id = id
+        self.name = name
+        self.parent_id = parent_id
+
+
+class CategoryTree:
+    """Immutable snapshot of the category hierarchy with precomputed lookups."""
+
+    def __init__(self, rows, version=0):
+        self.version = version
+        self.nodes = {}
+        self.children = {}
+        for id, name, parent_id in rows:
+            self.nodes[id] = CategoryNode(id, name, parent_id)
+            self.children[id] = []
+        self.roots = []
+        for node in self.nodes.values():
+            # A dangling parent_id is treated as a root rather than dropping the category
+            if node.parent_id in self.nodes and node.parent_id != node.id:
+                self.children[node.parent_id].append(node.id)
+            else:
+                self.roots.append(node.id)
+
+        self.ancestors = {}
+        self.descendants = {}
+        for root in self.roots:
+            self._walk(root)
+        # Nodes only reachable through a parent_id cycle never hang off a root
+        for id in self.nodes:
+            if id not in self.ancestors:
+                self._walk(id)
+
+    def _walk(self, root):
+        # Iterative DFS: fills ancestor chains on the way down and descendant sets on the way up
+        self.ancestors[root] = ()
+        stack = [(root, False)]
+        while stack:
+            id, done = stack.pop()
+            if done:
+                subtree = {id}
+                for child in self.children[id]:
+                    subtree |= self.descendants.get(child, frozenset())
+                self.descendants[id] = frozenset(subtree)
+                continue
+            stack.append((id, True))
+            chain = self.ancestors[id] + (id,)
+            for child in self.children[id]:
+                if child not in self.ancestors:
+                    self.ancestors[child] = chain
+                    stack.append((child, False))
+
+    def get(self, id):
+        return self.nodes.get(id)
+
+    def ordered(self):
+        return sorted(self.nodes.values(), key=lambda n: n.id)
+
+    def children_of(self, id):
+        return [self.nodes[c] for c in self.children.get(id, ())]
+
+    def ancestors_of(self, id):
+        # Root first, excluding the category itself
+        return [self.nodes[a] for a in self.ancestors.get(id, ())]
+
+    def subtree_ids(self, id):
+        # The category itself plus every category below it
+        return self.descendants.get(id, frozenset())
+
+
+class CategoryTreeCache:
+    """Per-process category tree, rebuilt when the shared version stamp moves.
+
+    The stamp is re-read at most every ``check_interval`` seconds, so between
+    checks reading the tree costs no queries at all.
+    """
+
+    def __init__(self, check_interval=5.0):
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.tree = None
+        self.checked_at = 0.0
+
+    def get(self, session):
+        tree = self.tree
+        if tree is not None and time.monotonic() - self.checked_at < self.check_interval:
+            return tree
+        with self.lock:
+            version, _ = versions.current(session, VERSION_KEY)
+            if self.tree is None or self.tree.version != version:
+                rows = session.execute(select(Category.id, Category.name, Category.parent_id)).all()
+                self.tree = CategoryTree(rows, version)
+            self.checked_at = time.monotonic()
+            return self.tree
+
+    def invalidate(self):
+        self.tree = None
+
+
+def subtree_query(category_id):
+    # WITH RECURSIVE equivalent of CategoryTree.subtree_ids, for when the id set
+    # is too large to inline as an IN list
+    subtree = select(Category.id).where(Category.id == category_id).cte("subtree", recursive=True)
+    subtree = subtree.union_all(select(Category.id).where(Category.parent_id == subtree.c.id))
+    return select(subtree.c.id)
@@ -1,6 +1,6 @@
 from sqlalchemy import (
     Column, Integer, String, ForeignKey, Text, Boolean,
-    DECIMAL, DateTime
+    DECIMAL, DateTime, Date, Index, UniqueConstraint
 )
 from sqlalchemy.orm import relationship, DeclarativeBase, mapped_column, Mapped
 from datetime import datetime
@@ -8,6 +8,8 @@ import os
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 
+from money import discounted_unit_price
+
 
 class Base(DeclarativeBase):
     pass
@@ -36,6 +38,11 @@ class Category(Base):
     subcategories = relationship("Category")
     products = relationship("Product", back_populates="category")
 
+def _initial_effective_price(context):
+    # Inserts start from the product's own discount; pricing.reprice() layers running sales on top
+    params = context.get_current_parameters()
+    return discounted_unit_price(params.get('price'), params.get('discount'))
+
 class Product(Base):
     __tablename__ = 'products'
 
@@ -48,11 +55,22 @@ class Product(Base):
     image_url = Column(String)
     category_id = Column(Integer, ForeignKey('categories.id'))
     created_at = Column(DateTime, default=datetime.utcnow)
+    # price after the product discount or a running sale; maintained by pricing.py
+    effective_price = Column(DECIMAL(10, 2), default=_initial_effective_price)
 
     category = relationship("Category", back_populates="products")
     order_items = relationship("OrderItem", back_populates="product")
     cart_items = relationship("CartItem", back_populates="product")
 
+    # Keyset pagination on the catalog walks (created_at, id) or (effective_price, id),
+    # optionally within a category
+    __table_args__ = (
+        Index('ix_products_created_at_id', 'created_at', 'id'),
+        Index('ix_products_category_id_created_at_id', 'category_id', 'created_at', 'id'),
+        Index('ix_products_effective_price_id', 'effective_price', 'id'),
+        Index('ix_products_category_id_effective_price_id', 'category_id', 'effective_price', 'id'),
+    )
+
 class Order(Base):
     __tablename__ = 'orders'
 
@@ -69,6 +87,12 @@ class Order(Base):
     user = relationship("User", back_populates="orders")
     items = relationship("OrderItem", back_populates="order")
 
+    __table_args__ = (
+        Index('ix_orders_created_at_id', 'created_at', 'id'),
+        Index('ix_orders_status_created_at_id', 'status', 'created_at', 'id'),
+        Index('ix_orders_user_id_created_at', 'user_id', 'created_at'),
+    )
+
 class OrderItem(Base):
     __tablename__ = 'order_items'
 
@@ -93,6 +117,23 @@ class CartItem(Base):
     user = relationship("User", back_populates="cart_items")
     product = relationship("Product", back_populates="cart_items")
 
+    __table_args__ = (
+        # One line per product per cart, so batched cart updates can upsert on it
+        Index('ux_cart_items_user_id_product_id', 'user_id', 'product_id', unique=True),
+    )
+
+class CartUpdateToken(Base):
+    __tablename__ = 'cart_update_tokens'
+
+    # Idempotency tokens of applied cart API batches; a retried batch with the same token is a no-op
+    user_id = Column(Integer, primary_key=True)
+    token = Column(String(64), primary_key=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_cart_update_tokens_created_at', 'created_at'),
+    )
+
 
 class Address(Base):
     __tablename__ = 'addresses'
@@ -115,5 +156,161 @@ class Address(Base):
     orders = relationship("Order", back_populates="address")
 
 
+class SchemaMigration(Base):
+    __tablename__ = 'schema_migrations'
+
+    # One row per migration in migrations.MIGRATIONS that has been applied
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String(100), nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+class CacheVersion(Base):
+    __tablename__ = 'cache_versions'
+
+    # One row per cached data set (e.g. 'categories'); writers bump it, readers compare it
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class PriceSchedule(Base):
+    __tablename__ = 'price_schedules'
+
+    # A sale: `discount` percent off between starts_at and ends_at (open-ended when NULL), for one
+    # product, a category and everything under it, or the whole catalog when both are NULL
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100))
+    discount = Column(Integer, nullable=False)
+    product_id = Column(Integer, ForeignKey('products.id'))
+    category_id = Column(Integer, ForeignKey('categories.id'))
+    starts_at = Column(DateTime, nullable=False)
+    ends_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_price_schedules_starts_at', 'starts_at'),
+        Index('ix_price_schedules_ends_at', 'ends_at'),
+    )
+
+class ProductImage(Base):
+    __tablename__ = 'product_images'
+
+    # Thumbnails built from one image_url; `digest` names their directory in the image store
+    id = Column(Integer, primary_key=True)
+    source_url = Column(String(2048), nullable=False, unique=True)
+    digest = Column(String(64))
+    width = Column(Integer)
+    height = Column(Integer)
+    widths = Column(String(100))  # comma-separated thumbnail widths that exist on disk
+    error = Column(Text)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class StockReservation(Base):
+    __tablename__ = 'stock_reservations'
+
+    # A cart's hold on stock until expires_at; see inventory.py
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, ForeignKey('products.id'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'product_id', name='uq_stock_reservations_user_product'),
+        Index('ix_stock_reservations_expires_at', 'expires_at'),
+        Index('ix_stock_reservations_product_id', 'product_id'),
+    )
+
+class StockCounter(Base):
+    __tablename__ = 'stock_counters'
+
+    # Sum of stock_reservations.quantity per product, kept in step by inventory.py
+    product_id = Column(Integer, ForeignKey('products.id'), primary_key=True)
+    reserved = Column(Integer, nullable=False, default=0)
+
+class Job(Base):
+    __tablename__ = 'jobs'
+
+    # Background work queued by requests (see jobs.py); rows are claimed by `flask jobs worker`
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100), nullable=False)
+    payload = Column(Text, nullable=False, default='{}')  # JSON keyword arguments for the task
+    status = Column(String(20), nullable=False, default='queued')  # queued, running, done, failed
+    idempotency_key = Column(String(200), unique=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = Column(String(100))
+    locked_at = Column(DateTime)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
+
+    # Workers poll for the oldest due job in a status
+    __table_args__ = (
+        Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+
+# Sales summaries maintained by analytics.refresh(); dashboards read these instead of the order history.
+# Money is stored in full units like the rest of the schema; ids of deleted rows are kept as-is.
+
+class AnalyticsOrdersDaily(Base):
+    __tablename__ = 'analytics_orders_daily'
+
+    day = Column(Date, primary_key=True)
+    payment_method = Column(String(50), primary_key=True)  # '' when unknown
+    status = Column(String(20), primary_key=True)          # title-cased, e.g. 'Cancelled'
+    orders = Column(Integer, nullable=False, default=0)
+    revenue = Column(DECIMAL(14, 2), nullable=False, default=0)
+
+class AnalyticsCategoriesDaily(Base):
+    __tablename__ = 'analytics_categories_daily'
+
+    # Cancelled orders are left out; gross is the list price the line would have cost without discount
+    day = Column(Date, primary_key=True)
+    category_id = Column(Integer, primary_key=True)  # 0 for products without a category
+    units = Column(Integer, nullable=False, default=0)
+    gross = Column(DECIMAL(14, 2), nullable=False, default=0)
+    revenue = Column(DECIMAL(14, 2), nullable=False, default=0)
+    discounted_units = Column(Integer, nullable=False, default=0)
+    discounted_revenue = Column(DECIMAL(14, 2), nullable=False, default=0)
+
+class AnalyticsProductsDaily(Base):
+    __tablename__ = 'analytics_products_daily'
+
+    day = Column(Date, primary_key=True)
+    product_id = Column(Integer, primary_key=True)
+    units = Column(Integer, nullable=False, default=0)
+    gross = Column(DECIMAL(14, 2), nullable=False, default=0)
+    revenue = Column(DECIMAL(14, 2), nullable=False, default=0)
+
+class AnalyticsState(Base):
+    __tablename__ = 'analytics_state'
+
+    # Watermark of the summaries: everything up to last_order_id is counted, and orders from
+    # reopen_order_id on were still open at the last refresh, so their days are recomputed
+    name = Column(String(50), primary_key=True)
+    last_order_id = Column(Integer, nullable=False, default=0)
+    reopen_order_id = Column(Integer)
+    refreshed_at = Column(DateTime)
+
+
+# Co-purchase index maintained by recommendations.refresh(). Pairs are stored in both directions
+# so each product's neighbours are a prefix scan of the primary key.
+
+class CoPurchaseCount(Base):
+    __tablename__ = 'co_purchase_counts'
+
+    product_id = Column(Integer, primary_key=True)
+    other_id = Column(Integer, primary_key=True)
+    orders = Column(Integer, nullable=False, default=0)  # orders containing both products
 
+class ProductRecommendation(Base):
+    __tablename__ = 'product_recommendations'
 
+    # The top few co_purchase_counts rows per product; the storefront only reads this table
+    product_id = Column(Integer, primary_key=True)
+    rank = Column(Integer, primary_key=True)  # 1 is bought together most often
+    recommended_id = Column(Integer, nullable=False)
+    orders = Column(Integer, nullable=False)
@@ -0,0 +1,105 @@
+import os
+import time
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool, NullPool
+
+from metrics import pool_checkout_seconds
+
+PROFILES = ('pooled', 'sqlite', 'serverless')
+
+
+class TimedPoolMixin:
+    # Pools expose no "before checkout" event, so time the checkout itself
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_checkout_seconds.observe(time.perf_counter() - start)
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedNullPool(TimedPoolMixin, NullPool):
+    pass
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def select_profile(uri):
+    profile = os.environ.get('DB_PROFILE')
+    if profile:
+        if profile not in PROFILES:
+            raise ValueError("DB_PROFILE must be one of %s, got %r" % (", ".join(PROFILES), profile))
+        return profile
+    if uri.startswith('sqlite'):
+        return 'sqlite'
+    # Vercel sets VERCEL=1; each invocation is short-lived, so leave pooling to an external pooler
+    if os.environ.get('VERCEL'):
+        return 'serverless'
+    return 'pooled'
+
+
+def is_memory_sqlite(uri):
+    return uri in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in uri
+
+
+def engine_options(profile, uri):
+    """Keyword arguments for create_engine (SQLALCHEMY_ENGINE_OPTIONS) for a profile."""
+    if profile == 'pooled':
+        return {
+            'poolclass': TimedQueuePool,
+            'pool_size': _env_int('DB_POOL_SIZE', 5),
+            'max_overflow': _env_int('DB_MAX_OVERFLOW', 10),
+            'pool_timeout': _env_int('DB_POOL_TIMEOUT', 30),
+            'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+            'pool_pre_ping': True,
+        }
+    if profile == 'serverless':
+        # PgBouncer/Supavisor in transaction mode does the pooling; holding
+        # connections in a frozen lambda would only leak them
+        return {'poolclass': TimedNullPool}
+    if is_memory_sqlite(uri):
+        # Flask-SQLAlchemy picks a static pool so the in-memory database survives
+        return {}
+    return {
+        'poolclass': TimedQueuePool,
+        'pool_size': _env_int('DB_POOL_SIZE', 5),
+        'max_overflow': _env_int('DB_MAX_OVERFLOW', 10),
+        'connect_args': {'timeout': _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000) / 1000},
+    }
+
+
+def sqlite_pragmas():
+    return (
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),
+        ('mmap_size', _env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        ('busy_timeout', _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    )
+
+
+def configure_engine(engine, profile):
+    if profile == 'sqlite' and engine.dialect.name == 'sqlite':
+        pragmas = sqlite_pragmas()
+
+        @event.listens_for(engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas:
+                cursor.execute("PRAGMA %s=%s" % (name, value))
+            cursor.close()
+
+
+def pool_status(engine):
+    pool = engine.pool
+    status = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow(),
+                      checked_in=pool.checkedin())
+    return status
@@ -0,0 +1,298 @@
+"""Catalog thumbnails: each image_url is fetched once, resized in a process pool and kept on disk.
+
+Files live under ``<root>/<digest[:2]>/<digest>/`` where ``digest`` is the
+SHA-256 of the original bytes, so a file never changes once written and can be
+served with a year-long cache lifetime. ``product_images`` maps each source URL
+to its digest and the widths that were built.
+"""
+import hashlib
+import http.client
+import io
+import ipaddress
+import multiprocessing
+import os
+import re
+import socket
+import tempfile
+import threading
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from urllib.parse import urlparse, unquote
+
+from sqlalchemy import select, insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from create_db import ProductImage
+
+WIDTHS = (160, 320, 640)
+THUMBNAIL_FORMATS = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+SOURCE_FORMATS = {'JPEG': 'jpeg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+MIMETYPES = dict(THUMBNAIL_FORMATS, png='image/png', gif='image/gif')
+MAX_SOURCE_BYTES = 20 * 1024 * 1024
+FETCH_TIMEOUT = 10
+BUILD_TIMEOUT = 120
+
+_DIGEST = re.compile(r'^[0-9a-f]{64}$')
+_FILE_NAME = re.compile(r'^(?:\d+\.(?:webp|jpeg)|original\.(?:jpeg|png|webp|gif))$')
+# Uploads are stored before their URL is saved, so their thumbnails are built without a fetch
+_STORED_ORIGINAL = re.compile(r'/img/([0-9a-f]{64})/(original\.[a-z]+)$')
+
+
+class ImageStore:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest, name):
+        """Where ``name`` for ``digest`` lives, or None if either isn't one of ours."""
+        if not _DIGEST.match(digest or '') or not _FILE_NAME.match(name or ''):
+            return None
+        return os.path.join(self.root, digest[:2], digest, name)
+
+    def save_original(self, data):
+        """Check ``data`` is an image we can thumbnail and store it. Returns ``(digest, name)``.
+
+        Raises ValueError for anything that isn't a JPEG, PNG, WebP or GIF.
+        """
+        from PIL import Image
+
+        if len(data) > MAX_SOURCE_BYTES:
+            raise ValueError("image is larger than %d MB" % (MAX_SOURCE_BYTES // (1024 * 1024)))
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image.verify()
+                extension = SOURCE_FORMATS.get(image.format)
+        except Exception as exc:  # Pillow raises a variety of types for corrupt files
+            raise ValueError("not a readable image") from exc
+        if extension is None:
+            raise ValueError("unsupported image format")
+        digest = hashlib.sha256(data).hexdigest()
+        name = 'original.' + extension
+        path = self.path(digest, name)
+        if not os.path.exists(path):
+            _write_atomic(path, data)
+        return digest, name
+
+
+def _write_atomic(path, data):
+    # Readers only ever see complete files: write next to the target, then rename over it
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _is_public(address):
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def _connect_public(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+    """socket.create_connection that refuses hosts resolving to private, loopback or link-local addresses.
+
+    The address that was checked is the one connected to, so a second DNS
+    answer can't swap in an internal host between the check and the request.
+    """
+    host, port = address
+    resolved = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    if not resolved or not all(_is_public(sockaddr[0]) for _, _, _, _, sockaddr in resolved):
+        raise ValueError("image host %s is not a public address" % host)
+    return socket.create_connection(resolved[0][4][:2], timeout, source_address)
+
+
+class _PublicHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+
+class _PublicHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_PublicHTTPConnection, req)
+
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_PublicHTTPSConnection, req, context=self._context)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+# image_url is set by admins and imports, so fetching it must not become a way to reach internal
+# services: only public addresses, no redirects (each hop would need the same check) and no
+# proxies from the environment (the proxy would make the request on our behalf, unchecked)
+_fetcher = urllib.request.build_opener(urllib.request.ProxyHandler({}), _PublicHTTPHandler(),
+                                       _PublicHTTPSHandler(), _NoRedirect())
+
+
+def _read_source(url, local_root):
+    parsed = urlparse(url)
+    if parsed.scheme in ('http', 'https'):
+        # A redirect comes back as an HTTPError (an OSError), like any other failed fetch
+        with _fetcher.open(url, timeout=FETCH_TIMEOUT) as response:
+            return response.read(MAX_SOURCE_BYTES + 1)
+    if parsed.scheme in ('', 'file') and local_root:
+        # Local files are only read from under local_root (fixtures in tests, a mounted share in prod)
+        root = os.path.realpath(local_root)
+        path = os.path.realpath(os.path.join(root, unquote(parsed.path).lstrip('/')))
+        if os.path.commonpath([root, path]) != root:
+            raise ValueError("%s is outside the local image root" % url)
+        with open(path, 'rb') as f:
+            return f.read(MAX_SOURCE_BYTES + 1)
+    raise ValueError("unsupported image URL %r" % url)
+
+
+def build_thumbnails(root, url, local_root=None, widths=WIDTHS):
+    """Fetch ``url`` if needed and write its thumbnails. Runs in a pool process.
+
+    Returns ``(digest, width, height, built_widths)``. Thumbnails already on
+    disk are kept, so re-running for the same image is cheap.
+    """
+    # Imported here: the web process only needs Pillow when an admin uploads an image
+    from PIL import Image, ImageOps
+
+    store = ImageStore(root)
+    stored = _STORED_ORIGINAL.search(urlparse(url).path)
+    if stored and store.path(*stored.groups()) and os.path.exists(store.path(*stored.groups())):
+        digest, name = stored.groups()
+    else:
+        digest, name = store.save_original(_read_source(url, local_root))
+
+    with Image.open(store.path(digest, name)) as source:
+        if source.format == 'JPEG':
+            # Let libjpeg decode at a reduced scale: far faster than decoding full size and shrinking
+            source.draft('RGB', (max(widths), max(widths)))
+        image = ImageOps.exif_transpose(source)
+        image.load()
+    width, height = image.size
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+    built = sorted({min(w, width) for w in widths})
+    for w in built:
+        resized = image if w == width else image.resize((w, max(1, round(height * w / width))), Image.LANCZOS)
+        for fmt in THUMBNAIL_FORMATS:
+            path = store.path(digest, '%d.%s' % (w, fmt))
+            if os.path.exists(path):
+                continue
+            out = io.BytesIO()
+            if fmt == 'webp':
+                resized.save(out, 'WEBP', quality=80, method=4)
+            else:
+                flat = resized
+                if resized.mode == 'RGBA':
+                    flat = Image.new('RGB', resized.size, 'white')
+                    flat.paste(resized, mask=resized.getchannel('A'))
+                flat.save(out, 'JPEG', quality=82, optimize=True, progressive=True)
+            _write_atomic(path, out.getvalue())
+    return digest, width, height, built
+
+
+class ThumbnailPool:
+    """Runs build_thumbnails in worker processes, started on first use.
+
+    Resizing is CPU-bound and holds the GIL, so threads would serialise it and
+    slow down everything else in the process.
+    """
+
+    def __init__(self, root, workers=None, local_root=None):
+        self.root = root
+        self.workers = workers
+        self.local_root = local_root
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def build(self, url, timeout=BUILD_TIMEOUT):
+        with self.lock:
+            if self.executor is None:
+                # spawn, not fork: the parent is multi-threaded (job worker, DB pool)
+                self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                    mp_context=multiprocessing.get_context('spawn'))
+            executor = self.executor
+        try:
+            return executor.submit(build_thumbnails, self.root, url, self.local_root).result(timeout)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM on a huge image); start a fresh pool for the next job
+            with self.lock:
+                if self.executor is executor:
+                    self.executor = None
+            raise
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+
+class Thumbnails:
+    __slots__ = ('digest', 'width', 'height', 'widths')
+
+    def __init__(self, digest, width, height, widths):
+        self.digest = digest
+        self.width = width
+        self.height = height
+        self.widths = widths
+
+    @property
+    def default_width(self):
+        # Used for the plain <img src> that browsers without srcset support load
+        return self.widths[len(self.widths) // 2]
+
+
+def lookup(session, urls):
+    """Built thumbnails for each of ``urls`` that has them, in one query: {url: Thumbnails}."""
+    urls = {url for url in urls if url}
+    if not urls:
+        return {}
+    rows = session.execute(
+        select(ProductImage.source_url, ProductImage.digest, ProductImage.width, ProductImage.height,
+               ProductImage.widths)
+        .where(ProductImage.source_url.in_(urls), ProductImage.digest.is_not(None))
+    ).all()
+    return {url: Thumbnails(digest, width, height, [int(w) for w in widths.split(',')])
+            for url, digest, width, height, widths in rows if widths}
+
+
+def missing(session, urls):
+    """The subset of ``urls`` that has never been processed."""
+    urls = {url for url in urls if url}
+    if not urls:
+        return set()
+    known = set(session.execute(
+        select(ProductImage.source_url).where(ProductImage.source_url.in_(urls))
+    ).scalars())
+    return urls - known
+
+
+def record(session, url, digest=None, width=None, height=None, widths=(), error=None):
+    """Store the outcome of building ``url`` inside the caller's transaction."""
+    values = {
+        'digest': digest, 'width': width, 'height': height,
+        'widths': ','.join(str(w) for w in widths) or None,
+        'error': error, 'updated_at': datetime.utcnow(),
+    }
+    dialect = session.get_bind(ProductImage).dialect
+    if dialect.name in ('sqlite', 'postgresql'):
+        dialect_insert = sqlite.insert if dialect.name == 'sqlite' else postgresql.insert
+        stmt = dialect_insert(ProductImage).values(source_url=url, **values)
+        session.execute(stmt.on_conflict_do_update(index_elements=['source_url'], set_=values))
+    elif not session.execute(update(ProductImage).filter_by(source_url=url).values(values)).rowcount:
+        session.execute(insert(ProductImage).values(source_url=url, **values))
@@ -0,0 +1,290 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, insert, delete, func, bindparam, case
+from sqlalchemy.dialects import postgresql, sqlite
+
+from create_db import Product, StockReservation, StockCounter
+
+DEFAULT_HOLD = timedelta(minutes=15)
+SWEEP_BATCH = 1000
+
+
+def held_quantity(product_id_column):
+    """SQL expression for the units currently held in carts for ``product_id_column``."""
+    return func.coalesce(
+        select(StockCounter.reserved).where(StockCounter.product_id == product_id_column).scalar_subquery(), 0
+    )
+
+
+def available(session, product_ids):
+    """Stock minus held units for each product, in one query: {product_id: available}."""
+    if not product_ids:
+        return {}
+    rows = session.execute(
+        select(Product.id, Product.stock_quantity - held_quantity(Product.id))
+        .where(Product.id.in_(set(product_ids)))
+    ).all()
+    return {product_id: max(value or 0, 0) for product_id, value in rows}
+
+
+def levels(session, product_ids):
+    """Stock and available units for each product, in one query: {product_id: [stock, available]}.
+
+    Lists rather than tuples so values read back from a JSON cache compare equal.
+    """
+    if not product_ids:
+        return {}
+    rows = session.execute(
+        select(Product.id, Product.stock_quantity, Product.stock_quantity - held_quantity(Product.id))
+        .where(Product.id.in_(set(product_ids)))
+    ).all()
+    return {product_id: [stock or 0, max(value or 0, 0)] for product_id, stock, value in rows}
+
+
+def _ensure_counters(session, product_ids):
+    dialect = session.get_bind(StockCounter).dialect
+    if dialect.name in ('sqlite', 'postgresql'):
+        dialect_insert = sqlite.insert if dialect.name == 'sqlite' else postgresql.insert
+        session.execute(dialect_insert(StockCounter).values([{'product_id': product_id, 'reserved': 0}
+                                                             for product_id in product_ids])
+                        .on_conflict_do_nothing(index_elements=['product_id']))
+        return
+    existing = set(session.execute(
+        select(StockCounter.product_id).where(StockCounter.product_id.in_(product_ids))).scalars())
+    missing = [product_id for product_id in product_ids if product_id not in existing]
+    if missing:
+        session.execute(insert(StockCounter), [{'product_id': product_id, 'reserved': 0} for product_id in missing])
+
+
+def hold(session, user_id, product_id, quantity, ttl=DEFAULT_HOLD):
+    """Set the user's hold on ``product_id`` to ``quantity`` units for ``ttl`` from now.
+
+    Growing a hold only succeeds while stock minus everyone's holds covers it;
+    the check and the increment are one conditional UPDATE on the counter row,
+    so concurrent carts can't over-reserve. Runs in the caller's transaction.
+    Returns ``(ok, available)``, ``available`` being what could still be held.
+    """
+    now = datetime.utcnow()
+    # Lock our own row before the counter; the sweeper takes them in the same order
+    current = session.execute(
+        select(StockReservation.id, StockReservation.quantity)
+        .filter_by(user_id=user_id, product_id=product_id)
+        .with_for_update()
+    ).first()
+    held = current.quantity if current else 0
+    delta = quantity - held
+
+    if delta > 0:
+        _ensure_counters(session, [product_id])
+        stock = select(Product.stock_quantity).where(Product.id == product_id).scalar_subquery()
+        granted = session.execute(
+            update(StockCounter)
+            .where(StockCounter.product_id == product_id, StockCounter.reserved + delta <= stock)
+            .values(reserved=StockCounter.reserved + delta)
+        ).rowcount
+        if not granted:
+            left = available(session, [product_id]).get(product_id, 0)
+            return False, held + left
+    elif delta < 0:
+        session.execute(
+            update(StockCounter).where(StockCounter.product_id == product_id)
+            .values(reserved=StockCounter.reserved + delta)
+        )
+
+    if quantity <= 0:
+        if current:
+            session.execute(delete(StockReservation).where(StockReservation.id == current.id))
+    elif current:
+        session.execute(
+            update(StockReservation).where(StockReservation.id == current.id)
+            .values(quantity=quantity, expires_at=now + ttl)
+        )
+    else:
+        session.execute(insert(StockReservation).values(
+            product_id=product_id, user_id=user_id, quantity=quantity, expires_at=now + ttl, created_at=now
+        ))
+    return True, None
+
+
+def _grow(session, deltas):
+    """Add ``deltas`` ({product_id: units}) to the counters that stock still covers. Returns those granted."""
+    product_ids = sorted(deltas)
+    stock = select(Product.stock_quantity).where(Product.id == StockCounter.product_id).scalar_subquery()
+    dialect = session.get_bind(StockCounter).dialect
+    if dialect.update_returning:
+        delta = case(deltas, value=StockCounter.product_id, else_=0)
+        return set(session.execute(
+            update(StockCounter)
+            .where(StockCounter.product_id.in_(product_ids), StockCounter.reserved + delta <= stock)
+            .values(reserved=StockCounter.reserved + delta)
+            .returning(StockCounter.product_id)
+        ).scalars())
+    return {product_id for product_id in product_ids if session.execute(
+        update(StockCounter)
+        .where(StockCounter.product_id == product_id, StockCounter.reserved + deltas[product_id] <= stock)
+        .values(reserved=StockCounter.reserved + deltas[product_id])
+    ).rowcount}
+
+
+def hold_many(session, user_id, quantities, ttl=DEFAULT_HOLD):
+    """``hold`` for several products at once: ``quantities`` is {product_id: quantity}.
+
+    Each product is granted or refused exactly as ``hold`` would, but in a
+    fixed number of statements however many products there are. Runs in the
+    caller's transaction. Returns {product_id: (ok, available)}.
+    """
+    if not quantities:
+        return {}
+    now = datetime.utcnow()
+    product_ids = sorted(quantities)
+    current = {row.product_id: row for row in session.execute(
+        select(StockReservation.id, StockReservation.product_id, StockReservation.quantity)
+        .where(StockReservation.user_id == user_id, StockReservation.product_id.in_(product_ids))
+        .order_by(StockReservation.product_id)
+        .with_for_update()
+    )}
+    held = {product_id: current[product_id].quantity if product_id in current else 0 for product_id in product_ids}
+    deltas = {product_id: quantities[product_id] - held[product_id] for product_id in product_ids}
+
+    growing = {product_id: delta for product_id, delta in deltas.items() if delta > 0}
+    changed = [product_id for product_id in product_ids if deltas[product_id]]
+    if growing:
+        _ensure_counters(session, sorted(growing))
+    if changed:
+        # Every counter the batch moves is locked up front in product order, like hold() taking
+        # them one at a time, so two carts changing overlapping products can't deadlock
+        session.execute(select(StockCounter.product_id).where(StockCounter.product_id.in_(changed))
+                        .order_by(StockCounter.product_id).with_for_update())
+    refused = set(growing) - _grow(session, growing) if growing else set()
+    _release_units(session, {product_id: -delta for product_id, delta in deltas.items() if delta < 0})
+
+    results = {product_id: (True, None) for product_id in product_ids}
+    if refused:
+        left = available(session, refused)
+        for product_id in refused:
+            results[product_id] = (False, held[product_id] + left.get(product_id, 0))
+    granted = [product_id for product_id in product_ids if product_id not in refused]
+
+    dropped = [current[p].id for p in granted if quantities[p] <= 0 and p in current]
+    if dropped:
+        session.execute(delete(StockReservation).where(StockReservation.id.in_(dropped)))
+    renewed = [p for p in granted if quantities[p] > 0 and p in current]
+    if renewed:
+        reservations = StockReservation.__table__
+        session.execute(
+            update(reservations).where(reservations.c.id == bindparam('hold_id'))
+            .values(quantity=bindparam('hold_quantity'), expires_at=now + ttl),
+            [{'hold_id': current[p].id, 'hold_quantity': quantities[p]} for p in renewed])
+    added = [p for p in granted if quantities[p] > 0 and p not in current]
+    if added:
+        session.execute(insert(StockReservation), [
+            {'product_id': p, 'user_id': user_id, 'quantity': quantities[p], 'expires_at': now + ttl,
+             'created_at': now} for p in added])
+    return results
+
+
+def release(session, user_id, product_ids=None):
+    """Drop the user's holds (on ``product_ids``, or all of them) inside the caller's transaction."""
+    stmt = select(StockReservation.id, StockReservation.product_id, StockReservation.quantity) \
+        .filter_by(user_id=user_id).with_for_update()
+    if product_ids is not None:
+        stmt = stmt.where(StockReservation.product_id.in_(list(product_ids)))
+    rows = session.execute(stmt).all()
+    _drop(session, rows)
+    return len(rows)
+
+
+def _drop(session, rows):
+    if not rows:
+        return
+    session.execute(delete(StockReservation).where(StockReservation.id.in_([row.id for row in rows])))
+    _decrement(session, rows)
+
+
+def _decrement(session, rows):
+    freed = defaultdict(int)
+    for row in rows:
+        freed[row.product_id] += row.quantity
+    _release_units(session, freed)
+
+
+def _release_units(session, freed):
+    """Take ``freed`` ({product_id: units}) off the counters."""
+    if not freed:
+        return
+    counters = StockCounter.__table__
+    # One executemany in product order, so two transactions releasing overlapping products can't deadlock
+    session.execute(
+        update(counters).where(counters.c.product_id == bindparam('freed_product_id'))
+        .values(reserved=counters.c.reserved - bindparam('freed_quantity')),
+        [{'freed_product_id': product_id, 'freed_quantity': freed[product_id]} for product_id in sorted(freed)]
+    )
+
+
+def discard(session, product_ids):
+    """Delete every hold on ``product_ids`` and their counters, ahead of deleting the products."""
+    product_ids = sorted(product_ids)
+    if not product_ids:
+        return
+    # Reservations before counters, the order hold() and the sweeper lock them in
+    session.execute(delete(StockReservation).where(StockReservation.product_id.in_(product_ids)))
+    session.execute(delete(StockCounter).where(StockCounter.product_id.in_(product_ids)))
+
+
+def holds_for(session, user_id):
+    """The user's holds as {product_id: (quantity, expires_at)}."""
+    rows = session.execute(
+        select(StockReservation.product_id, StockReservation.quantity, StockReservation.expires_at)
+        .filter_by(user_id=user_id)
+    ).all()
+    return {product_id: (quantity, expires_at) for product_id, quantity, expires_at in rows}
+
+
+def sweep(session, now=None, batch=SWEEP_BATCH):
+    """Delete expired holds and give their units back, committing every ``batch`` rows. Returns the count."""
+    now = now or datetime.utcnow()
+    dialect = session.get_bind(StockReservation).dialect
+    swept = 0
+    while True:
+        expired = select(StockReservation.id).where(StockReservation.expires_at < now) \
+            .order_by(StockReservation.expires_at).limit(batch)
+        if dialect.delete_returning:
+            # Only what was actually deleted is credited back: a cart may have renewed its hold meanwhile
+            rows = session.execute(
+                delete(StockReservation)
+                .where(StockReservation.id.in_(expired.scalar_subquery()), StockReservation.expires_at < now)
+                .returning(StockReservation.product_id, StockReservation.quantity)
+            ).all()
+            _decrement(session, rows)
+        else:
+            rows = session.execute(
+                select(StockReservation.id, StockReservation.product_id, StockReservation.quantity)
+                .where(StockReservation.id.in_(expired.scalar_subquery()))
+                .with_for_update()
+            ).all()
+            _drop(session, rows)
+        session.commit()
+        swept += len(rows)
+        if len(rows) < batch:
+            return swept
+
+
+def rebuild_counters(session):
+    """Recompute every counter from the reservation rows, e.g. after manual edits. Returns rows changed."""
+    totals = dict(session.execute(
+        select(StockReservation.product_id, func.sum(StockReservation.quantity))
+        .group_by(StockReservation.product_id)
+    ).all())
+    counters = dict(session.execute(select(StockCounter.product_id, StockCounter.reserved)).all())
+    changed = 0
+    for product_id in sorted(set(totals) | set(counters)):
+        want = int(totals.get(product_id) or 0)
+        if product_id not in counters:
+            session.add(StockCounter(product_id=product_id, reserved=want))
+            changed += 1
+        elif counters[product_id] != want:
+            session.execute(update(StockCounter).where(StockCounter.product_id == product_id).values(reserved=want))
+            changed += 1
+    session.commit()
+    return changed
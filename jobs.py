@@ -0,0 +1,316 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, insert, delete, func, or_, and_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from create_db import Job
+from metrics import Histogram, Counter, registry
+
+log = logging.getLogger(__name__)
+
+STATUSES = ('queued', 'running', 'done', 'failed')
+DEFAULT_MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 5
+RETRY_MAX_SECONDS = 3600
+# A running job whose worker hasn't finished it within this many seconds is assumed dead and retried
+DEFAULT_LEASE_SECONDS = 300
+
+jobs_total = registry.register(Counter(
+    "jobs_total", "Background jobs finished, by outcome (done, retried, failed)", "outcome"))
+job_seconds = registry.register(Histogram(
+    "job_seconds", "Time spent running a background job",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)))
+job_queue_seconds = registry.register(Histogram(
+    "job_queue_seconds", "Delay between a job becoming due and a worker claiming it",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)))
+
+TASKS = {}
+PERIODIC = {}  # task name -> interval in seconds
+
+
+class Task:
+    __slots__ = ('name', 'func', 'max_attempts')
+
+    def __init__(self, name, func, max_attempts):
+        self.name = name
+        self.func = func
+        self.max_attempts = max_attempts
+
+
+def task(name, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Register ``func(**payload)`` as the handler for jobs called ``name``.
+
+    Handlers run inside an app context and may use ``db.session``. Writes they
+    leave uncommitted are committed in the same transaction that marks the job
+    done, so such a job that fails part-way leaves nothing behind and is simply
+    retried. Handlers that commit themselves, such as the batch sweeps and
+    index refreshes in main.py, keep whatever they committed before a failure
+    and must be safe to run again from that point; the job itself is only
+    marked done once the handler returns.
+    """
+    def decorator(func):
+        TASKS[name] = Task(name, func, max_attempts)
+        return func
+    return decorator
+
+
+def periodic(name, every):
+    """Have workers queue ``name`` every ``every`` seconds.
+
+    Each interval gets its own idempotency key, so however many workers are
+    running the task is queued once per interval.
+    """
+    PERIODIC[name] = every
+
+
+def enqueue(session, name, payload=None, key=None, delay=0, max_attempts=None):
+    """Queue a job inside the caller's transaction, so it only exists if that transaction commits.
+
+    Jobs with an idempotency ``key`` are queued at most once, however many times
+    this is called. Returns False when the key was already taken.
+    """
+    if name not in TASKS:
+        raise KeyError("no task registered as %r" % name)
+    now = datetime.utcnow()
+    values = {
+        'name': name,
+        'payload': json.dumps(payload or {}, sort_keys=True, default=str),
+        'status': 'queued',
+        'idempotency_key': key,
+        'attempts': 0,
+        'max_attempts': max_attempts or TASKS[name].max_attempts,
+        'run_at': now + timedelta(seconds=delay),
+        'created_at': now,
+    }
+    if key is None:
+        session.execute(insert(Job), values)
+        return True
+
+    dialect = session.get_bind(Job).dialect
+    if dialect.name in ('sqlite', 'postgresql'):
+        dialect_insert = sqlite.insert if dialect.name == 'sqlite' else postgresql.insert
+        result = session.execute(
+            dialect_insert(Job).values(values).on_conflict_do_nothing(index_elements=['idempotency_key'])
+        )
+        return bool(result.rowcount)
+    if session.execute(select(Job.id).filter_by(idempotency_key=key)).first():
+        return False
+    session.execute(insert(Job), values)
+    return True
+
+
+def _claimable(now, lease):
+    return or_(
+        and_(Job.status == 'queued', Job.run_at <= now),
+        and_(Job.status == 'running', Job.locked_at < now - timedelta(seconds=lease)),
+    )
+
+
+def claim(session, worker_id, limit, lease=DEFAULT_LEASE_SECONDS):
+    """Mark up to ``limit`` due jobs as running for ``worker_id`` and commit; returns their ids.
+
+    Several workers can poll at once: Postgres skips rows another worker has
+    locked, elsewhere the status check in the UPDATE lets only one of them win.
+    """
+    now = datetime.utcnow()
+    claimable = _claimable(now, lease)
+    dialect = session.get_bind(Job).dialect
+    candidates = select(Job.id, Job.run_at).where(claimable).order_by(Job.run_at, Job.id).limit(limit)
+    if dialect.name == 'postgresql':
+        candidates = candidates.with_for_update(skip_locked=True)
+    due = dict(session.execute(candidates).all())
+    if not due:
+        session.commit()
+        return []
+
+    claim_values = dict(status='running', locked_by=worker_id, locked_at=now, attempts=Job.attempts + 1)
+    if dialect.update_returning:
+        claimed = session.execute(
+            update(Job).where(Job.id.in_(due), claimable).values(**claim_values).returning(Job.id)
+        ).scalars().all()
+    else:
+        claimed = [job_id for job_id in due
+                   if session.execute(update(Job).where(Job.id == job_id, claimable).values(**claim_values)).rowcount]
+    session.commit()
+    for job_id in claimed:
+        job_queue_seconds.observe(max((now - due[job_id]).total_seconds(), 0.0))
+    return sorted(claimed)
+
+
+def retry_delay(attempts):
+    return min(RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), RETRY_MAX_SECONDS)
+
+
+def run(session, job_id, worker_id):
+    """Run one claimed job and record the outcome. Returns 'done', 'retried', 'failed' or None if it was lost."""
+    job = session.get(Job, job_id)
+    if job is None or job.status != 'running' or job.locked_by != worker_id:
+        session.rollback()
+        return None
+    name, payload, attempts, max_attempts = job.name, job.payload, job.attempts, job.max_attempts
+
+    started = time.perf_counter()
+    error = None
+    try:
+        handler = TASKS.get(name)
+        if handler is None:
+            raise LookupError("no task registered as %r" % name)
+        handler.func(**json.loads(payload))
+        done = session.execute(
+            update(Job).where(Job.id == job_id, Job.locked_by == worker_id)
+            .values(status='done', finished_at=datetime.utcnow(), locked_by=None, locked_at=None, last_error=None)
+        ).rowcount
+        if not done:
+            # Our lease expired and another worker took the job over; let it finish
+            session.rollback()
+            return None
+        session.commit()
+    except Exception as exc:  # noqa: BLE001 - any handler failure is retried
+        session.rollback()
+        error = "%s: %s" % (type(exc).__name__, exc)
+        log.warning("job %s (%s) attempt %d failed: %s", job_id, name, attempts, error,
+                    exc_info=not isinstance(exc, LookupError))
+    finally:
+        job_seconds.observe(time.perf_counter() - started)
+
+    if error is None:
+        jobs_total.inc(label_value='done')
+        return 'done'
+
+    final = attempts >= max_attempts or name not in TASKS
+    now = datetime.utcnow()
+    values = dict(last_error=error[:2000], locked_by=None, locked_at=None)
+    if final:
+        values.update(status='failed', finished_at=now)
+    else:
+        values.update(status='queued', run_at=now + timedelta(seconds=retry_delay(attempts)))
+    session.execute(update(Job).where(Job.id == job_id, Job.locked_by == worker_id).values(**values))
+    session.commit()
+    outcome = 'failed' if final else 'retried'
+    jobs_total.inc(label_value=outcome)
+    return outcome
+
+
+def counts(session):
+    """Number of jobs per status, plus how late the oldest due job is."""
+    found = dict(session.execute(select(Job.status, func.count(Job.id)).group_by(Job.status)).all())
+    oldest = session.execute(
+        select(func.min(Job.run_at)).where(Job.status == 'queued', Job.run_at <= datetime.utcnow())
+    ).scalar()
+    result = {status: found.get(status, 0) for status in STATUSES}
+    result['oldest_due_seconds'] = (datetime.utcnow() - oldest).total_seconds() if oldest else 0.0
+    return result
+
+
+def prune(session, older_than):
+    """Delete finished jobs (done, or failed for good) that ended before ``older_than`` ago."""
+    cutoff = datetime.utcnow() - older_than
+    deleted = session.execute(
+        delete(Job).where(Job.status.in_(('done', 'failed')), Job.finished_at < cutoff)
+    ).rowcount
+    session.commit()
+    return deleted
+
+
+class Worker:
+    """Polls the jobs table and runs what it claims on a thread pool.
+
+    Each job runs in its own app context (and so its own ``db.session``). The
+    polling thread only claims as many jobs as there are idle threads, so a slow
+    worker never sits on work that another worker could pick up.
+    """
+
+    def __init__(self, app, db, threads=4, poll_interval=1.0, lease=DEFAULT_LEASE_SECONDS, name=None):
+        self.app = app
+        self.db = db
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.id = name or "%s:%d:%x" % (socket.gethostname(), os.getpid(), id(self))
+        self.stopping = threading.Event()
+        self.idle = threading.Semaphore(threads)
+        self.executor = None
+        self.next_periodic = {}
+
+    def _schedule(self):
+        now = time.time()
+        due = {name: every for name, every in PERIODIC.items() if self.next_periodic.get(name, 0) <= now}
+        if not due:
+            return
+        try:
+            with self.app.app_context():
+                for name, every in due.items():
+                    enqueue(self.db.session, name, key="periodic:%s:%d" % (name, now // every))
+                self.db.session.commit()
+        except Exception:  # noqa: BLE001 - retried on the next poll
+            log.exception("could not queue periodic jobs")
+            return
+        for name, every in due.items():
+            self.next_periodic[name] = (now // every + 1) * every
+
+    def _run(self, job_id):
+        try:
+            with self.app.app_context():
+                run(self.db.session, job_id, self.id)
+        except Exception:  # noqa: BLE001 - keep the pool alive; the lease will hand the job out again
+            log.exception("job %s could not be recorded", job_id)
+        finally:
+            self.idle.release()
+
+    def _claim(self):
+        free = 0
+        while self.idle.acquire(blocking=False):
+            free += 1
+        if not free:
+            return []
+        try:
+            with self.app.app_context():
+                claimed = claim(self.db.session, self.id, free, self.lease)
+        except Exception:  # noqa: BLE001 - database hiccup; try again on the next poll
+            log.exception("could not claim jobs")
+            claimed = []
+        for _ in range(free - len(claimed)):
+            self.idle.release()
+        return [self.executor.submit(self._run, job_id) for job_id in claimed]
+
+    def run_forever(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='jobs')
+        log.info("job worker %s started with %d threads", self.id, self.threads)
+        try:
+            while not self.stopping.is_set():
+                self._schedule()
+                if not self._claim():
+                    self.stopping.wait(self.poll_interval)
+        finally:
+            self.executor.shutdown(wait=True)
+            log.info("job worker %s stopped", self.id)
+
+    def run_until_empty(self):
+        """Process every job that is currently due, then return (for cron and tests)."""
+        self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='jobs')
+        self._schedule()
+        pending = set()
+        try:
+            while True:
+                pending.update(self._claim())
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        finally:
+            self.executor.shutdown(wait=True)
+
+    def start(self):
+        """Run the worker on a daemon thread of this process."""
+        thread = threading.Thread(target=self.run_forever, name='jobs-worker', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.stopping.set()
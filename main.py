@@ -1,16 +1,50 @@
-from flask import Flask, render_template, request, redirect, flash, url_for, abort
+from flask import Flask, render_template, request, redirect, flash, url_for, abort, jsonify, Response, stream_with_context, send_file
 import os
+import io
+import csv
+import json
+import hashlib
+import sys
+import signal
+import click
+from flask.cli import AppGroup
 from flask_sqlalchemy import SQLAlchemy
-from create_db import Base, User, Product, Category, CartItem, OrderItem, Address,Order  # Base comes from DeclarativeBase in your models.py
+from create_db import Base, User, Product, Category, CartItem, OrderItem, Address,Order, PriceSchedule, ProductImage  # Base comes from DeclarativeBase in your models.py
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from werkzeug.security import check_password_hash, generate_password_hash
+from werkzeug.security import generate_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_wtf import FlaskForm
-from wtforms import StringField, DecimalField, IntegerField, TextAreaField, SubmitField, SelectField,BooleanField
-from wtforms.validators import DataRequired, NumberRange, Length, Optional
+from wtforms import StringField, IntegerField, SubmitField, SelectField
+from wtforms.validators import DataRequired
 from flask_bootstrap import Bootstrap5
-from decimal import Decimal
-from sqlalchemy import or_,not_
-from sqlalchemy.orm import aliased
+from sqlalchemy.orm import joinedload, contains_eager
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from pagination import keyset_page, clamp_per_page
+import search
+import db_profiles
+from metrics import pool_checkout_seconds
+import sql_instrumentation
+from sql_instrumentation import query_budget
+import versions
+from cart_pricing import price_cart
+from orders import (place_order, client_order_filters, status_totals, load_order, is_terminal,
+                    ORDER_STATUSES, PAYMENT_METHODS)
+from cache import cache_from_url
+from response_cache import PageCache, CATALOG_VERSION_KEY
+from user_cache import PrincipalCache
+import catalog_io
+import jobs
+import inventory
+import pricing
+import images
+import ratelimit
+import passwords
+import migrations
+import recommendations
+import catalog_snapshot
+import cart_updates
+from category_tree import CategoryTreeCache, subtree_query, VERSION_KEY as CATEGORY_VERSION_KEY
 
 class AddressForm(FlaskForm):
     full_name = StringField("Full Name", validators=[DataRequired()])
@@ -36,24 +70,13 @@ class CheckoutForm(FlaskForm):
 
     submit = SubmitField("Place Order")
 
-class CategoryForm(FlaskForm):
-    name = StringField('Category Name', validators=[DataRequired(), Length(max=100)])
-    parent_id = SelectField('Parent Category', coerce=int, choices=[], validate_choice=False)
-    submit = SubmitField('Add Category')
-
-class ProductForm(FlaskForm):
-    name = StringField('Product Name', validators=[DataRequired(), Length(max=150)])
-    description = TextAreaField('Description', validators=[DataRequired()])
-    price = DecimalField('Price ($)', validators=[DataRequired(), NumberRange(min=0)])
-    discount = IntegerField('Discount (%)', validators=[NumberRange(min=0, max=100)])
-    stock_quantity = IntegerField('Stock Quantity', validators=[DataRequired(), NumberRange(min=0)])
-    image_url = StringField('Image URL', validators=[DataRequired()])
-    category_id = SelectField('Category', coerce=int, validators=[DataRequired()])
-    submit = SubmitField('Add Product')
-
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('secret_key')
+# Behind N reverse proxies, set TRUSTED_PROXIES=N so request.remote_addr (used by the login
+# and signup throttles) is the client's address from X-Forwarded-For, not the proxy's
+if int(os.environ.get('TRUSTED_PROXIES', 0)):
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ['TRUSTED_PROXIES']), x_proto=1)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = "login"# Redirect if not logged in
@@ -61,47 +84,242 @@ login_manager.login_message_category = "danger"
 login_manager.login_message = "Please login to access this page."
 Bootstrap5(app)
 
+category_cache = CategoryTreeCache(check_interval=float(os.environ.get('CATEGORY_CACHE_CHECK_SECONDS', 5)))
+
+def category_choices():
+    return [(c.id, c.name) for c in category_cache.get(db.session).ordered()]
+
 @app.context_processor
 def inject_categories():
-    categories = db.session.execute(db.select(Category)).scalars().all()
-    return dict(nav_categories=categories)
+    return dict(nav_categories=category_cache.get(db.session).ordered())
+
+@app.template_global()
+def url_with_args(**updates):
+    # Rebuild the current URL with some query parameters replaced (None drops them)
+    args = request.args.to_dict()
+    args.update(updates)
+    args = {k: v for k, v in args.items() if v is not None}
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+# Catalog thumbnails, built by the job worker in a process pool (see images.py)
+image_store = images.ImageStore(os.environ.get('IMAGE_STORE_DIR') or os.path.join(app.instance_path, 'images'))
+thumbnail_pool = images.ThumbnailPool(image_store.root,
+                                      workers=int(os.environ['IMAGE_WORKERS']) if os.environ.get('IMAGE_WORKERS') else None,
+                                      local_root=os.environ.get('IMAGE_LOCAL_ROOT'))
+
+@app.template_global()
+def image_srcset(thumbnails, fmt):
+    return ", ".join(f"{url_for('product_image', digest=thumbnails.digest, name=f'{w}.{fmt}')} {w}w"
+                     for w in thumbnails.widths)
+
+# Login/signup throttling: limits like '5/minute' per client IP and per email, 'off' to disable
+rate_limiter = ratelimit.RateLimiter(ratelimit.buckets_from_url(os.environ.get('RATE_LIMIT_URL')))
+password_hasher = passwords.HashPool(workers=int(os.environ.get('PASSWORD_HASH_THREADS', 2)),
+                                     max_queue=int(os.environ.get('PASSWORD_HASH_QUEUE', 32)))
+
+def client_ip():
+    return request.remote_addr or 'unknown'
+
+def form_email():
+    return ratelimit.hashed_key(request.form.get('email'))
+
+# Per IP only failed logins count, so many people signing in from one office or NAT aren't
+# locked out by each other's successes
+LOGIN_LIMITS = (
+    ratelimit.Rule('login:ip', os.environ.get('RATE_LIMIT_LOGIN_IP', '20/minute'), client_ip, failures_only=True),
+    ratelimit.Rule('login:email', os.environ.get('RATE_LIMIT_LOGIN_EMAIL', '5/minute'), form_email),
+)
+SIGNUP_LIMITS = (
+    ratelimit.Rule('signup:ip', os.environ.get('RATE_LIMIT_SIGNUP_IP', '5/minute'), client_ip),
+    ratelimit.Rule('signup:email', os.environ.get('RATE_LIMIT_SIGNUP_EMAIL', '5/minute'), form_email),
+)
+
+def too_many_attempts(template, retry_after):
+    flash(f"Too many attempts. Please try again in {retry_after} seconds.", "danger")
+    return render_template(template), 429, {'Retry-After': str(retry_after)}
+
+# Adding to the cart holds the stock for this long; the sweeper job frees expired holds
+CART_HOLD = timedelta(seconds=int(os.environ.get('CART_HOLD_SECONDS', 900)))
+
+# Identity + cart badge for the logged-in user, so most requests never touch the users table
+principal_cache = PrincipalCache(
+    cache_from_url(os.environ.get('USER_CACHE_URL'), prefix='user:', max_entries=10000),
+    ttl=float(os.environ.get('USER_CACHE_TTL', 60)),
+)
 
 # Required user loader
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(User, int(user_id))
+    try:
+        return principal_cache.load(db.session, int(user_id))
+    except ValueError:
+        return None
 
 
 # ✅ Use env var or fallback to SQLite
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get("DB_URI", "sqlite:///e-commerce.db")
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# ✅ Engine/pool tuning picked from DB_URI (or forced with DB_PROFILE)
+db_profile = db_profiles.select_profile(app.config['SQLALCHEMY_DATABASE_URI'])
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = db_profiles.engine_options(db_profile, app.config['SQLALCHEMY_DATABASE_URI'])
+
 # ✅ Initialize SQLAlchemy with custom base
 db = SQLAlchemy(model_class=Base)
 db.init_app(app)
 
-# ✅ Create tables with app context
+# ✅ Per-request query counts, Server-Timing headers and /_metrics
+app.config['SQL_QUERY_BUDGET_STRICT'] = os.environ.get('SQL_QUERY_BUDGET_STRICT') == '1'
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+
+# ✅ Schema changes live in migrations.py. Serverless deploys set SCHEMA_ON_STARTUP=0 and run
+# `flask db-init` once per release, so a cold start never waits on DDL; the engine then
+# connects on the first query rather than at import
 with app.app_context():
-    db.create_all()
+    db_profiles.configure_engine(db.engine, db_profile)
+    sql_instrumentation.init_app(app, db.engine)
+    search_index = search.index_for(db.engine)
+    if os.environ.get('SCHEMA_ON_STARTUP', '1') == '1':
+        migrations.upgrade(db.engine, db.session, search_index)
+
+@app.cli.command('db-init')
+def db_init():
+    """Create or upgrade the database schema."""
+    applied = migrations.upgrade(db.engine, db.session, search_index)
+    for name in applied:
+        print(f"applied: {name}")
+    print(f"schema at version {migrations.current_version(db.engine)}")
 
 
 @app.route('/profile')
 @login_required
 def home():
-    return render_template('home.html', user=current_user)
+    user = db.session.get(User, current_user.id)
+    return render_template('home.html', user=user)
+
+# Admin order list orderings: whether created_at runs newest first
+ORDER_SORTS = {
+    'newest': True,
+    'oldest': False,
+}
+
+# Catalog orderings: keyset columns and direction; price sorts use the stored effective price
+PRODUCT_SORTS = {
+    'newest': ((Product.created_at, Product.id), True),
+    'oldest': ((Product.created_at, Product.id), False),
+    'price_low': ((Product.effective_price, Product.id), False),
+    'price_high': ((Product.effective_price, Product.id), True),
+}
+
+def parse_price(value):
+    try:
+        price = Decimal(value) if value else None
+    except InvalidOperation:
+        return None
+    return price if price is not None and price.is_finite() and price >= 0 else None
+
+# ✅ Anonymous catalog pages, invalidated by bumping the catalog/category versions. Stock moves
+# with every cart and order, so instead a hit is re-checked against the stock levels it showed
+page_cache = PageCache(
+    cache_from_url(os.environ.get('PAGE_CACHE_URL'), prefix='page:', max_entries=2048, ttl=3600),
+    get_session=lambda: db.session,
+    version_keys=(CATALOG_VERSION_KEY, CATEGORY_VERSION_KEY),
+    live={'stock': inventory.levels},
+)
+
+# ✅ Optional read-only catalog in a memory-mapped file shared by every worker on the host
+# (catalog_snapshot.py). Set CATALOG_SNAPSHOT_DIR, ideally on a tmpfs such as /dev/shm, to
+# serve listing, category and price-filter pages from it instead of the database
+catalog_snapshots = (
+    catalog_snapshot.SnapshotCache(os.environ['CATALOG_SNAPSHOT_DIR'],
+                                   check_interval=float(os.environ.get('CATALOG_SNAPSHOT_CHECK_SECONDS', 5)))
+    if os.environ.get('CATALOG_SNAPSHOT_DIR') else None
+)
 
 @app.route('/')
+@query_budget(6)
+@page_cache.cached
 def products():
-    product = db.session.execute(db.select(Product)).scalars().all()
+    category_id = request.args.get('category', type=int)
+
+    stmt = db.select(Product)
+    if category_id:
+        stmt = stmt.filter(Product.category_id == category_id)
+
+    return render_catalog(stmt, {category_id} if category_id else None, category_id=category_id)
+
+def render_catalog(stmt, category_ids=None, **context):
+    # stmt and category_ids describe the same products: the first for the database, the second
+    # for the catalog snapshot when one is configured
+    sort = request.args.get('sort', 'newest')
+    if sort not in PRODUCT_SORTS:
+        sort = 'newest'
+    columns, descending = PRODUCT_SORTS[sort]
+
+    min_price = parse_price(request.args.get('min_price'))
+    max_price = parse_price(request.args.get('max_price'))
+    if catalog_snapshots is not None:
+        page = catalog_snapshots.get(db.session).keyset_page(
+            list(columns),
+            cursor=request.args.get('after'),
+            per_page=request.args.get('per_page', type=int),
+            descending=descending,
+            category_ids=sorted(category_ids) if category_ids is not None else None,
+            min_price=min_price, max_price=max_price,
+        )
+    else:
+        if min_price is not None:
+            stmt = stmt.filter(Product.effective_price >= min_price)
+        if max_price is not None:
+            stmt = stmt.filter(Product.effective_price <= max_price)
+        page = keyset_page(
+            db.session, stmt.options(joinedload(Product.category)),
+            columns=list(columns),
+            cursor=request.args.get('after'),
+            per_page=request.args.get('per_page', type=int),
+            descending=descending,
+        )
     admin=0
     if current_user.is_authenticated and current_user.is_admin:
         admin=1
 
-    return render_template('index.html', items=product,user_is_admin=admin)
+    # Live from the database: a snapshot's stock column is as old as the snapshot
+    stock_levels = inventory.levels(db.session, [p.id for p in page.items])
+    page_cache.shown('stock', stock_levels)
+    return render_template('index.html', items=page.items, page=page, sort=sort, stock_levels=stock_levels,
+                           thumbnails=images.lookup(db.session, [p.image_url for p in page.items]),
+                           min_price=min_price, max_price=max_price, user_is_admin=admin, **context)
+
+@app.route('/search')
+def search_products():
+    query = request.args.get('q', '').strip()
+    page_number = max(request.args.get('page', 1, type=int), 1)
+    per_page = clamp_per_page(request.args.get('per_page', type=int))
+
+    result = search_index.search(db.session, query, limit=per_page, offset=(page_number - 1) * per_page)
+    found = db.session.execute(
+        db.select(Product).options(joinedload(Product.category)).filter(Product.id.in_(result.ids))
+    ).scalars().all()
+    by_id = {p.id: p for p in found}
+    items = [by_id[pid] for pid in result.ids if pid in by_id]
+
+    admin=0
+    if current_user.is_authenticated and current_user.is_admin:
+        admin=1
+
+    return render_template('index.html', items=items, search_query=query, search_total=result.total,
+                           stock_levels=inventory.levels(db.session, result.ids),
+                           thumbnails=images.lookup(db.session, [p.image_url for p in items]),
+                           page_number=page_number, has_next=page_number * per_page < result.total,
+                           user_is_admin=admin)
 
 @app.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
+        # Throttled before anything touches the database or the password hasher
+        retry_after = rate_limiter.check(LOGIN_LIMITS)
+        if retry_after:
+            return too_many_attempts("login.html", retry_after)
         email = request.form["email"]
         password = request.form["password"]
         user = db.session.execute(
@@ -109,7 +327,8 @@ def login():
         ).scalar_one_or_none()
 
         if user:
-            if check_password_hash(user.password, password):
+            if password_hasher.check(user.password, password):
+                rate_limiter.succeeded(LOGIN_LIMITS)
                 login_user(user)
                 flash(f"{user.name} Logged in successfully.", "success")
                 return redirect(url_for('products'))
@@ -122,6 +341,8 @@ def login():
 
 @app.route('/logout')
 def logout():
+    if current_user.is_authenticated:
+        principal_cache.invalidate(current_user.id)
     logout_user()
     flash('You have been Logged out', 'warning')
     return redirect(url_for('products'))
@@ -129,6 +350,9 @@ def logout():
 @app.route("/signup", methods=["GET", "POST"])
 def signup():
     if request.method == "POST":
+        retry_after = rate_limiter.check(SIGNUP_LIMITS)
+        if retry_after:
+            return too_many_attempts("signup.html", retry_after)
         fname = request.form["first_name"]
         lname = request.form["last_name"]
         email = request.form["email"]
@@ -154,7 +378,7 @@ def signup():
             return redirect(url_for("signup"))
 
         # Hash and save user
-        hashed_pw = generate_password_hash(password)
+        hashed_pw = password_hasher.generate(password)
         new_user = User(
             name=fname + ' ' + lname,
             email=email,
@@ -169,27 +393,67 @@ def signup():
 
     return render_template("signup.html")
 
+def save_uploaded_image(form):
+    """The product's image URL: an upload is stored first and served from /img. None if it was rejected."""
+    upload = form.image_file.data
+    if not upload:
+        return form.image_url.data
+    try:
+        digest, name = image_store.save_original(upload.read(images.MAX_SOURCE_BYTES + 1))
+    except ValueError as exc:
+        form.image_file.errors.append(str(exc))
+        return None
+    return url_for('product_image', digest=digest, name=name)
+
+def queue_thumbnails(session, urls, retry=False):
+    """Queue thumbnail builds for URLs never seen before; returns how many were queued."""
+    # A retry gets a fresh key, or the finished job from the first attempt would swallow it
+    suffix = f":{datetime.utcnow():%Y%m%d%H%M}" if retry else ""
+    return sum(jobs.enqueue(session, 'images.thumbnail', {'url': url},
+                            key=f"image:{hashlib.sha256(url.encode()).hexdigest()}{suffix}")
+               for url in images.missing(session, urls))
+
+@app.route('/img/<digest>/<name>')
+def product_image(digest, name):
+    path = image_store.path(digest, name)
+    if path is None or not os.path.exists(path):
+        abort(404)
+    # Content-addressed: a URL always names the same bytes, so browsers and CDNs may keep it forever
+    response = send_file(path, mimetype=images.MIMETYPES[name.rsplit('.', 1)[1]], max_age=31536000,
+                         etag=digest + '-' + name)
+    response.cache_control.immutable = True
+    return response
+
 @app.route("/add-product", methods=["GET", "POST"])
 @login_required
 def add_product():
     if not current_user.is_admin:
         abort(403)
 
+    from admin_forms import ProductForm
     form = ProductForm()
     # Dynamically load categories
-    form.category_id.choices = [(cat.id, cat.name) for cat in db.session.execute(db.select(Category)).scalars()]
+    form.category_id.choices = category_choices()
 
     if form.validate_on_submit():
+        image_url = save_uploaded_image(form)
+        if image_url is None:
+            return render_template("add_product.html", form=form)
         product = Product(
             name=form.name.data,
             description=form.description.data,
             price=form.price.data,
             discount=form.discount.data,
             stock_quantity=form.stock_quantity.data,
-            image_url=form.image_url.data,
+            image_url=image_url,
             category_id=form.category_id.data
         )
         db.session.add(product)
+        db.session.flush()
+        pricing.reprice(db.session, [product.id])
+        queue_thumbnails(db.session, [product.image_url])
+        search_index.index_products(db.session, [product])
+        versions.bump(db.session, CATALOG_VERSION_KEY)
         db.session.commit()
         flash("Product added successfully!", "success")
         return redirect(url_for('home'))
@@ -202,17 +466,19 @@ def add_category():
     if not current_user.is_admin:
         abort(403)
 
+    from admin_forms import CategoryForm
     form = CategoryForm()
 
     # Populate parent category choices
-    categories = db.session.execute(db.select(Category)).scalars().all()
-    form.parent_id.choices = [(0, "No Parent")] + [(c.id, c.name) for c in categories]
+    form.parent_id.choices = [(0, "No Parent")] + category_choices()
 
     if form.validate_on_submit():
         parent_id = form.parent_id.data if form.parent_id.data != 0 else None
         new_category = Category(name=form.name.data, parent_id=parent_id)
         db.session.add(new_category)
+        versions.bump(db.session, CATEGORY_VERSION_KEY)
         db.session.commit()
+        category_cache.invalidate()
         flash("Category added successfully!", "success")
         return redirect(url_for('add_category'))
 
@@ -227,13 +493,23 @@ def add_to_cart(product_id):
     if not product:
         flash("Product not found.", "danger")
         return redirect(url_for("products"))
+    if not quantity or quantity < 1:
+        flash("Choose a quantity of at least 1.", "warning")
+        return redirect(request.referrer or url_for("products"))
 
     cart_item = db.session.execute(
         db.select(CartItem).filter_by(user_id=current_user.id, product_id=product_id)
     ).scalar_one_or_none()
 
+    wanted = (cart_item.quantity if cart_item else 0) + quantity
+    held, left = inventory.hold(db.session, current_user.id, product_id, wanted, CART_HOLD)
+    if not held:
+        db.session.rollback()
+        flash(f"Sorry, only {left} of {product.name} can be added right now.", "warning")
+        return redirect(request.referrer or url_for("products"))
+
     if cart_item:
-        cart_item.quantity += quantity
+        cart_item.quantity = wanted
     else:
         cart_item = CartItem(
             user_id=current_user.id,
@@ -243,6 +519,7 @@ def add_to_cart(product_id):
         db.session.add(cart_item)
 
     db.session.commit()
+    principal_cache.invalidate(current_user.id)
     flash(f"{product.name} added to cart!", "success")
     return redirect(url_for("view_cart"))
 
@@ -251,47 +528,78 @@ def add_to_cart(product_id):
 @login_required
 def remove_from_cart(cart_item):
     item = db.get_or_404(CartItem, cart_item)
+    # Someone else's cart line is reported as missing rather than forbidden, so ids can't be probed
+    if item.user_id != current_user.id:
+        abort(404)
+    inventory.release(db.session, current_user.id, [item.product_id])
     db.session.delete(item)
     db.session.commit()
+    principal_cache.invalidate(current_user.id)
     flash(f"Item removed from cart!", "success")
     return redirect(url_for("view_cart"))
 
 
 @app.route("/cart")
+@query_budget(6)
 @login_required
 def view_cart():
-    cart_items = db.session.execute(
-        db.select(CartItem).filter_by(user_id=current_user.id)
-    ).scalars().all()
-    products = []
-    for items in cart_items:
-        product_id = items.product_id
-        product = db.session.execute(
-            db.select(Product).filter_by(id=product_id)
-        ).scalar()
-        if product is None:
-            db.session.delete(items)
-            db.session.commit()
-            continue
-        else:
-            products.append(product)
-
-    total = 0
-    for item in cart_items:
-        price = item.product.price
-        quantity = item.quantity
-        discount = item.product.discount or 0
-
-        subtotal = price * quantity
-        subtotal = Decimal(subtotal)
-        discount = Decimal(discount)  # instead of float 10.0
-        discount_amount = subtotal * (discount / Decimal('100'))
-        final_price = subtotal - discount_amount
+    cart = price_cart(db.session, current_user.id)
+    in_cart = [line.product.id for line in cart.lines]
+    return render_template("cart.html", cart=cart, total=cart.total,
+                           holds=inventory.holds_for(db.session, current_user.id), now=datetime.utcnow(),
+                           bought_together=recommendations.bought_together(db.session, in_cart))
+
+def cart_json(cart, holds):
+    money = lambda value: str(Decimal(value).quantize(Decimal('0.01')))
+    return {
+        'lines': [{
+            'item_id': line.item.id,
+            'product_id': line.product.id,
+            'name': line.product.name,
+            'quantity': line.quantity,
+            'unit_price': money(line.unit_price),
+            'unit_final_price': money(line.unit_final_price),
+            'discount': line.discount,
+            'subtotal': money(line.subtotal),
+            'final_price': money(line.final_price),
+            'reserved_until': holds[line.product.id][1].isoformat() + 'Z' if line.product.id in holds else None,
+        } for line in cart.lines],
+        'item_count': cart.item_count,
+        'subtotal': money(cart.subtotal),
+        'discount_total': money(cart.discount_total),
+        'total': money(cart.total),
+    }
+
+@app.route("/api/cart", methods=["GET", "POST"])
+# A batch's queries don't grow with its length: token and lookups (4), two rounds of batched
+# holds (9 + 7, the second for lines stock only partly covers), the write (2), the priced cart (2)
+@query_budget(24)
+@login_required
+def cart_api():
+    """The cart as JSON; POST a batch of line changes (see cart_updates.py) to apply them first."""
+    results, replayed = [], False
+    if request.method == "POST":
+        # JSON only: a cross-site form can't send it, so the session cookie alone can't change a cart
+        if not request.is_json:
+            return jsonify(error="send the changes as application/json"), 415
+        try:
+            changes, token = cart_updates.parse(request.get_json(silent=True),
+                                                request.headers.get('Idempotency-Key'))
+        except ValueError as exc:
+            return jsonify(error=str(exc)), 400
+        results, replayed = cart_updates.apply(db.session, current_user.id, changes, token, CART_HOLD)
+        db.session.commit()
+        if not replayed:
+            principal_cache.invalidate(current_user.id)
 
-        total += final_price
-    return render_template("cart.html", product_ids=products, cart_items=cart_items, total=total)
+    cart = price_cart(db.session, current_user.id)
+    payload = cart_json(cart, inventory.holds_for(db.session, current_user.id))
+    payload['changes'] = [result.as_dict() for result in results]
+    payload['replayed'] = replayed
+    return jsonify(payload)
 
 @app.route("/checkout", methods=["GET", "POST"])
+@query_budget(13)
 @login_required
 def checkout():
     form = CheckoutForm()
@@ -309,60 +617,86 @@ def checkout():
         (a.id, f"{a.full_name},{a.phone}    {a.street}, {a.city}, {a.country}") for a in saved_addresses
     ]
 
-    # Get cart items
-    cart_items = db.session.execute(
-        db.select(CartItem).filter_by(user_id=current_user.id)
-    ).scalars().all()
+    cart = price_cart(db.session, current_user.id)
 
-    if not cart_items:
+    if not cart:
         flash("Your cart is empty.",'warning')
         return redirect(url_for("view_cart"))
 
-    total = sum(
-        Decimal(item.product.price * item.quantity) *
-        (1 - (Decimal(item.product.discount or 0) / 100))
-        for item in cart_items
-    )
+    total = cart.total
 
     if form.validate_on_submit():
-        order = Order(
-            user_id=current_user.id,
-            status="pending",
-            total_amount=total,
+        order, skipped = place_order(
+            db.session, current_user.id, cart,
             address_id=form.address_id.data,
             payment_method=form.payment_method.data
         )
-        db.session.add(order)
-        db.session.flush()
-
-        for item in cart_items:
-            price=item.product.price * (Decimal('1.0') - Decimal(item.product.discount) / Decimal('100'))
-            if item.product.stock_quantity-item.quantity>=0:
-                db.session.add(OrderItem(
-                    order_id=order.id,
-                    product_id=item.product_id,
-                    quantity=item.quantity,
-                    price_each=price
-                ))
-                item.product.stock_quantity-=item.quantity
-                db.session.delete(item)
-
+        if order is None:
+            db.session.rollback()
+            flash("Sorry, none of the items in your cart are in stock anymore.", "danger")
+            return redirect(url_for("view_cart"))
+
+        # Side work runs on the job worker; it is queued in the order's transaction
+        reserved_ids = sorted({line.product.id for line in cart.lines if line not in skipped})
+        jobs.enqueue(db.session, 'inventory.low_stock_alert', {'product_ids': reserved_ids},
+                     key=f'order:{order.id}:low-stock')
         db.session.commit()
+        principal_cache.invalidate(current_user.id)
+        if skipped:
+            names = ", ".join(line.product.name for line in skipped)
+            flash(f"Not enough stock for: {names}. Those items were left in your cart.", "warning")
         flash("Order placed successfully!", "success")
         return redirect(url_for("order_summary", order_id=order.id))
 
     return render_template("checkout.html", form=form, total=total, addresses=saved_addresses)
 
+def can_view_order(order):
+    return order is not None and (order.user_id == current_user.id or current_user.is_admin)
+
 @app.route("/order_summary/<int:order_id>")
+@query_budget(6)
 @login_required
 def order_summary(order_id):
-    order = db.session.get(Order, order_id)
+    order = load_order(db.session, order_id)
 
-    if not order or order.user_id != current_user.id:
+    if not can_view_order(order):
         flash("Order not found or access denied.", "danger")
         return redirect(url_for("home"))
 
-    return render_template("order_summary.html", order=order)
+    bought_together = recommendations.bought_together(db.session, [item.product_id for item in order.items])
+    return render_template("order_summary.html", order=order, bought_together=bought_together)
+
+# Rendered receipts of Delivered/Cancelled orders, keyed by order id
+receipt_cache = cache_from_url(os.environ.get('RECEIPT_CACHE_URL'), prefix='receipt:',
+                               max_entries=int(os.environ.get('RECEIPT_CACHE_SIZE', 512)))
+
+@app.route("/order/<int:order_id>/receipt")
+@login_required
+def order_receipt(order_id):
+    cached = receipt_cache.get(order_id)
+    if cached is not None:
+        user_id, html = cached
+        if user_id == current_user.id or current_user.is_admin:
+            return html
+        abort(404)
+
+    order = load_order(db.session, order_id)
+    if not can_view_order(order):
+        abort(404)
+    return render_receipt(order)
+
+def render_receipt(order):
+    html = render_template("receipts.html", order=order, printed_at=datetime.utcnow())
+    if is_terminal(order):
+        receipt_cache.set(order.id, (order.user_id, html))
+    return html
+
+def order_status_changed(order):
+    receipt_cache.delete(order.id)
+    if is_terminal(order) and receipt_cache.shared:
+        # Warm the receipt once the order can no longer change; pointless if only the worker would see it
+        jobs.enqueue(db.session, 'orders.render_receipt', {'order_id': order.id},
+                     key=f'order:{order.id}:receipt:{order.status.upper()}')
 
 @app.route("/add_address", methods=["GET", "POST"])
 @login_required
@@ -386,6 +720,7 @@ def add_address():
     return render_template("add_address.html", form=form)
 
 @app.route("/my_orders")
+@query_budget(5)
 @login_required
 def my_orders():
     orders = (
@@ -394,40 +729,113 @@ def my_orders():
         .order_by(Order.created_at.desc())
         .all()
     )
-    all_orders = (
-        db.session.query(Order)
-        .join(Order.user)
-        .filter(not_(User.is_admin))
-        .order_by(Order.created_at.desc())
-        .all()
+    return render_template("my_orders.html", orders=orders)
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d') if value else None
+    except ValueError:
+        return None
+
+@app.route("/admin/orders")
+@query_budget(6)
+@login_required
+def admin_orders():
+    if not current_user.is_admin:
+        abort(403)
+
+    status = request.args.get('status') or None
+    payment_method = request.args.get('payment_method') or None
+    date_from = parse_date(request.args.get('date_from'))
+    date_to = parse_date(request.args.get('date_to'))
+    sort = request.args.get('sort', 'newest')
+    if sort not in ORDER_SORTS:
+        sort = 'newest'
+
+    # Aggregates ignore the status filter so every status column stays visible
+    base_filters = client_order_filters(date_from=date_from, date_to=date_to, payment_method=payment_method)
+    filters = client_order_filters(status=status, date_from=date_from, date_to=date_to,
+                                   payment_method=payment_method)
+
+    page = keyset_page(
+        db.session,
+        db.select(Order).join(Order.user).options(contains_eager(Order.user))
+        .filter(*filters),
+        columns=[Order.created_at, Order.id],
+        cursor=request.args.get('after'),
+        per_page=request.args.get('per_page', type=int),
+        descending=ORDER_SORTS[sort],
     )
-    return render_template("my_orders.html", orders=orders,not_admin=all_orders)
+    totals = status_totals(db.session, base_filters)
+
+    return render_template("admin_orders.html", page=page, orders=page.items, totals=totals,
+                           statuses=ORDER_STATUSES, payment_methods=PAYMENT_METHODS,
+                           status=status, payment_method=payment_method, sort=sort,
+                           date_from=request.args.get('date_from', ''), date_to=request.args.get('date_to', ''))
+
+@app.route("/admin/analytics")
+@query_budget(10)
+@login_required
+def admin_analytics():
+    if not current_user.is_admin:
+        abort(403)
+    import analytics  # pulls in pandas; only this page, the CLI and the worker need it
+    default_from, default_to = analytics.default_range()
+    date_from = parse_date(request.args.get('date_from')) or default_from
+    date_to = parse_date(request.args.get('date_to')) or default_to
+    sales = analytics.report(db.session, date_from, date_to)
+    return render_template("admin_analytics.html", sales=sales, date_from=date_from, date_to=date_to)
+
+@app.route("/admin/analytics/refresh", methods=["POST"])
+@login_required
+def admin_analytics_refresh():
+    if not current_user.is_admin:
+        abort(403)
+    # One refresh per minute however often the button is pressed
+    jobs.enqueue(db.session, 'analytics.refresh', key=f"analytics:{datetime.utcnow():%Y%m%d%H%M}")
+    db.session.commit()
+    flash("Analytics refresh queued.", "info")
+    return redirect(request.referrer or url_for('admin_analytics'))
+
+# Above this many descendant categories the id list is resolved in SQL instead of inlined
+MAX_INLINE_CATEGORY_IDS = 500
 
 @app.route('/category/<int:category_id>')
+@query_budget(6)
+@page_cache.cached
 def category_products(category_id):
-    category = db.get_or_404(Category, category_id)
-    CategoryAlias = aliased(Category)
-
-    products = db.session.execute(
-        db.select(Product).join(CategoryAlias, Product.category).filter(
-            or_(
-                Product.category_id == category_id,
-                CategoryAlias.parent_id == category_id
-            )
-        )
-    ).scalars().all()
+    tree = category_cache.get(db.session)
+    category = tree.get(category_id)
+    if category is None:
+        abort(404)
+
+    subtree = tree.subtree_ids(category_id)
+    if len(subtree) <= MAX_INLINE_CATEGORY_IDS:
+        stmt = db.select(Product).filter(Product.category_id.in_(subtree))
+    else:
+        stmt = db.select(Product).filter(Product.category_id.in_(subtree_query(category_id)))
 
-    return render_template("index.html", category=category, items=products)
+    return render_catalog(stmt, subtree, category=category, ancestors=tree.ancestors_of(category_id),
+                          subcategories=tree.children_of(category_id))
 
 @app.route('/update_quantity/<id>/<action>')
+@login_required
 def update_quantity(id,action):
     cart_item=db.get_or_404(CartItem,id)
+    if cart_item.user_id != current_user.id:
+        abort(404)
     if action=='add':
-        cart_item.quantity+=1
+        wanted = cart_item.quantity+1
     else:
-        if cart_item.quantity-1 >=0:
-            cart_item.quantity-=1
-    db.session.commit()
+        wanted = max(cart_item.quantity-1, 0)
+    held, left = inventory.hold(db.session, current_user.id, cart_item.product_id, wanted, CART_HOLD)
+    if held:
+        cart_item.quantity = wanted
+        db.session.commit()
+    else:
+        db.session.rollback()
+        flash(f"Sorry, only {left} can be held for you right now.", "warning")
+    principal_cache.invalidate(current_user.id)
     return redirect(url_for('view_cart'))
 
 @app.route("/cancel_order/<order_id>")
@@ -435,6 +843,7 @@ def update_quantity(id,action):
 def cancel_order(order_id):
     order=db.get_or_404(Order,order_id)
     order.status='Cancelled'
+    order_status_changed(order)
     db.session.commit()
 
     return redirect(url_for('my_orders'))
@@ -453,7 +862,13 @@ def delete_address(id):
 def remove_product(id):
     if current_user.is_admin:
         product=db.get_or_404(Product,id)
+        search_index.remove_products(db.session, [product.id])
+        # Holds and counters reference the product; carts lose the held units with it
+        inventory.discard(db.session, [product.id])
+        # A sale for this product alone has nothing left to cover
+        db.session.execute(db.delete(PriceSchedule).filter_by(product_id=product.id))
         db.session.delete(product)
+        versions.bump(db.session, CATALOG_VERSION_KEY)
         db.session.commit()
 
         return redirect(url_for('products'))
@@ -466,12 +881,23 @@ def update_product(id):
         if not product:
             abort(404)
 
+        from admin_forms import ProductForm
         form = ProductForm(obj=product)  # ← pre-populate fields
 
-        form.category_id.choices = [(cat.id, cat.name) for cat in db.session.execute(db.select(Category)).scalars()]
+        form.category_id.choices = category_choices()
 
         if form.validate_on_submit():
+            image_url = save_uploaded_image(form)
+            if image_url is None:
+                return render_template('update_product.html', form=form, product=product)
             form.populate_obj(product)   # ← update product from form data
+            product.image_url = image_url
+            db.session.flush()
+            queue_thumbnails(db.session, [product.image_url])
+            pricing.reprice(db.session, [product.id])
+            db.session.expire(product, ['effective_price'])
+            search_index.index_products(db.session, [product])
+            versions.bump(db.session, CATALOG_VERSION_KEY)
             db.session.commit()
             flash('Product updated successfully.', 'success')
             return redirect(url_for('products'))
@@ -481,13 +907,354 @@ def update_product(id):
 @app.route('/update_order/<int:order_id>',methods=['GET','POST'])
 @login_required
 def update_order(order_id):
+    if not current_user.is_admin:
+        abort(403)
     order=db.get_or_404(Order,order_id)
     if order.status.upper()=='PENDING':
         order.status='Paid'
     elif order.status.upper()=='PAID':
         order.status='Delivered'
+    order_status_changed(order)
     db.session.commit()
-    return redirect(url_for('my_orders'))
+    return redirect(request.referrer or url_for('admin_orders'))
+
+@app.cli.command('db-pool-stats')
+def db_pool_stats():
+    """Print the engine profile, pool state and connection checkout latency."""
+    stats = pool_checkout_seconds.snapshot()
+    print(f"profile: {db_profile}")
+    for key, value in db_profiles.pool_status(db.engine).items():
+        print(f"{key}: {value}")
+    print(f"checkouts: {stats['count']}")
+    for label, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+        print(f"checkout {label}: {pool_checkout_seconds.quantile(q) * 1000:.2f} ms")
+    print(f"checkout max: {stats['max'] * 1000:.2f} ms")
+
+def after_catalog_batch(session, products):
+    pricing.reprice(session, [p.id for p in products])
+    queue_thumbnails(session, [p.image_url for p in products])
+    search_index.index_products(session, products)
+    versions.bump(session, CATALOG_VERSION_KEY)
+
+@app.route('/admin/catalog/import', methods=['POST'])
+@login_required
+def admin_catalog_import():
+    if not current_user.is_admin:
+        abort(403)
+    from admin_forms import CatalogImportForm, ProductForm
+    # A form post like any other admin change, so it carries the CSRF token too
+    form = CatalogImportForm()
+    if not form.validate_on_submit():
+        return jsonify(error="upload a 'file' as csv or jsonl", fields=form.errors), 400
+    upload = form.file.data
+    fmt = form.format.data or ('jsonl' if upload.filename.endswith(('.jsonl', '.ndjson')) else 'csv')
+
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    report = catalog_io.import_products(
+        db.session, catalog_io.read_rows(stream, fmt), ProductForm,
+        batch_size=form.batch_size.data or catalog_io.DEFAULT_BATCH_SIZE,
+        on_batch=after_catalog_batch,
+    )
+    return jsonify(report.as_dict())
+
+@app.route('/admin/catalog/export')
+@login_required
+def admin_catalog_export():
+    if not current_user.is_admin:
+        abort(403)
+    fmt = request.args.get('format', 'csv')
+    if fmt not in catalog_io.FORMATS:
+        abort(400)
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(
+        stream_with_context(catalog_io.export_products(db.session, fmt)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=products.{fmt}'},
+    )
+
+catalog_cli = AppGroup('catalog', help='Bulk product import/export and the catalog snapshot.')
+
+@catalog_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('--format', 'fmt', type=click.Choice(catalog_io.FORMATS), help='Defaults to the file extension.')
+@click.option('--batch-size', default=catalog_io.DEFAULT_BATCH_SIZE, show_default=True)
+@click.option('--errors', 'errors_path', type=click.Path(dir_okay=False), help='Write rejected rows here as CSV.')
+def catalog_import(path, fmt, batch_size, errors_path):
+    """Import products from a CSV or JSON Lines file ('-' for stdin)."""
+    fmt = fmt or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    if path == '-':
+        stream = click.get_text_stream('stdin', encoding='utf-8-sig')
+    else:
+        stream = open(path, encoding='utf-8-sig', newline='')
+
+    def progress(report):
+        click.echo(f"read {report.read}  inserted {report.inserted}  updated {report.updated}  failed {report.failed}",
+                   err=True)
+
+    errors_out = open(errors_path, 'w', newline='') if errors_path else None
+    writer = csv.writer(errors_out) if errors_out else None
+    if writer:
+        writer.writerow(['line', 'errors', 'row'])
+
+    def reject(line, row, messages):
+        if writer:
+            writer.writerow([line, ' | '.join(messages), json.dumps(row, default=str)])
+
+    from admin_forms import ProductForm
+    with stream:
+        report = catalog_io.import_products(db.session, catalog_io.read_rows(stream, fmt), ProductForm,
+                                            batch_size=batch_size, on_batch=after_catalog_batch,
+                                            on_progress=progress, on_error=reject)
+    progress(report)
+    if errors_out:
+        errors_out.close()
+        click.echo(f"wrote {report.failed} rejected rows to {errors_path}", err=True)
+    if report.failed:
+        sys.exit(1)
+
+@catalog_cli.command('export')
+@click.argument('path', default='-', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--format', 'fmt', type=click.Choice(catalog_io.FORMATS), default='csv', show_default=True)
+def catalog_export(path, fmt):
+    """Stream every product to a CSV or JSON Lines file ('-' for stdout)."""
+    out = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8', newline='')
+    try:
+        for chunk in catalog_io.export_products(db.session, fmt):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+@catalog_cli.command('snapshot')
+def catalog_snapshot_build():
+    """Write the snapshot for the current catalog version into $CATALOG_SNAPSHOT_DIR."""
+    if catalog_snapshots is None:
+        sys.exit("CATALOG_SNAPSHOT_DIR is not set")
+    snapshot = catalog_snapshots.get(db.session)
+    print(f"{snapshot.path}: {len(snapshot)} products, {snapshot.size / 1024:.0f} KiB")
+
+app.cli.add_command(catalog_cli)
+
+# Follow-up work queued by requests and run by `flask jobs worker`
+LOW_STOCK_THRESHOLD = int(os.environ.get('LOW_STOCK_THRESHOLD', 5))
+
+@jobs.task('inventory.low_stock_alert')
+def low_stock_alert(product_ids):
+    low = db.session.execute(
+        db.select(Product.id, Product.name, Product.stock_quantity)
+        .where(Product.id.in_(product_ids), Product.stock_quantity <= LOW_STOCK_THRESHOLD)
+    ).all()
+    for product_id, name, stock in low:
+        app.logger.warning("Low stock: %s (#%d) has %d left", name, product_id, stock)
+
+@jobs.task('orders.render_receipt')
+def render_receipt_job(order_id):
+    order = load_order(db.session, order_id)
+    if order is not None and is_terminal(order):
+        with app.test_request_context():
+            render_receipt(order)
+
+@jobs.task('analytics.refresh', max_attempts=3)
+def refresh_analytics():
+    import analytics
+    analytics.refresh(db.session)
+
+@jobs.task('images.thumbnail', max_attempts=3)
+def build_thumbnails(url):
+    try:
+        digest, width, height, widths = thumbnail_pool.build(url)
+    except (OSError, ValueError) as exc:
+        # A broken or missing image won't fix itself on retry; remember it and keep the original URL
+        images.record(db.session, url, error=str(exc))
+        return
+    images.record(db.session, url, digest, width, height, widths)
+    versions.bump(db.session, CATALOG_VERSION_KEY)
+
+@jobs.task('inventory.sweep', max_attempts=1)
+def sweep_holds():
+    swept = inventory.sweep(db.session)
+    if swept:
+        app.logger.info("released %d expired stock holds", swept)
+
+jobs.periodic('inventory.sweep', every=int(os.environ.get('INVENTORY_SWEEP_SECONDS', 60)))
+
+@jobs.task('pricing.apply_schedules', max_attempts=1)
+def apply_price_schedules():
+    repriced = pricing.apply_schedules(db.session)
+    if repriced:
+        app.logger.info("repriced %d products for scheduled sales", repriced)
+
+jobs.periodic('pricing.apply_schedules', every=int(os.environ.get('PRICING_CHECK_SECONDS', 60)))
+
+@jobs.task('recommendations.refresh', max_attempts=3)
+def refresh_recommendations():
+    result = recommendations.refresh(db.session)
+    if result.orders:
+        app.logger.info("co-purchase index: %d orders, %d products updated", result.orders, result.products)
+
+jobs.periodic('recommendations.refresh', every=int(os.environ.get('RECOMMENDATIONS_REFRESH_SECONDS', 3600)))
+
+@jobs.task('cart.prune_tokens', max_attempts=1)
+def prune_cart_tokens():
+    cart_updates.prune_tokens(db.session)
+
+jobs.periodic('cart.prune_tokens', every=3600)
+
+def job_worker(threads=None, poll_interval=None):
+    return jobs.Worker(app, db,
+                       threads=threads or int(os.environ.get('JOBS_THREADS', 4)),
+                       poll_interval=poll_interval or float(os.environ.get('JOBS_POLL_SECONDS', 1)))
+
+jobs_cli = AppGroup('jobs', help='Background job queue.')
+
+@jobs_cli.command('worker')
+@click.option('--threads', type=int, help='Jobs run concurrently (default $JOBS_THREADS or 4).')
+@click.option('--poll-interval', type=float, help='Seconds between polls when idle (default $JOBS_POLL_SECONDS or 1).')
+@click.option('--once', is_flag=True, help='Run the jobs that are due now, then exit.')
+def jobs_worker(threads, poll_interval, once):
+    """Claim and run queued jobs until interrupted."""
+    worker = job_worker(threads, poll_interval)
+    if once:
+        worker.run_until_empty()
+        return
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    try:
+        worker.run_forever()
+    except KeyboardInterrupt:
+        worker.stop()
+
+@jobs_cli.command('status')
+def jobs_status():
+    """Print how many jobs are in each state."""
+    for key, value in jobs.counts(db.session).items():
+        print(f"{key}: {value}")
+
+@jobs_cli.command('prune')
+@click.option('--days', default=7, show_default=True, help='Keep finished jobs this many days.')
+def jobs_prune(days):
+    """Delete finished jobs older than --days."""
+    print(f"deleted {jobs.prune(db.session, timedelta(days=days))} jobs")
+
+app.cli.add_command(jobs_cli)
+
+analytics_cli = AppGroup('analytics', help='Sales summary tables.')
+
+@analytics_cli.command('refresh')
+@click.option('--full', is_flag=True, help='Rebuild the summaries from the whole order history.')
+@click.option('--chunksize', type=int, help='Rows read per batch (default 50000).')
+def analytics_refresh(full, chunksize):
+    """Fold new and recently changed orders into the sales summaries."""
+    import analytics
+    result = analytics.refresh(db.session, full=full, chunksize=chunksize or analytics.DEFAULT_CHUNKSIZE)
+    if result.since is None:
+        print("summaries are up to date")
+    else:
+        print(f"recomputed from {result.since}: {result.orders} orders, {result.items} items, "
+              f"watermark order #{result.last_order_id}")
+
+app.cli.add_command(analytics_cli)
+
+recommendations_cli = AppGroup('recommendations', help='"Frequently bought together" index.')
+
+@recommendations_cli.command('refresh')
+@click.option('--full', is_flag=True, help='Recount co-purchases from the whole order history.')
+@click.option('--chunksize', type=int, help='Rows read per batch (default 50000).')
+@click.option('--top', type=int, help='Recommendations kept per product (default 20).')
+def recommendations_refresh(full, chunksize, top):
+    """Add orders placed since the last refresh to the co-purchase index."""
+    result = recommendations.refresh(db.session, full=full,
+                                     chunksize=chunksize or recommendations.DEFAULT_CHUNKSIZE,
+                                     top_k=top or recommendations.DEFAULT_TOP_K)
+    print(f"{result.orders} orders read, {result.pairs} pair counts updated, "
+          f"{result.products} products re-ranked, watermark order #{result.last_order_id}")
+
+app.cli.add_command(recommendations_cli)
+
+inventory_cli = AppGroup('inventory', help='Cart stock holds.')
+
+@inventory_cli.command('sweep')
+def inventory_sweep():
+    """Release expired cart holds now."""
+    print(f"released {inventory.sweep(db.session)} expired holds")
+
+@inventory_cli.command('rebuild-counters')
+def inventory_rebuild_counters():
+    """Recompute held-stock counters from the hold rows."""
+    print(f"fixed {inventory.rebuild_counters(db.session)} counters")
+
+app.cli.add_command(inventory_cli)
+
+pricing_cli = AppGroup('pricing', help='Effective prices and scheduled sales.')
+
+def parse_when(value):
+    return datetime.fromisoformat(value) if value else None
+
+@pricing_cli.command('add-sale')
+@click.option('--discount', type=click.IntRange(1, 100), required=True, help='Percent off.')
+@click.option('--starts', help='UTC start, ISO format (default now).')
+@click.option('--ends', help='UTC end, ISO format (default open-ended).')
+@click.option('--product', 'product_id', type=int, help='Limit the sale to one product.')
+@click.option('--category', 'category_id', type=int, help='Limit the sale to a category and its subcategories.')
+@click.option('--name', help='Label shown in `flask pricing sales`.')
+def pricing_add_sale(discount, starts, ends, product_id, category_id, name):
+    """Schedule a sale; without --product or --category it covers the whole catalog."""
+    schedule, changed = pricing.schedule_sale(
+        db.session, discount, parse_when(starts) or datetime.utcnow(), parse_when(ends),
+        product_id=product_id, category_id=category_id, name=name,
+    )
+    print(f"sale #{schedule.id} scheduled, {changed} products repriced now")
+
+@pricing_cli.command('sales')
+def pricing_sales():
+    """List scheduled sales."""
+    for s in db.session.execute(db.select(PriceSchedule).order_by(PriceSchedule.starts_at)).scalars():
+        scope = (f"product {s.product_id}" if s.product_id else
+                 f"category {s.category_id}" if s.category_id else "catalog")
+        print(f"#{s.id} {s.name or ''} {s.discount}% off {scope}: {s.starts_at} -> {s.ends_at or 'open'}")
+
+@pricing_cli.command('end-sale')
+@click.argument('schedule_id', type=int)
+def pricing_end_sale(schedule_id):
+    """End a sale now."""
+    changed = pricing.end_sale(db.session, schedule_id)
+    if changed is None:
+        raise click.ClickException(f"no sale #{schedule_id}")
+    print(f"sale #{schedule_id} ended, {changed} products repriced")
+
+@pricing_cli.command('reprice')
+def pricing_reprice():
+    """Recompute every product's effective price now."""
+    changed = pricing.reprice(db.session)
+    if changed:
+        versions.bump(db.session, CATALOG_VERSION_KEY)
+    db.session.commit()
+    print(f"repriced {changed} products")
+
+app.cli.add_command(pricing_cli)
+
+images_cli = AppGroup('images', help='Catalog thumbnails.')
+
+@images_cli.command('backfill')
+@click.option('--retry-failed', is_flag=True, help='Also retry images that failed before.')
+def images_backfill(retry_failed):
+    """Queue thumbnails for every product image that doesn't have them yet."""
+    urls = set(db.session.execute(db.select(Product.image_url).distinct()).scalars())
+    if retry_failed:
+        failed = db.session.execute(
+            db.select(ProductImage.source_url).where(ProductImage.source_url.in_(urls), ProductImage.digest.is_(None))
+        ).scalars().all()
+        db.session.execute(db.delete(ProductImage).where(ProductImage.source_url.in_(failed)))
+    queued = queue_thumbnails(db.session, urls, retry=retry_failed)
+    db.session.commit()
+    print(f"queued {queued} images")
+
+app.cli.add_command(images_cli)
+
+# Single-process deployments can run the worker inside the web process instead
+if os.environ.get('JOBS_EMBEDDED_WORKER') == '1':
+    job_worker().start()
 
 if __name__ == '__main__':
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true' and os.environ.get('JOBS_EMBEDDED_WORKER') != '1':
+        job_worker().start()  # the dev server has no separate worker
     app.run(debug=True)
\ No newline at end of file
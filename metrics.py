@@ -0,0 +1,131 @@
+import bisect
+import threading
+
+# Seconds; tuned for pool checkouts and SQL calls, which are mostly sub-millisecond
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.total += value
+            self.count += 1
+            if value > self.max:
+                self.max = value
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        with self.lock:
+            if not self.count:
+                return 0.0
+            rank = q * self.count
+            seen = 0
+            for bound, count in zip(self.buckets + (self.max,), self.counts):
+                seen += count
+                if seen >= rank:
+                    return min(bound, self.max)
+            return self.max
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "count": self.count,
+                "sum": self.total,
+                "max": self.max,
+                "avg": self.total / self.count if self.count else 0.0,
+            }
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s histogram" % self.name]
+        with self.lock:
+            cumulative = 0
+            for bound, count in zip(self.buckets, self.counts):
+                cumulative += count
+                lines.append('%s_bucket{le="%s"} %d' % (self.name, bound, cumulative))
+            lines.append('%s_bucket{le="+Inf"} %d' % (self.name, self.count))
+            lines.append("%s_sum %f" % (self.name, self.total))
+            lines.append("%s_count %d" % (self.name, self.count))
+        return lines
+
+
+pool_checkout_seconds = Histogram(
+    "db_pool_checkout_seconds", "Time spent waiting for a connection from the engine pool"
+)
+
+
+class Counter:
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount=1, label_value=None):
+        with self.lock:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def value(self, label_value=None):
+        return self.values.get(label_value, 0)
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s counter" % self.name]
+        with self.lock:
+            for label_value, value in sorted(self.values.items(), key=lambda kv: str(kv[0])):
+                if self.label and label_value is not None:
+                    lines.append('%s{%s="%s"} %s' % (self.name, self.label, _escape(label_value), _number(value)))
+                else:
+                    lines.append("%s %s" % (self.name, _number(value)))
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time."""
+
+    def __init__(self, name, help, callback):
+        self.name = name
+        self.help = help
+        self.callback = callback
+
+    def render(self):
+        return ["# HELP %s %s" % (self.name, self.help), "# TYPE %s gauge" % self.name,
+                "%s %s" % (self.name, _number(self.callback()))]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+registry.register(pool_checkout_seconds)
@@ -0,0 +1,86 @@
+"""Versioned schema setup, run by ``flask db-init`` or, outside serverless deploys, at startup.
+
+Each migration runs once per database and is recorded in ``schema_migrations``.
+Migrations must be idempotent: databases created before this table existed
+already have some of their effects. Append new ones; never renumber.
+"""
+from datetime import datetime
+
+from sqlalchemy import inspect, select, func, insert, update, delete
+from sqlalchemy.exc import IntegrityError
+
+from create_db import Base, SchemaMigration, CoPurchaseCount, ProductRecommendation, CartItem, CartUpdateToken
+import pricing
+
+
+def _create_tables(engine, session, search_index):
+    Base.metadata.create_all(engine)
+
+
+def _effective_price(engine, session, search_index):
+    pricing.ensure_schema(engine)
+
+
+def _search_index(engine, session, search_index):
+    search_index.setup(session)
+
+
+def _co_purchase_tables(engine, session, search_index):
+    Base.metadata.create_all(engine, tables=[CoPurchaseCount.__table__, ProductRecommendation.__table__])
+
+
+def _unique_cart_lines(engine, session, search_index):
+    # Older code could leave two rows for one product in a cart; merge them before the index forbids it
+    duplicates = session.execute(
+        select(CartItem.user_id, CartItem.product_id, func.min(CartItem.id), func.sum(CartItem.quantity))
+        .group_by(CartItem.user_id, CartItem.product_id)
+        .having(func.count() > 1)
+    ).all()
+    for user_id, product_id, keep_id, quantity in duplicates:
+        session.execute(update(CartItem).where(CartItem.id == keep_id).values(quantity=quantity))
+        session.execute(delete(CartItem).where(CartItem.user_id == user_id, CartItem.product_id == product_id,
+                                               CartItem.id != keep_id))
+    session.commit()
+    index = next(i for i in CartItem.__table__.indexes if i.name == 'ux_cart_items_user_id_product_id')
+    index.create(engine, checkfirst=True)
+    Base.metadata.create_all(engine, tables=[CartUpdateToken.__table__])
+
+
+MIGRATIONS = (
+    (1, 'create tables', _create_tables),
+    (2, 'products.effective_price', _effective_price),
+    (3, 'search index', _search_index),
+    (4, 'co-purchase index', _co_purchase_tables),
+    (5, 'unique cart lines', _unique_cart_lines),
+)
+LATEST = MIGRATIONS[-1][0]
+
+
+def current_version(engine):
+    """Highest applied migration, or 0 for a database that has never been initialised."""
+    with engine.connect() as conn:
+        if not inspect(conn).has_table(SchemaMigration.__tablename__):
+            return 0
+        return conn.execute(select(func.max(SchemaMigration.version))).scalar() or 0
+
+
+def upgrade(engine, session, search_index):
+    """Apply every pending migration in order. Returns the names of those applied."""
+    applied = []
+    version = current_version(engine)
+    if version >= LATEST:
+        return applied
+    for number, name, migrate in MIGRATIONS:
+        if number <= version:
+            continue
+        migrate(engine, session, search_index)
+        # create_all in the first migration is what makes this table exist
+        try:
+            session.execute(insert(SchemaMigration).values(version=number, name=name, applied_at=datetime.utcnow()))
+            session.commit()
+        except IntegrityError:
+            # Another process starting at the same time recorded it first
+            session.rollback()
+            continue
+        applied.append(name)
+    return applied
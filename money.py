@@ -0,0 +1,11 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+CENT = Decimal('0.01')
+HUNDRED = Decimal('100')
+
+
+def discounted_unit_price(price, discount):
+    # Same rounding as OrderItem.price_each (DECIMAL(10, 2)), so cart totals match the order
+    price = Decimal(price or 0)
+    discount = Decimal(discount or 0)
+    return (price * (HUNDRED - discount) / HUNDRED).quantize(CENT, rounding=ROUND_HALF_UP)
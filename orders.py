@@ -0,0 +1,158 @@
+from datetime import timedelta
+
+from sqlalchemy import select, update, insert, delete, case, func
+from sqlalchemy.orm import selectinload, joinedload
+
+from create_db import Product, Order, OrderItem, CartItem, User
+import inventory
+
+products = Product.__table__
+
+ORDER_STATUSES = ('Pending', 'Paid', 'Delivered', 'Cancelled')
+PAYMENT_METHODS = ('cod', 'card', 'paypal')
+# Orders in these states never change again, so anything rendered from them can be cached
+TERMINAL_STATUSES = ('DELIVERED', 'CANCELLED')
+
+
+def reserve_stock(session, quantities):
+    """Atomically take ``quantities`` ({product_id: qty}) out of stock.
+
+    Each product is only decremented if it still has enough stock once other
+    carts' holds are set aside, so two concurrent checkouts can never drive it
+    negative. Returns the set of product ids that were reserved; the rest are
+    left untouched.
+    """
+    if not quantities:
+        return set()
+    ids = sorted(quantities)
+    dialect = session.get_bind(Product).dialect
+
+    if dialect.name == "postgresql":
+        # Lock the rows in a fixed order first so overlapping checkouts can't deadlock
+        session.execute(select(products.c.id).where(products.c.id.in_(ids)).order_by(products.c.id).with_for_update())
+
+    free = products.c.stock_quantity - inventory.held_quantity(products.c.id)
+    if dialect.update_returning:
+        wanted = case(quantities, value=products.c.id)
+        reserved = session.execute(
+            update(products)
+            .where(products.c.id.in_(ids), free >= wanted)
+            .values(stock_quantity=products.c.stock_quantity - wanted)
+            .returning(products.c.id)
+        ).scalars().all()
+        return set(reserved)
+
+    reserved = set()
+    for product_id in ids:
+        qty = quantities[product_id]
+        result = session.execute(
+            update(products)
+            .where(products.c.id == product_id, free >= qty)
+            .values(stock_quantity=products.c.stock_quantity - qty)
+        )
+        if result.rowcount:
+            reserved.add(product_id)
+    return reserved
+
+
+def place_order(session, user_id, cart, address_id, payment_method):
+    """Turn a priced cart into an order inside the caller's transaction.
+
+    Only lines whose stock could be reserved are ordered, removed from the cart
+    and counted in the total. Returns ``(order, skipped_lines)``; ``order`` is
+    None when nothing could be reserved, in which case the caller should roll back.
+    """
+    quantities = {}
+    for line in cart.lines:
+        if line.quantity > 0:
+            quantities[line.product.id] = quantities.get(line.product.id, 0) + line.quantity
+
+    # The cart's own holds become the order's stock, so they stop counting against it
+    inventory.release(session, user_id, quantities)
+    reserved = reserve_stock(session, quantities)
+    ordered = [line for line in cart.lines if line.product.id in reserved and line.quantity > 0]
+    skipped = [line for line in cart.lines if line not in ordered]
+    if not ordered:
+        return None, skipped
+
+    order = Order(
+        user_id=user_id,
+        status="pending",
+        total_amount=sum(line.final_price for line in ordered),
+        address_id=address_id,
+        payment_method=payment_method
+    )
+    session.add(order)
+    session.flush()
+
+    session.execute(insert(OrderItem), [
+        {
+            "order_id": order.id,
+            "product_id": line.product.id,
+            "quantity": line.quantity,
+            "price_each": line.unit_final_price,
+        }
+        for line in ordered
+    ])
+    session.execute(
+        delete(CartItem).where(CartItem.id.in_([line.item.id for line in ordered]))
+        .execution_options(synchronize_session=False)
+    )
+    return order, skipped
+
+
+def status_variants(status):
+    # Statuses have been stored as 'pending' and 'Paid' alike; match every spelling
+    # with an IN list so the (status, created_at) index stays usable
+    return {status, status.lower(), status.title(), status.upper()}
+
+
+def client_order_filters(status=None, date_from=None, date_to=None, payment_method=None):
+    # Orders placed by customers (admin test orders are left out), filtered for the dashboard
+    conditions = [User.is_admin.is_not(True)]
+    if status:
+        conditions.append(Order.status.in_(status_variants(status)))
+    if date_from:
+        conditions.append(Order.created_at >= date_from)
+    if date_to:
+        # date_to is inclusive of the whole day
+        conditions.append(Order.created_at < date_to + timedelta(days=1))
+    if payment_method:
+        conditions.append(Order.payment_method == payment_method)
+    return conditions
+
+
+def status_totals(session, conditions):
+    """Order count and revenue per status in one grouped query, keyed by title-cased status.
+
+    ``conditions`` may reference User, which is joined in.
+    """
+    rows = session.execute(
+        select(Order.status, func.count(Order.id), func.coalesce(func.sum(Order.total_amount), 0))
+        .join(Order.user)
+        .where(*conditions)
+        .group_by(Order.status)
+    ).all()
+    totals = {}
+    for status, count, revenue in rows:
+        key = (status or 'Unknown').title()
+        prev_count, prev_revenue = totals.get(key, (0, 0))
+        totals[key] = (prev_count + count, prev_revenue + revenue)
+    return totals
+
+
+def is_terminal(order):
+    return (order.status or '').upper() in TERMINAL_STATUSES
+
+
+def load_order(session, order_id):
+    """Fetch an order with its address, user and every line's product in two round trips."""
+    return session.execute(
+        select(Order)
+        .options(
+            joinedload(Order.address),
+            joinedload(Order.user),
+            selectinload(Order.items).joinedload(OrderItem.product),
+        )
+        .where(Order.id == order_id)
+    ).unique().scalar_one_or_none()
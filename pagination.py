@@ -0,0 +1,85 @@
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal
+from typing import NamedTuple, Optional
+
+from sqlalchemy import tuple_, DateTime, Numeric, Integer
+
+DEFAULT_PER_PAGE = 20
+MAX_PER_PAGE = 100
+
+
+class Page(NamedTuple):
+    items: list
+    next_cursor: Optional[str]
+    per_page: int
+
+
+def clamp_per_page(value):
+    if not value or value < 1:
+        return DEFAULT_PER_PAGE
+    return min(value, MAX_PER_PAGE)
+
+
+def encode_cursor(values):
+    raw = json.dumps([_dump(v) for v in values]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, columns):
+    # A cursor that can't be parsed is treated as "first page" rather than an error,
+    # so stale or hand-edited links degrade gracefully.
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if len(values) != len(columns):
+            return None
+        return [_load(col, v) for col, v in zip(columns, values)]
+    except (ValueError, TypeError, ArithmeticError):
+        return None
+
+
+def keyset_page(session, stmt, columns, cursor=None, per_page=DEFAULT_PER_PAGE, descending=True):
+    """Run ``stmt`` ordered by ``columns`` and return the page after ``cursor``.
+
+    ``columns`` must end with a unique column (normally the primary key) so the
+    ordering is total and no row is skipped or repeated between pages.
+    """
+    per_page = clamp_per_page(per_page)
+    values = decode_cursor(cursor, columns)
+    if values is not None:
+        key = tuple_(*columns)
+        stmt = stmt.where(key < tuple_(*values) if descending else key > tuple_(*values))
+
+    order = [c.desc() if descending else c.asc() for c in columns]
+    rows = session.execute(stmt.order_by(*order).limit(per_page + 1)).unique().scalars().all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, c.key) for c in columns])
+    return Page(rows, next_cursor, per_page)
+
+
+def _dump(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _load(column, value):
+    if value is None:
+        raise ValueError("keyset columns cannot be NULL")
+    if isinstance(column.type, DateTime):
+        return datetime.fromisoformat(value)
+    if isinstance(column.type, Numeric):
+        return Decimal(value)
+    if isinstance(column.type, Integer):
+        return int(value)
+    return value
@@ -0,0 +1,75 @@
+"""Password hashing on a small, bounded thread pool.
+
+Key derivation is deliberately slow and CPU-bound. Running it on at most
+``workers`` threads keeps a login burst from taking every core away from the
+rest of the site, and the bounded queue turns overload into a quick 503
+instead of an ever-growing backlog. hashlib releases the GIL while it hashes,
+so the pool really does run on ``workers`` cores.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from metrics import Counter, Gauge, Histogram, registry
+
+password_hash_seconds = registry.register(Histogram(
+    "password_hash_seconds", "Time spent deriving a password hash, excluding the wait for a thread",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)))
+password_hash_wait_seconds = registry.register(Histogram(
+    "password_hash_wait_seconds", "Time a password hash waited for a free hashing thread",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)))
+password_hash_rejected_total = registry.register(Counter(
+    "password_hash_rejected_total", "Password hashes refused because the hashing queue was full"))
+
+
+class HashPoolFull(ServiceUnavailable):
+    description = "The server is busy signing people in. Please try again in a moment."
+
+    def __init__(self):
+        super().__init__(retry_after=1)
+
+
+class HashPool:
+    def __init__(self, workers=2, max_queue=32):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self.slots = threading.BoundedSemaphore(workers + max_queue)
+        self.lock = threading.Lock()
+        self.pending = 0
+        registry.register(Gauge("password_hash_queue_depth", "Password hashes waiting for a hashing thread",
+                                self.queue_depth))
+
+    def queue_depth(self):
+        return max(self.pending - self.workers, 0)
+
+    def run(self, func, *args):
+        """Run ``func(*args)`` on the pool and wait for it; raises HashPoolFull when the queue is full."""
+        if not self.slots.acquire(blocking=False):
+            password_hash_rejected_total.inc()
+            raise HashPoolFull()
+        with self.lock:
+            self.pending += 1
+        try:
+            return self.executor.submit(self._timed, time.perf_counter(), func, args).result()
+        finally:
+            with self.lock:
+                self.pending -= 1
+            self.slots.release()
+
+    @staticmethod
+    def _timed(queued_at, func, args):
+        started = time.perf_counter()
+        password_hash_wait_seconds.observe(started - queued_at)
+        try:
+            return func(*args)
+        finally:
+            password_hash_seconds.observe(time.perf_counter() - started)
+
+    def check(self, pwhash, password):
+        return self.run(check_password_hash, pwhash, password)
+
+    def generate(self, password):
+        return self.run(generate_password_hash, password)
@@ -0,0 +1,135 @@
+from datetime import datetime
+
+from sqlalchemy import select, update, exists, or_, and_, case, cast, func, inspect, literal_column, text, true, Integer
+
+from create_db import Product, PriceSchedule
+from category_tree import subtree_query
+from response_cache import CATALOG_VERSION_KEY
+import versions
+
+VERSION_KEY = "pricing"
+
+
+def ensure_schema(engine):
+    """Add products.effective_price to databases created before it existed, then backfill it.
+
+    ``create_all`` only creates missing tables, so an existing products table
+    needs the column (and its sort indexes) added by hand. The backfill uses each
+    product's own discount; the first apply_schedules() run layers sales on top.
+    """
+    columns = {column['name'] for column in inspect(engine).get_columns(Product.__tablename__)}
+    if 'effective_price' in columns:
+        return False
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE products ADD COLUMN effective_price NUMERIC(10, 2)"))
+        for index in Product.__table__.indexes:
+            if 'effective_price' in index.columns:
+                index.create(conn, checkfirst=True)
+        conn.execute(update(Product).values(effective_price=effective_price_expr(func.coalesce(Product.discount, 0))))
+    return True
+
+
+def effective_price_expr(discount):
+    """SQL for ``price`` less ``discount`` percent, rounded half-up to the cent like money.discounted_unit_price.
+
+    Worked in integer cents so SQLite (floats) and Postgres (numeric) round identically.
+    """
+    price_cents = cast(func.round(func.coalesce(Product.price, 0) * 100), Integer)
+    cents = (price_cents * (100 - discount) + 50) // 100
+    return cents / literal_column('100.0')
+
+
+def active_schedules(session, now=None):
+    now = now or datetime.utcnow()
+    return session.execute(
+        select(PriceSchedule)
+        .where(PriceSchedule.starts_at <= now, or_(PriceSchedule.ends_at.is_(None), PriceSchedule.ends_at > now))
+        .order_by(PriceSchedule.discount.desc(), PriceSchedule.id)
+    ).scalars().all()
+
+
+def _active_discount(session, now=None):
+    # Sales don't stack: a product gets the larger of its own discount and the best sale covering it.
+    # Schedules are checked best-first, so the first matching branch is the best sale.
+    base = func.coalesce(Product.discount, 0)
+    branches = []
+    for schedule in active_schedules(session, now):
+        if schedule.product_id is not None:
+            scope = Product.id == schedule.product_id
+        elif schedule.category_id is not None:
+            # Resolved up front: a recursive CTE would be hoisted to the front of the UPDATE,
+            # where SQLite drivers stop reporting a rowcount
+            subtree = session.execute(subtree_query(schedule.category_id)).scalars().all()
+            scope = Product.category_id.in_(subtree)
+        else:
+            scope = true()
+        branches.append((and_(scope, base < schedule.discount), schedule.discount))
+    if not branches:
+        return base
+    return case(*branches, else_=base)
+
+
+def reprice(session, product_ids=None, now=None):
+    """Recompute effective prices in one UPDATE inside the caller's transaction.
+
+    Only rows whose price actually changes are written. Returns how many were.
+    """
+    price = effective_price_expr(_active_discount(session, now))
+    stmt = update(Product).where(Product.effective_price.is_distinct_from(price)).values(effective_price=price)
+    if product_ids is not None:
+        if not product_ids:
+            return 0
+        stmt = stmt.where(Product.id.in_(list(product_ids)))
+    return session.execute(stmt.execution_options(synchronize_session=False)).rowcount
+
+
+def apply_schedules(session, now=None):
+    """Reprice the catalog if a sale started or ended since the last run, and commit.
+
+    Cheap when nothing is due: one query for the last run and one for crossed
+    boundaries. Returns the number of products repriced.
+    """
+    now = now or datetime.utcnow()
+    _, last = versions.current(session, VERSION_KEY)
+    if last is not None:
+        crossed = session.execute(select(exists().where(or_(
+            and_(PriceSchedule.starts_at > last, PriceSchedule.starts_at <= now),
+            and_(PriceSchedule.ends_at > last, PriceSchedule.ends_at <= now),
+        )))).scalar()
+        if not crossed:
+            return 0
+    changed = reprice(session, now=now)
+    versions.bump(session, VERSION_KEY, at=now)
+    if changed:
+        versions.bump(session, CATALOG_VERSION_KEY)
+    session.commit()
+    return changed
+
+
+def schedule_sale(session, discount, starts_at, ends_at=None, product_id=None, category_id=None, name=None):
+    """Add a sale and reprice what it covers if it is already running. Commits."""
+    schedule = PriceSchedule(name=name, discount=discount, starts_at=starts_at, ends_at=ends_at,
+                             product_id=product_id, category_id=category_id)
+    session.add(schedule)
+    session.flush()
+    changed = reprice(session)
+    if changed:
+        versions.bump(session, CATALOG_VERSION_KEY)
+    session.commit()
+    return schedule, changed
+
+
+def end_sale(session, schedule_id, now=None):
+    """End a sale now and put the prices it covered back. Commits; returns products repriced or None."""
+    now = now or datetime.utcnow()
+    schedule = session.get(PriceSchedule, schedule_id)
+    if schedule is None:
+        return None
+    if schedule.ends_at is None or schedule.ends_at > now:
+        schedule.ends_at = now
+    session.flush()
+    changed = reprice(session, now=now)
+    if changed:
+        versions.bump(session, CATALOG_VERSION_KEY)
+    session.commit()
+    return changed
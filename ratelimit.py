@@ -0,0 +1,179 @@
+"""Token-bucket rate limiting keyed by client IP, email or anything else a rule extracts.
+
+A limit such as ``5/minute`` is a bucket holding 5 tokens that refills at
+5 per minute: bursts up to the size of the bucket go through, after which
+requests are let in at the refill rate. Buckets live in process memory or in a
+Redis-compatible server shared by every worker.
+"""
+import hashlib
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from urllib.parse import urlparse, parse_qs
+
+from metrics import Counter, registry
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+rate_limited_total = registry.register(Counter(
+    "rate_limited_total", "Requests rejected by a rate limit, by rule", "rule"))
+
+
+class Limit(NamedTuple):
+    burst: int
+    per_second: float
+
+    @classmethod
+    def parse(cls, value):
+        """``"5/minute"`` -> Limit(5, 5/60). ``"off"`` or an empty value disables the rule (None)."""
+        value = (value or '').strip().lower()
+        if value in ('', 'off', 'none', '0'):
+            return None
+        match = re.fullmatch(r'(\d+)\s*/\s*(second|minute|hour|day)', value)
+        if not match:
+            raise ValueError("rate limit must look like '5/minute', got %r" % value)
+        count = int(match.group(1))
+        return cls(count, count / PERIODS[match.group(2)])
+
+
+class Decision(NamedTuple):
+    allowed: bool
+    retry_after: float  # seconds until the next token, 0 when allowed
+
+
+class MemoryBuckets:
+    """Buckets for one process. Least recently used keys are dropped beyond ``max_entries``,
+    which can only make a limit more lenient, never stricter."""
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()  # key -> (tokens, updated_at)
+
+    def take(self, key, limit, cost=1):
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated_at = self.buckets.pop(key, (limit.burst, now))
+            tokens = min(limit.burst, tokens + (now - updated_at) * limit.per_second)
+            allowed = tokens >= cost
+            if allowed:
+                tokens = min(limit.burst, tokens - cost)  # a negative cost refunds, up to the burst
+            self.buckets[key] = (tokens, now)
+            while len(self.buckets) > self.max_entries:
+                self.buckets.popitem(last=False)
+        return Decision(allowed, 0.0 if allowed else (cost - tokens) / limit.per_second)
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+# Refill and take in one round trip; the server's clock is used so workers' clocks needn't agree
+_TAKE_SCRIPT = """
+local burst = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = math.min(burst, tokens - cost)
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBuckets:
+    """Buckets shared between workers through a Redis-compatible server (Redis, Valkey, KeyDB)."""
+
+    def __init__(self, url, prefix="ratelimit:"):
+        try:
+            import redis
+        except ImportError as exc:
+            raise RuntimeError("a redis:// rate limit URL needs the 'redis' package installed") from exc
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.script = self.client.register_script(_TAKE_SCRIPT)
+
+    def take(self, key, limit, cost=1):
+        allowed, tokens = self.script(keys=[self.prefix + key], args=[limit.burst, limit.per_second, cost])
+        tokens = float(tokens)
+        return Decision(bool(allowed), 0.0 if allowed else (cost - tokens) / limit.per_second)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+
+def buckets_from_url(url, prefix="ratelimit:"):
+    """``memory://?max_entries=N`` (the default) or ``redis://host:port/db``."""
+    parsed = urlparse(url or "memory://")
+    if parsed.scheme == "memory":
+        options = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+        return MemoryBuckets(max_entries=int(options.get("max_entries", 100000)))
+    if parsed.scheme in ("redis", "rediss", "unix"):
+        return RedisBuckets(url, prefix=prefix)
+    raise ValueError("unsupported rate limit URL %r" % url)
+
+
+class Rule:
+    """``limit`` applied per value of ``key()``; a key of None (e.g. an empty form field) skips the rule.
+
+    A ``failures_only`` rule is still checked up front, but ``RateLimiter.succeeded``
+    gives its token back, so only failed attempts use it up.
+    """
+
+    def __init__(self, name, limit, key, failures_only=False):
+        self.name = name
+        self.limit = Limit.parse(limit) if isinstance(limit, str) else limit
+        self.key = key
+        self.failures_only = failures_only
+
+
+class RateLimiter:
+    def __init__(self, buckets):
+        self.buckets = buckets
+
+    def check(self, rules, cost=1):
+        """Take a token from every rule's bucket. Returns None if allowed, else seconds to wait.
+
+        Call it before doing anything expensive: a rejected request should cost
+        the server no more than the bucket lookup.
+        """
+        wait = 0.0
+        for rule in rules:
+            if rule.limit is None:
+                continue
+            value = rule.key()
+            if value is None:
+                continue
+            decision = self.buckets.take("%s:%s" % (rule.name, value), rule.limit, cost)
+            if not decision.allowed:
+                rate_limited_total.inc(label_value=rule.name)
+                wait = max(wait, decision.retry_after)
+        return math.ceil(wait) if wait else None
+
+    def succeeded(self, rules, cost=1):
+        """Refund the tokens ``check`` took for the ``failures_only`` rules among ``rules``."""
+        for rule in rules:
+            if rule.limit is None or not rule.failures_only:
+                continue
+            value = rule.key()
+            if value is not None:
+                self.buckets.take("%s:%s" % (rule.name, value), rule.limit, -cost)
+
+
+def hashed_key(value):
+    """Stable, non-reversible bucket key for personal data such as an email address."""
+    value = (value or '').strip().lower()
+    return hashlib.sha256(value.encode()).hexdigest()[:32] if value else None
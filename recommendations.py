@@ -0,0 +1,185 @@
+"""'Frequently bought together': a co-purchase index built from order history by a batch job.
+
+refresh() counts, for every pair of products, how many orders contained both,
+reading only orders past a stored watermark and adding them to
+``co_purchase_counts``. The top ``top_k`` pairs of every product it touched are
+then copied into ``product_recommendations``, which is all the storefront reads.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, delete, insert, update, func
+from sqlalchemy.dialects import postgresql, sqlite
+
+from create_db import Order, OrderItem, Product, User, AnalyticsState, CoPurchaseCount, ProductRecommendation
+
+STATE_KEY = 'co_purchase'
+DEFAULT_CHUNKSIZE = 50000
+DEFAULT_TOP_K = 20
+# Bulk and wholesale orders say little about what goes together and cost n² pairs each
+MAX_BASKET = 50
+# The watermark only moves past orders at least this old. Ids are handed out before commit, so a
+# newer order can be visible while an older id is still being written
+DEFAULT_SETTLE = timedelta(minutes=5)
+_ID_BATCH = 500
+
+
+class RefreshResult:
+    def __init__(self, orders, pairs, products, last_order_id):
+        self.orders = orders      # orders read
+        self.pairs = pairs        # (product, other) count updates written, one per pair per chunk
+        self.products = products  # products whose recommendations were rebuilt
+        self.last_order_id = last_order_id
+
+
+def _item_frames(connection, after_id, upto_id, chunksize):
+    import pandas as pd
+
+    stmt = (
+        select(OrderItem.order_id, OrderItem.product_id)
+        .join(OrderItem.order)
+        .join(Order.user)
+        # Same population as the sales summaries: no admin test orders, no cancelled ones
+        .where(User.is_admin.is_not(True), func.lower(Order.status) != 'cancelled',
+               Order.id > after_id, Order.id <= upto_id, OrderItem.product_id.is_not(None))
+        .order_by(OrderItem.order_id)
+    )
+    return pd.read_sql(stmt, connection, chunksize=chunksize)
+
+
+def _baskets(frames):
+    """Chunks of (order_id, product_id) rows that never split an order between two chunks."""
+    import pandas as pd
+
+    carry = None
+    for frame in frames:
+        if frame.empty:
+            continue
+        if carry is not None:
+            frame = pd.concat([carry, frame], ignore_index=True)
+        # Rows arrive ordered by order_id, so only the last order may continue in the next chunk
+        last = frame['order_id'].iat[-1]
+        tail = frame['order_id'].to_numpy() == last
+        carry = frame[tail]
+        if not tail.all():
+            yield frame[~tail]
+    if carry is not None and len(carry):
+        yield carry
+
+
+def _count_pairs(frame, max_basket):
+    """``(keys, counts)``: how many orders contained each ordered pair of distinct products, or None."""
+    import numpy as np
+
+    frame = frame.drop_duplicates(['order_id', 'product_id'])
+    sizes = frame.groupby('order_id', sort=False)['product_id'].transform('size').to_numpy()
+    frame = frame[(sizes > 1) & (sizes <= max_basket)]
+    if frame.empty:
+        return None
+    pairs = frame.merge(frame, on='order_id', suffixes=('', '_other'))
+    pairs = pairs[pairs['product_id'].to_numpy() != pairs['product_id_other'].to_numpy()]
+    # Counting packed int64 keys (ids fit in 32 bits) is much faster than grouping on two columns
+    a = pairs['product_id'].to_numpy(dtype=np.int64)
+    b = pairs['product_id_other'].to_numpy(dtype=np.int64)
+    keys, counts = np.unique((a << 32) | b, return_counts=True)
+    return keys, counts
+
+
+def _add_counts(session, records):
+    dialect = session.get_bind(CoPurchaseCount).dialect
+    if dialect.name in ('sqlite', 'postgresql'):
+        dialect_insert = sqlite.insert if dialect.name == 'sqlite' else postgresql.insert
+        stmt = dialect_insert(CoPurchaseCount)
+        stmt = stmt.on_conflict_do_update(index_elements=['product_id', 'other_id'],
+                                          set_={'orders': CoPurchaseCount.orders + stmt.excluded.orders})
+        session.execute(stmt, records)
+        return
+    for record in records:
+        updated = session.execute(
+            update(CoPurchaseCount).filter_by(product_id=record['product_id'], other_id=record['other_id'])
+            .values(orders=CoPurchaseCount.orders + record['orders'])
+        ).rowcount
+        if not updated:
+            session.execute(insert(CoPurchaseCount).values(record))
+
+
+def _rebuild_top(session, product_ids, top_k):
+    for start in range(0, len(product_ids), _ID_BATCH):
+        batch = product_ids[start:start + _ID_BATCH]
+        ranked = select(
+            CoPurchaseCount.product_id, CoPurchaseCount.other_id, CoPurchaseCount.orders,
+            func.row_number().over(partition_by=CoPurchaseCount.product_id,
+                                   order_by=(CoPurchaseCount.orders.desc(), CoPurchaseCount.other_id)).label('rank'),
+        ).where(CoPurchaseCount.product_id.in_(batch)).subquery()
+        session.execute(delete(ProductRecommendation).where(ProductRecommendation.product_id.in_(batch)))
+        session.execute(insert(ProductRecommendation).from_select(
+            ['product_id', 'rank', 'recommended_id', 'orders'],
+            select(ranked.c.product_id, ranked.c.rank, ranked.c.other_id, ranked.c.orders)
+            .where(ranked.c.rank <= top_k)))
+
+
+def refresh(session, full=False, chunksize=DEFAULT_CHUNKSIZE, top_k=DEFAULT_TOP_K, max_basket=MAX_BASKET,
+            settle=DEFAULT_SETTLE):
+    """Add orders placed since the last refresh, and older than ``settle``, to the co-purchase index and commit.
+
+    Counts only grow: an order cancelled after it was counted stays counted
+    until the next ``full`` rebuild, which recounts everything.
+    """
+    import numpy as np
+
+    state = session.get(AnalyticsState, STATE_KEY)
+    if state is None:
+        state = AnalyticsState(name=STATE_KEY, last_order_id=0)
+        session.add(state)
+    after_id = 0 if full else state.last_order_id
+    # Fixed up front so orders placed while this runs are left whole for the next refresh
+    upto_id = session.execute(
+        select(func.max(Order.id)).where(Order.created_at < datetime.utcnow() - settle)).scalar() or 0
+
+    if full:
+        session.execute(delete(CoPurchaseCount))
+        session.execute(delete(ProductRecommendation))
+    # Each chunk's counts are added to the table as soon as they are known, so memory is bounded
+    # by the pairs in one chunk rather than by every pair in the order history
+    n_orders, n_pairs, touched = 0, 0, set()
+    for frame in _baskets(_item_frames(session.connection(), after_id, upto_id, chunksize)):
+        n_orders += frame['order_id'].nunique()
+        counted = _count_pairs(frame, max_basket)
+        if counted is None:
+            continue
+        keys, counts = counted
+        products = (keys >> 32).astype(np.int64)
+        others = (keys & 0xFFFFFFFF).astype(np.int64)
+        for start in range(0, len(keys), chunksize):
+            part = slice(start, start + chunksize)
+            _add_counts(session, [{'product_id': int(p), 'other_id': int(o), 'orders': int(n)}
+                                  for p, o, n in zip(products[part], others[part], counts[part])])
+        n_pairs += len(keys)
+        touched.update(np.unique(products).tolist())
+    touched = sorted(touched)
+    _rebuild_top(session, touched, top_k)
+
+    state.last_order_id = max(after_id, upto_id)
+    state.refreshed_at = datetime.utcnow()
+    session.commit()
+    return RefreshResult(n_orders, n_pairs, len(touched), state.last_order_id)
+
+
+def bought_together(session, product_ids, limit=4):
+    """In-stock products most often bought with any of ``product_ids``, best first. One query."""
+    ids = sorted({product_id for product_id in product_ids if product_id is not None})
+    if not ids:
+        return []
+    score = func.sum(ProductRecommendation.orders).label('score')
+    scored = (
+        select(ProductRecommendation.recommended_id, score)
+        .where(ProductRecommendation.product_id.in_(ids), ProductRecommendation.recommended_id.not_in(ids))
+        .group_by(ProductRecommendation.recommended_id)
+        .subquery()
+    )
+    return session.execute(
+        select(Product)
+        .join(scored, Product.id == scored.c.recommended_id)
+        .where(Product.stock_quantity > 0)
+        .order_by(scored.c.score.desc(), Product.id)
+        .limit(limit)
+    ).scalars().all()
@@ -0,0 +1,105 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import g, request, session, make_response
+from flask_login import current_user
+
+import versions
+
+CATALOG_VERSION_KEY = "catalog"
+
+
+class PageCache:
+    """Whole-response cache for anonymous GETs, keyed by route, query string and data versions.
+
+    ``version_keys`` name the cache_versions rows a page depends on. Writers bump
+    those rows in their transaction, which changes the key of every page built from
+    the old data, so entries never need to be found and deleted. The backend's TTL
+    only bounds how long unreachable entries linger.
+
+    Data that changes with every cart or order, like stock levels, would empty the
+    cache if it were versioned. ``live`` maps a name to ``fetch(session, ids) ->
+    {id: value}`` instead: a view records what it showed with ``shown()``, and a hit
+    is only served while one fetch of those ids still returns the same values.
+    """
+
+    def __init__(self, backend, get_session, version_keys=(CATALOG_VERSION_KEY,), live=None):
+        self.backend = backend
+        self.get_session = get_session
+        self.version_keys = tuple(version_keys)
+        self.live = dict(live or {})
+
+    def shown(self, name, values):
+        """Note the ``live`` values ({id: value}) the page being rendered displays."""
+        if name not in self.live:
+            raise KeyError("no live data registered as %r" % name)
+        if "page_cache_shown" in g:
+            g.page_cache_shown[name] = sorted(values.items())
+
+    def still_shown(self, session, entry):
+        for name, pairs in entry.get("shown", {}).items():
+            current = self.live[name](session, [item_id for item_id, _ in pairs])
+            if any(current.get(item_id) != value for item_id, value in pairs):
+                return False
+        return True
+
+    def cacheable(self):
+        # Logged-in pages carry per-user chrome, and a pending flash message is one-off
+        return (request.method == "GET"
+                and not current_user.is_authenticated
+                and "_flashes" not in session)
+
+    def key_for(self, stamps):
+        args = "&".join("%s=%s" % kv for kv in sorted(request.args.items(multi=True)))
+        data_version = ".".join(str(stamps[name][0]) for name in self.version_keys)
+        return "page:%s:%s:%s?%s" % (data_version, request.endpoint,
+                                     ",".join("%s=%s" % kv for kv in sorted((request.view_args or {}).items())),
+                                     args)
+
+    def cached(self, view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not self.cacheable():
+                return view(*args, **kwargs)
+
+            db_session = self.get_session()
+            stamps = versions.current_many(db_session, self.version_keys)
+            key = self.key_for(stamps)
+            entry = self.backend.get(key)
+            stale = entry is not None and not self.still_shown(db_session, entry)
+            if entry is None or stale:
+                g.page_cache_shown = {}
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                body = response.get_data(as_text=True)
+                entry = {
+                    "body": body,
+                    "content_type": response.content_type,
+                    "etag": hashlib.sha1(body.encode("utf-8")).hexdigest(),
+                    # Rebuilt under the same key, so the versions alone no longer date it
+                    "last_modified": time.time() if stale else _last_modified(stamps),
+                    "shown": g.page_cache_shown,
+                }
+                self.backend.set(key, entry)
+            else:
+                response = make_response(entry["body"])
+                response.content_type = entry["content_type"]
+
+            response.set_etag(entry["etag"])
+            if entry["last_modified"]:
+                response.last_modified = datetime.fromtimestamp(entry["last_modified"], timezone.utc)
+            # Browsers must revalidate, and a page seen while logged out must not be reused after login
+            response.headers["Cache-Control"] = "no-cache"
+            response.vary.add("Cookie")
+            return response.make_conditional(request)
+        return wrapper
+
+
+def _last_modified(stamps):
+    times = [updated_at for _, updated_at in stamps.values() if updated_at is not None]
+    if not times:
+        return None
+    return max(times).replace(tzinfo=timezone.utc).timestamp()
@@ -0,0 +1,214 @@
+import math
+import re
+import threading
+from collections import defaultdict, Counter
+
+from sqlalchemy import text, select
+
+from create_db import Product
+from response_cache import CATALOG_VERSION_KEY
+import versions
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+MAX_QUERY_TERMS = 10
+
+
+def tokenize(value):
+    return TOKEN_RE.findall((value or "").lower())
+
+
+class SearchResult:
+    def __init__(self, ids, total):
+        self.ids = ids
+        self.total = total
+
+
+class Fts5Index:
+    """SQLite FTS5 table keyed by product id, ranked with bm25 (name weighted above description)."""
+
+    name = "fts5"
+
+    def setup(self, session):
+        session.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts "
+            "USING fts5(name, description, tokenize='porter unicode61')"
+        ))
+        indexed = session.execute(text("SELECT count(*) FROM products_fts")).scalar()
+        if not indexed:
+            session.execute(text(
+                "INSERT INTO products_fts(rowid, name, description) "
+                "SELECT id, coalesce(name, ''), coalesce(description, '') FROM products"
+            ))
+        session.commit()
+
+    def index_products(self, session, products):
+        rows = [{"id": p.id, "name": p.name or "", "description": p.description or ""} for p in products]
+        if not rows:
+            return
+        session.execute(text("DELETE FROM products_fts WHERE rowid = :id"), rows)
+        session.execute(text(
+            "INSERT INTO products_fts(rowid, name, description) VALUES (:id, :name, :description)"
+        ), rows)
+
+    def remove_products(self, session, product_ids):
+        if product_ids:
+            session.execute(text("DELETE FROM products_fts WHERE rowid = :id"),
+                            [{"id": pid} for pid in product_ids])
+
+    def search(self, session, query, limit, offset):
+        terms = tokenize(query)[:MAX_QUERY_TERMS]
+        if not terms:
+            return SearchResult([], 0)
+        # Quote every term so user input can't inject FTS5 syntax; the last one is a prefix match
+        match = " ".join('"%s"' % t for t in terms[:-1]) + ' "%s"*' % terms[-1]
+        ids = session.execute(text(
+            "SELECT rowid FROM products_fts WHERE products_fts MATCH :match "
+            "ORDER BY bm25(products_fts, 10.0, 1.0) LIMIT :limit OFFSET :offset"
+        ), {"match": match.strip(), "limit": limit, "offset": offset}).scalars().all()
+        total = session.execute(text(
+            "SELECT count(*) FROM products_fts WHERE products_fts MATCH :match"
+        ), {"match": match.strip()}).scalar()
+        return SearchResult(ids, total)
+
+
+class PostgresIndex:
+    """GIN index over a tsvector expression on products; Postgres keeps it current on every write."""
+
+    name = "postgres"
+    document = ("setweight(to_tsvector('english', coalesce(products.name, '')), 'A') || "
+                "setweight(to_tsvector('english', coalesce(products.description, '')), 'B')")
+
+    def setup(self, session):
+        session.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_products_search ON products USING GIN ((%s))" % self.document
+        ))
+        session.commit()
+
+    def index_products(self, session, products):
+        pass
+
+    def remove_products(self, session, product_ids):
+        pass
+
+    def search(self, session, query, limit, offset):
+        if not tokenize(query):
+            return SearchResult([], 0)
+        params = {"q": query, "limit": limit, "offset": offset}
+        ids = session.execute(text(
+            "SELECT id FROM products WHERE (%s) @@ websearch_to_tsquery('english', :q) "
+            "ORDER BY ts_rank_cd((%s), websearch_to_tsquery('english', :q)) DESC, id "
+            "LIMIT :limit OFFSET :offset" % (self.document, self.document)
+        ), params).scalars().all()
+        total = session.execute(text(
+            "SELECT count(*) FROM products WHERE (%s) @@ websearch_to_tsquery('english', :q)" % self.document
+        ), params).scalar()
+        return SearchResult(ids, total)
+
+
+class MemoryIndex:
+    """Pure-Python inverted index for backends without native full-text search.
+
+    The postings live in this process only, so each worker builds its own copy
+    on the first search and rebuilds it whenever the catalog version has moved.
+    Every product write bumps that version in its own transaction, so the index
+    follows committed writes from any process and never sees rolled-back ones;
+    the write hooks have nothing to do.
+    """
+
+    name = "memory"
+    name_weight = 3.0
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None                # catalog version the postings were built from
+        self.postings = defaultdict(dict)  # term -> {product_id: weighted tf}
+        self.doc_terms = {}                # product_id -> set of terms, for removal
+        self.doc_lengths = {}
+
+    def setup(self, session):
+        pass
+
+    def _build(self, session, version):
+        self.postings.clear()
+        self.doc_terms.clear()
+        self.doc_lengths.clear()
+        rows = session.execute(
+            select(Product.id, Product.name, Product.description).execution_options(yield_per=1000)
+        )
+        for pid, name, description in rows:
+            self._add(pid, name, description)
+        self.version = version
+
+    def _add(self, pid, name, description):
+        weights = Counter()
+        for term in tokenize(name):
+            weights[term] += self.name_weight
+        for term in tokenize(description):
+            weights[term] += 1.0
+        for term, weight in weights.items():
+            self.postings[term][pid] = weight
+        self.doc_terms[pid] = set(weights)
+        self.doc_lengths[pid] = sum(weights.values())
+
+    def index_products(self, session, products):
+        pass
+
+    def remove_products(self, session, product_ids):
+        pass
+
+    def _prefix_postings(self, prefix):
+        # The last query term matches as a prefix, like the FTS5 backend
+        docs = dict(self.postings.get(prefix, {}))
+        for term, postings in self.postings.items():
+            if term != prefix and term.startswith(prefix):
+                for pid, tf in postings.items():
+                    docs[pid] = max(docs.get(pid, 0), tf)
+        return docs
+
+    def search(self, session, query, limit, offset):
+        terms = tokenize(query)[:MAX_QUERY_TERMS]
+        if not terms:
+            return SearchResult([], 0)
+        version, _ = versions.current(session, CATALOG_VERSION_KEY)
+        with self.lock:
+            if version != self.version:
+                self._build(session, version)
+            n_docs = len(self.doc_lengths) or 1
+            avg_len = sum(self.doc_lengths.values()) / n_docs
+            scores = Counter()
+            matched = None
+            for i, term in enumerate(terms):
+                if i == len(terms) - 1:
+                    docs = self._prefix_postings(term)
+                else:
+                    docs = self.postings.get(term, {})
+                matched = set(docs) if matched is None else matched & set(docs)
+                idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                for pid, tf in docs.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[pid] / avg_len)
+                    scores[pid] += idf * tf * (self.k1 + 1) / (tf + norm)
+        # Every term must match, as with the SQL backends
+        ranked = sorted(matched or (), key=lambda pid: (-scores[pid], pid))
+        return SearchResult(ranked[offset:offset + limit], len(ranked))
+
+
+def _sqlite_has_fts5(dbapi):
+    # Probed on a private in-memory database, so picking a backend never connects to the real one
+    conn = dbapi.connect(":memory:")
+    try:
+        conn.execute("CREATE VIRTUAL TABLE fts5_probe USING fts5(x)")
+        return True
+    except dbapi.OperationalError:
+        return False
+    finally:
+        conn.close()
+
+
+def index_for(engine):
+    if engine.dialect.name == "sqlite":
+        return Fts5Index() if _sqlite_has_fts5(engine.dialect.dbapi) else MemoryIndex()
+    if engine.dialect.name == "postgresql":
+        return PostgresIndex()
+    return MemoryIndex()
@@ -0,0 +1,150 @@
+import logging
+import re
+import time
+from collections import Counter as Tally
+
+from flask import g, has_request_context, request, Response, abort
+from sqlalchemy import event
+
+from metrics import Histogram, Counter, Gauge, registry
+
+log = logging.getLogger(__name__)
+
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+
+requests_total = registry.register(Counter(
+    "http_requests_total", "Requests handled, by endpoint", label="endpoint"))
+sql_queries_total = registry.register(Counter(
+    "sql_queries_total", "SQL statements executed while handling requests, by endpoint", label="endpoint"))
+sql_seconds_total = registry.register(Counter(
+    "sql_seconds_total", "Time spent in SQL while handling requests, by endpoint", label="endpoint"))
+sql_duplicates_total = registry.register(Counter(
+    "sql_duplicate_statements_total",
+    "Repeated executions of an identical statement shape within one request (N+1 suspects), by endpoint",
+    label="endpoint"))
+sql_budget_exceeded_total = registry.register(Counter(
+    "sql_query_budget_exceeded_total", "Requests that issued more queries than their budget, by endpoint",
+    label="endpoint"))
+queries_per_request = registry.register(Histogram(
+    "sql_queries_per_request", "SQL statements per request", buckets=QUERY_COUNT_BUCKETS))
+sql_seconds_per_request = registry.register(Histogram(
+    "sql_seconds_per_request", "Time spent in SQL per request"))
+
+_PLACEHOLDER = r"(?:\?|%s|%\(\w+\)s|:\w+)"
+_IN_LIST_RE = re.compile(r"\(\s*%s(?:\s*,\s*%s)+\s*\)" % (_PLACEHOLDER, _PLACEHOLDER))
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SPACE_RE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def fingerprint(statement):
+    """Reduce a statement to its shape so repeated lookups with different ids compare equal."""
+    statement = _STRING_RE.sub("?", statement)
+    statement = _NUMBER_RE.sub("?", statement)
+    statement = _IN_LIST_RE.sub("(?)", statement)
+    return _SPACE_RE.sub(" ", statement).strip()
+
+
+class RequestQueryStats:
+    __slots__ = ("count", "seconds", "fingerprints")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.fingerprints = Tally()
+
+    def duplicates(self, threshold=2):
+        return [(fp, n) for fp, n in self.fingerprints.most_common() if n >= threshold]
+
+
+def query_budget(max_queries):
+    """Declare the most queries a view may issue; checked after every request."""
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+def current_stats():
+    return g.get("sql_stats") if has_request_context() else None
+
+
+def init_app(app, engine):
+    app.config.setdefault("SQL_QUERY_BUDGET_STRICT", False)
+    app.config.setdefault("SQL_DEFAULT_QUERY_BUDGET", None)
+    app.config.setdefault("SQL_DUPLICATE_THRESHOLD", 3)
+    app.config.setdefault("METRICS_TOKEN", None)
+
+    if hasattr(engine.pool, "checkedout"):
+        registry.register(Gauge("db_pool_checked_out", "Connections currently checked out of the pool",
+                                engine.pool.checkedout))
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        if context.connection is not None and context.connection.info.get("query_started"):
+            context.connection.info["query_started"].pop()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        stats = current_stats()
+        if stats is not None:
+            stats.count += 1
+            stats.seconds += time.perf_counter() - started
+            stats.fingerprints[fingerprint(statement)] += 1
+
+    @app.before_request
+    def start_request_stats():
+        g.sql_stats = RequestQueryStats()
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def finish_request_stats(response):
+        stats = g.pop("sql_stats", None)
+        if stats is None:
+            return response
+        endpoint = request.endpoint or "unknown"
+        elapsed = time.perf_counter() - g.pop("request_started")
+
+        requests_total.inc(label_value=endpoint)
+        sql_queries_total.inc(stats.count, label_value=endpoint)
+        sql_seconds_total.inc(stats.seconds, label_value=endpoint)
+        queries_per_request.observe(stats.count)
+        sql_seconds_per_request.observe(stats.seconds)
+
+        duplicates = stats.duplicates(app.config["SQL_DUPLICATE_THRESHOLD"])
+        for statement, times in duplicates:
+            sql_duplicates_total.inc(times - 1, label_value=endpoint)
+            log.warning("possible N+1 in %s: statement ran %d times: %s", endpoint, times, statement[:200])
+
+        response.headers.add(
+            "Server-Timing",
+            'db;dur=%.2f;desc="%d queries", app;dur=%.2f' % (stats.seconds * 1000, stats.count, elapsed * 1000)
+        )
+
+        view = app.view_functions.get(request.endpoint)
+        budget = getattr(view, "query_budget", None) or app.config["SQL_DEFAULT_QUERY_BUDGET"]
+        if budget is not None and stats.count > budget:
+            sql_budget_exceeded_total.inc(label_value=endpoint)
+            message = "%s issued %d queries (budget %d)" % (endpoint, stats.count, budget)
+            if duplicates:
+                message += "; repeated: " + "; ".join("%dx %s" % (n, fp[:120]) for fp, n in duplicates[:3])
+            if app.config["SQL_QUERY_BUDGET_STRICT"]:
+                raise QueryBudgetExceeded(message)
+            log.warning(message)
+        return response
+
+    @app.route("/_metrics")
+    def prometheus_metrics():
+        token = app.config["METRICS_TOKEN"]
+        if token and request.headers.get("Authorization") != "Bearer " + token:
+            abort(403)
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,127 @@
+"""One throwaway SQLite database for the whole run, configured before ``main`` is imported.
+
+Tests share the database, so every row they need is created through the
+factories below with fresh names and emails instead of assuming empty tables.
+"""
+import itertools
+import os
+import tempfile
+import uuid
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+_WORKDIR = tempfile.mkdtemp(prefix="shop-tests-")
+os.environ["DB_URI"] = "sqlite:///" + os.path.join(_WORKDIR, "shop.db")
+os.environ.setdefault("secret_key", "tests")
+# Every test client shares one address; tests that need a throttle build their own RateLimiter
+for _name in ("RATE_LIMIT_LOGIN_IP", "RATE_LIMIT_LOGIN_EMAIL", "RATE_LIMIT_SIGNUP_IP", "RATE_LIMIT_SIGNUP_EMAIL"):
+    os.environ[_name] = "off"
+
+import main as shop  # noqa: E402
+from create_db import User, Category, Product, Address, Order, OrderItem  # noqa: E402
+
+PASSWORD = "secret"
+_PASSWORD_HASH = shop.generate_password_hash(PASSWORD)
+_RUN = uuid.uuid4().hex[:8]
+_serial = itertools.count(1)
+
+
+@pytest.fixture
+def app():
+    shop.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    return shop.app
+
+
+@pytest.fixture
+def db(app):
+    with app.app_context():
+        yield shop.db
+
+
+@pytest.fixture
+def make_user(app):
+    """``make_user(is_admin=False)`` -> namespace with the new user's id, email and address_id."""
+    def make(is_admin=False):
+        n = next(_serial)
+        with app.app_context():
+            user = User(name="user %d" % n, email="user%d-%s@test.example" % (n, _RUN), password=_PASSWORD_HASH,
+                        is_admin=is_admin)
+            shop.db.session.add(user)
+            shop.db.session.flush()
+            address = Address(user_id=user.id, full_name=user.name, street="1 Test St", city="Test",
+                              zip_code="00000", country="Test", phone="0")
+            shop.db.session.add(address)
+            shop.db.session.commit()
+            return SimpleNamespace(id=user.id, email=user.email, address_id=address.id)
+    return make
+
+
+@pytest.fixture
+def make_category(app):
+    def make():
+        with app.app_context():
+            category = Category(name="category %d-%s" % (next(_serial), _RUN))
+            shop.db.session.add(category)
+            shop.db.session.commit()
+            return category.id
+    return make
+
+
+@pytest.fixture
+def make_product(app):
+    """``make_product(stock=5, price="10.00", ...)`` -> the new product's id."""
+    def make(stock=5, price="10.00", discount=0, category_id=None, created_at=None):
+        with app.app_context():
+            product = Product(name="product %d-%s" % (next(_serial), _RUN), description="", price=Decimal(price),
+                              discount=discount, stock_quantity=stock, image_url="", category_id=category_id)
+            if created_at is not None:
+                product.created_at = created_at
+            shop.db.session.add(product)
+            shop.db.session.commit()
+            return product.id
+    return make
+
+
+@pytest.fixture
+def make_order(app):
+    """``make_order(user, product_ids, status="pending", ...)`` -> the new order's id, one unit of each product."""
+    def make(user, product_ids, status="pending", price="1.00", created_at=None, id=None):
+        with app.app_context():
+            order = Order(id=id, user_id=user.id, address_id=user.address_id, status=status, payment_method="cod",
+                          total_amount=Decimal(price) * len(product_ids))
+            if created_at is not None:
+                order.created_at = created_at
+            shop.db.session.add(order)
+            shop.db.session.flush()
+            shop.db.session.add_all([OrderItem(order_id=order.id, product_id=product_id, quantity=1,
+                                               price_each=Decimal(price)) for product_id in product_ids])
+            shop.db.session.commit()
+            return order.id
+    return make
+
+
+@pytest.fixture
+def login(app):
+    """``login(user)`` -> a test client signed in as ``user``."""
+    def sign_in(user):
+        client = app.test_client()
+        response = client.post("/login", data={"email": user.email, "password": PASSWORD})
+        assert response.status_code == 302 and "/login" not in response.headers["Location"], response.status_code
+        return client
+    return sign_in
+
+
+@pytest.fixture
+def make_customer(make_user, login):
+    """``make_customer()`` -> a new shopper's id, email and address_id plus ``client``, already signed in."""
+    def make():
+        user = make_user()
+        return SimpleNamespace(**vars(user), client=login(user))
+    return make
+
+
+@pytest.fixture
+def customer(make_customer):
+    return make_customer()
@@ -0,0 +1,47 @@
+import itertools
+import re
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+import main as shop
+from orders import client_order_filters, status_totals
+
+_days = itertools.count()
+
+
+@pytest.fixture
+def placed(make_user, make_product, make_order):
+    """``(day, ids)``: orders on an otherwise empty day, in two statuses spelled several ways, plus an
+    admin's order that day and a customer's the day after."""
+    day = datetime(2001, 1, 1) + timedelta(days=2 * next(_days))
+    noon = day + timedelta(hours=12)
+    customer, admin, product_id = make_user(), make_user(is_admin=True), make_product()
+    ids = {
+        "pending": make_order(customer, [product_id], status="pending", price="10.00", created_at=noon),
+        "Pending": make_order(customer, [product_id], status="Pending", price="2.50", created_at=noon),
+        "PAID": make_order(customer, [product_id], status="PAID", price="4.00", created_at=noon),
+        "admin": make_order(admin, [product_id], status="pending", price="100.00", created_at=noon),
+        "next day": make_order(customer, [product_id], status="pending", price="1.00",
+                               created_at=noon + timedelta(days=1)),
+    }
+    return day, ids
+
+
+def test_totals_merge_status_spellings_and_leave_admin_orders_out(db, placed):
+    day, _ = placed
+    totals = status_totals(db.session, client_order_filters(date_from=day, date_to=day))
+    assert totals == {"Pending": (2, Decimal("12.50")), "Paid": (1, Decimal("4.00"))}
+    # Filtering on one spelling still finds them all
+    pending = status_totals(db.session, client_order_filters(status="PENDING", date_from=day, date_to=day))
+    assert pending == {"Pending": (2, Decimal("12.50"))}
+
+
+def test_the_dashboard_filters_its_list_but_not_its_totals(app, placed, make_user, login):
+    day, ids = placed
+    admin = login(make_user(is_admin=True))
+    body = admin.get("/admin/orders?status=paid&date_from=%s&date_to=%s" % (day.date(), day.date())).get_data(
+        as_text=True)
+    assert [int(i) for i in re.findall(r"<td>#(\d+)</td>", body)] == [ids["PAID"]]
+    assert "12.50" in body  # the pending column of the totals is still shown
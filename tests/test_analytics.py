@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, func
+
+import analytics
+import main as shop
+from create_db import AnalyticsState, Order
+
+
+def revenue(session, day):
+    report = analytics.report(session, day, day)
+    return dict((d, r) for d, _, r in report.by_day).get(day, 0)
+
+
+def test_the_watermark_waits_for_ids_committed_out_of_order(db, make_user, make_product, make_order):
+    user, product_id = make_user(), make_product()
+    analytics.refresh(db.session)
+    late_id = (db.session.execute(select(func.max(Order.id))).scalar() or 0) + 10
+
+    # The later id commits first, while the earlier one is still being written
+    make_order(user, [product_id], price="7.00", id=late_id + 1)
+    analytics.refresh(db.session)
+    assert db.session.get(AnalyticsState, analytics.STATE_KEY).last_order_id < late_id
+
+    make_order(user, [product_id], price="5.00", id=late_id)
+    day = db.session.get(Order, late_id).created_at.date()
+    before = revenue(db.session, day)
+    result = analytics.refresh(db.session, settle=timedelta(0))
+    assert result.last_order_id == late_id + 1
+    assert revenue(db.session, day) - before == pytest.approx(5)
+
+
+def test_refresh_follows_new_orders_and_later_status_changes(db, make_user, make_category, make_product, make_order):
+    day = datetime(1999, 6, 1, 12)
+    user, category_id = make_user(), make_category()
+    product_id = make_product(category_id=category_id)
+    pending = make_order(user, [product_id], price="10.00", created_at=day)
+    make_order(user, [product_id, product_id], status="Paid", price="2.00", created_at=day)
+
+    analytics.refresh(db.session, settle=timedelta(0))
+    report = analytics.report(db.session, day.date(), day.date())
+    assert [(d, n, r) for d, n, r in report.by_day] == [(day.date(), 2, pytest.approx(14))]
+    assert report.cancellation == (0, 2, 0.0)
+    assert [(row[0], row[2]) for row in report.top_products] == [(product_id, 3)]
+
+    # The pending order was still open, so the next refresh sees it cancelled
+    db.session.get(Order, pending).status = "Cancelled"
+    db.session.commit()
+    analytics.refresh(db.session, settle=timedelta(0))
+    report = analytics.report(db.session, day.date(), day.date())
+    assert [r for _, _, r in report.by_day] == [pytest.approx(4)]
+    assert report.cancellation == (1, 2, 0.5)
+
+    analytics.refresh(db.session, full=True, settle=timedelta(0))
+    rebuilt = analytics.report(db.session, day.date(), day.date())
+    assert (rebuilt.by_day, rebuilt.cancellation) == (report.by_day, report.cancellation)
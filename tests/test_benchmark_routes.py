@@ -0,0 +1,34 @@
+import pytest
+
+import main as shop
+from benchmarks import dataset, suite
+
+SCALE = {"users": 3, "categories": 6, "depth": 2, "products": 40, "orders_per_user": 2, "items_per_order": 2,
+         "cart_lines": 2, "seed": 7}
+
+
+@pytest.fixture(scope="module")
+def manifest():
+    shop.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    return dataset.seed(shop, SCALE, progress=lambda message: None)
+
+
+@pytest.mark.parametrize("route", suite.routes({"products": [1, 1], "categories": [1]}), ids=lambda r: r.name)
+def test_every_benchmark_route_runs_within_its_query_budget(app, manifest, route, monkeypatch):
+    monkeypatch.setitem(app.config, "SQL_QUERY_BUDGET_STRICT", True)
+    users = manifest["users"]
+    customers = []
+    for user in users:
+        session = suite.TestClientSession(app)
+        status, _ = session.request("POST", "/login", {"email": user["email"], "password": manifest["password"]})
+        assert status == 302
+        customers.append(session)
+    sessions = [suite.TestClientSession(app) for _ in users] if route.anonymous else customers
+
+    # Rebuilt from the seeded manifest: the parametrize list only supplies the route names
+    route = next(r for r in suite.routes(manifest) if r.name == route.name)
+    result = suite.measure(route, sessions, users, requests=6, warmup=1, seed=SCALE["seed"])
+    assert result["errors"] == 0, result["error_samples"]
+    assert result["requests"] == 6
+    budget = getattr(app.view_functions[route.name.replace("checkout_submit", "checkout")], "query_budget")
+    assert result["queries_max"] <= budget
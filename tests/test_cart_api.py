@@ -0,0 +1,90 @@
+import inventory
+import main as shop
+from create_db import CartUpdateToken
+
+
+def post(client, body, **headers):
+    response = client.post("/api/cart", json=body, headers=headers)
+    return response.status_code, response.get_json()
+
+
+def test_a_replayed_idempotency_key_changes_nothing(app, customer, make_product):
+    product_id = make_product(stock=5)
+    client = customer.client
+    body = {"changes": [{"product_id": product_id, "delta": 1}, {"product_id": product_id, "delta": 1}]}
+
+    status, first = post(client, body, **{"Idempotency-Key": "retry-1"})
+    assert status == 200 and first["replayed"] is False
+    assert first["changes"] == [{"product_id": product_id, "requested": 2, "quantity": 2, "limited": False}]
+
+    status, again = post(client, body, **{"Idempotency-Key": "retry-1"})
+    assert status == 200 and again["replayed"] is True and again["changes"] == []
+    assert [(line["product_id"], line["quantity"]) for line in again["lines"]] == [(product_id, 2)]
+    with app.app_context():
+        assert inventory.holds_for(shop.db.session, customer.id)[product_id][0] == 2
+
+
+def test_a_token_in_the_body_works_like_the_header(customer, make_product):
+    product_id = make_product(stock=5)
+    client = customer.client
+    body = {"changes": [{"product_id": product_id, "delta": 1}], "token": "body-token"}
+    assert post(client, body)[1]["replayed"] is False
+    assert post(client, body)[1]["replayed"] is True
+    # A new token is a new batch
+    _, cart = post(client, dict(body, token="body-token-2"))
+    assert cart["lines"][0]["quantity"] == 2
+
+
+def test_tokens_are_per_user(make_customer, make_product):
+    product_id = make_product(stock=5)
+    body = {"changes": [{"product_id": product_id, "delta": 1}]}
+    assert post(make_customer().client, body, **{"Idempotency-Key": "shared"})[1]["replayed"] is False
+    assert post(make_customer().client, body, **{"Idempotency-Key": "shared"})[1]["replayed"] is False
+
+
+def test_stock_limits_the_batch(customer, make_product):
+    product_id = make_product(stock=3)
+    _, cart = post(customer.client, {"changes": [{"product_id": product_id, "quantity": 5}, {"product_id": 10 ** 6, "delta": 1}]})
+    assert cart["changes"] == [
+        {"product_id": product_id, "requested": 5, "quantity": 3, "limited": True},
+        {"product_id": 10 ** 6, "error": "not found"},
+    ]
+
+
+def test_bad_batches_are_rejected_before_anything_changes(customer, make_product):
+    product_id = make_product()
+    client = customer.client
+    assert client.post("/api/cart", data={"changes": "x"}).status_code == 415
+    for body in ({"changes": [{"product_id": product_id}]},
+                 {"changes": [{"product_id": product_id, "delta": 1.5}]},
+                 {"changes": [{"product_id": product_id, "quantity": -1}]},
+                 {"changes": [{"product_id": product_id, "delta": 1}], "token": "spaces are not allowed"}):
+        assert post(client, body)[0] == 400, body
+    assert post(client, {"changes": []})[1]["lines"] == []
+
+
+def test_prune_forgets_old_tokens(app, customer, make_product):
+    post(customer.client, {"changes": [{"product_id": make_product(), "delta": 1}]}, **{"Idempotency-Key": "old"})
+    with app.app_context():
+        session = shop.db.session
+        session.execute(shop.db.update(CartUpdateToken).values(created_at=shop.datetime(2000, 1, 1)))
+        session.commit()
+        assert shop.cart_updates.prune_tokens(session) >= 1
+        session.commit()
+        assert session.execute(shop.db.select(CartUpdateToken).filter_by(token="old")).first() is None
+
+
+def test_a_full_batch_stays_within_the_query_budget(app, customer, make_product, monkeypatch):
+    monkeypatch.setitem(app.config, "SQL_QUERY_BUDGET_STRICT", True)
+    client = customer.client
+    products = [make_product(stock=3) for _ in range(shop.cart_updates.MAX_CHANGES)]
+    half = len(products) // 2
+    status, cart = post(client, {"changes": [{"product_id": p, "delta": 1} for p in products[:half]]})
+    assert status == 200
+    # Raises, drops, partial raises and new lines all at once
+    changes = ([{"product_id": p, "quantity": 5} for p in products[:10]]
+               + [{"product_id": p, "quantity": 0} for p in products[10:20]]
+               + [{"product_id": p, "delta": 1} for p in products[20:]])
+    status, cart = post(client, {"changes": changes}, **{"Idempotency-Key": "full-batch"})
+    assert status == 200
+    assert cart["item_count"] == 10 * 3 + (half - 20) * 2 + (len(products) - half)
@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import main as shop
+import pricing
+from cart_pricing import price_cart
+from create_db import Order
+
+
+def test_lines_are_discounted_per_unit_and_rounded_like_orders(app, customer, make_product):
+    quarter_off, half_off = make_product(price="19.99", discount=25), make_product(price="10.01", discount=50)
+    customer.client.post("/add-to-cart/%d" % quarter_off, data={"quantity": 3})
+    customer.client.post("/add-to-cart/%d" % half_off, data={"quantity": 2})
+
+    with app.app_context():
+        cart = price_cart(shop.db.session, customer.id)
+        assert [(line.unit_final_price, line.discount, line.final_price) for line in cart.lines] == [
+            (Decimal("14.99"), 25, Decimal("44.97")), (Decimal("5.01"), 50, Decimal("10.02"))]
+        assert (cart.subtotal, cart.discount_total, cart.total, cart.item_count) == (
+            Decimal("79.99"), Decimal("25.00"), Decimal("54.99"), 5)
+
+    response = customer.client.post("/checkout", data={"address_id": customer.address_id, "payment_method": "cod"})
+    order_id = int(response.headers["Location"].rstrip("/").rsplit("/", 1)[-1])
+    with app.app_context():
+        order = shop.db.session.get(Order, order_id)
+        assert order.total_amount == Decimal("54.99")
+        assert sum(item.price_each * item.quantity for item in order.items) == order.total_amount
+
+
+def test_a_running_sale_beats_a_smaller_product_discount(app, customer, make_product):
+    product_id = make_product(price="40.00", discount=10)
+    customer.client.post("/add-to-cart/%d" % product_id, data={"quantity": 1})
+    with app.app_context():
+        pricing.schedule_sale(shop.db.session, 30, datetime.utcnow() - timedelta(minutes=1), product_id=product_id)
+        [line] = price_cart(shop.db.session, customer.id).lines
+    assert (line.unit_price, line.unit_final_price, line.discount) == (Decimal("40.00"), Decimal("28.00"), 30)
+
+
+def test_lines_whose_product_is_gone_are_dropped(app, customer, make_product):
+    kept, gone = make_product(), make_product()
+    for product_id in (kept, gone):
+        customer.client.post("/add-to-cart/%d" % product_id, data={"quantity": 1})
+    with app.app_context():
+        shop.inventory.discard(shop.db.session, [gone])
+        shop.db.session.execute(shop.db.delete(shop.Product).filter_by(id=gone))
+        shop.db.session.commit()
+        cart = price_cart(shop.db.session, customer.id)
+        assert [line.product.id for line in cart.lines] == [kept] and cart.removed == 1
+        assert price_cart(shop.db.session, customer.id).removed == 0
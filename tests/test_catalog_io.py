@@ -0,0 +1,46 @@
+import io
+import json
+from decimal import Decimal
+
+import main as shop
+from create_db import Product
+
+
+def upload(client, body, name="products.csv"):
+    return client.post("/admin/catalog/import", data={"file": (io.BytesIO(body.encode()), name)},
+                       content_type="multipart/form-data")
+
+
+def test_import_needs_a_csrf_token(app, make_user, make_category, login, monkeypatch):
+    admin = login(make_user(is_admin=True))
+    monkeypatch.setitem(app.config, "WTF_CSRF_ENABLED", True)
+    name = "forged %d" % make_category()
+    response = upload(admin, "name,description,price,stock_quantity,image_url\n%s,x,1.00,1,http://a/b.png\n" % name)
+    assert response.status_code == 400
+    assert "csrf_token" in response.get_json()["fields"]
+    with app.app_context():
+        assert shop.db.session.execute(shop.db.select(Product.id).filter_by(name=name)).first() is None
+
+
+def test_an_exported_catalog_imports_back_as_updates(app, make_user, make_category, make_product, login):
+    category_id = make_category()
+    ids = [make_product(price="12.50", discount=10, stock=4, category_id=category_id) for _ in range(2)]
+    with app.app_context():
+        for product_id in ids:
+            product = shop.db.session.get(Product, product_id)
+            product.description, product.image_url = "round trip", "https://img.test/%d.png" % product_id
+        shop.db.session.commit()
+    admin = login(make_user(is_admin=True))
+
+    exported = admin.get("/admin/catalog/export?format=jsonl").get_data(as_text=True)
+    rows = [row for row in map(json.loads, exported.splitlines()) if row["id"] in ids]
+    assert len(rows) == 2
+    rows[0]["price"] = "15.00"
+    report = upload(admin, "".join(json.dumps(row) + "\n" for row in rows), "products.jsonl").get_json()
+    assert report == {"read": 2, "inserted": 0, "updated": 2, "failed": 0, "errors": []}
+
+    with app.app_context():
+        changed, same = (shop.db.session.get(Product, row["id"]) for row in rows)
+        assert changed.price == Decimal("15.00") and changed.effective_price == Decimal("13.50")
+        assert (same.price, same.discount, same.stock_quantity, same.category_id, same.description) == (
+            Decimal("12.50"), 10, 4, category_id, "round trip")
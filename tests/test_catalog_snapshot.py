@@ -0,0 +1,78 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+import catalog_snapshot
+import main as shop
+import pagination
+import versions
+from create_db import Product
+
+COLUMNS = [Product.created_at, Product.id]
+
+
+def bump_catalog(session):
+    versions.bump(session, shop.CATALOG_VERSION_KEY)
+    session.commit()
+
+
+def test_snapshots_are_pruned_by_when_they_were_superseded(db, tmp_path, monkeypatch):
+    cache = catalog_snapshot.SnapshotCache(str(tmp_path), check_interval=0)
+    first = cache.get(db.session).path
+    # Written long ago, but only superseded now: it must outlive the grace period from here
+    os.utime(first, (time.time() - 2 * catalog_snapshot.PRUNE_AFTER,) * 2)
+
+    bump_catalog(db.session)
+    second = cache.get(db.session).path
+    assert os.path.exists(first) and os.path.exists(first + catalog_snapshot.SUPERSEDED)
+
+    # Once the grace period has passed since it was superseded, the next new snapshot prunes it
+    monkeypatch.setattr(catalog_snapshot, "PRUNE_AFTER", -1)
+    bump_catalog(db.session)
+    third = cache.get(db.session).path
+    assert not os.path.exists(first) and not os.path.exists(first + catalog_snapshot.SUPERSEDED)
+    assert os.path.exists(second + catalog_snapshot.SUPERSEDED)
+    assert os.path.exists(third) and not os.path.exists(third + catalog_snapshot.SUPERSEDED)
+
+
+def test_a_snapshot_pruned_before_it_is_opened_is_rebuilt(db, tmp_path, monkeypatch):
+    cache = catalog_snapshot.SnapshotCache(str(tmp_path), check_interval=0)
+    opened = catalog_snapshot.CatalogSnapshot
+    raced = []
+
+    def open_after_a_prune(path):
+        if not raced:
+            raced.append(path)
+            os.unlink(path)  # what another worker's _prune would do between the write and the open
+        return opened(path)
+
+    monkeypatch.setattr(catalog_snapshot, "CatalogSnapshot", open_after_a_prune)
+    snapshot = cache.get(db.session)
+    assert raced == [snapshot.path] and os.path.exists(snapshot.path)
+
+
+def test_snapshot_pages_match_the_database(db, tmp_path, make_category, make_product):
+    category_id = make_category()
+    start = datetime(2024, 1, 1)
+    # Ties on created_at are broken by id on both backends
+    stamps = [start, start + timedelta(hours=1), start + timedelta(hours=1), start + timedelta(hours=2)]
+    ids = [make_product(category_id=category_id, created_at=stamp) for stamp in stamps]
+    newest_first = [i for _, i in sorted(zip(stamps, ids), reverse=True)]
+    snapshot = catalog_snapshot.SnapshotCache(str(tmp_path)).get(db.session)
+
+    seen, cursor = [], None
+    while True:
+        page = snapshot.keyset_page(COLUMNS, cursor, per_page=3, category_ids=[category_id])
+        seen.extend(p.id for p in page.items)
+        if page.next_cursor is None:
+            break
+        cursor = page.next_cursor
+    assert seen == newest_first
+
+    # A cursor from one backend continues on the other
+    stmt = select(Product).where(Product.category_id == category_id)
+    first = pagination.keyset_page(db.session, stmt, COLUMNS, per_page=2)
+    rest = snapshot.keyset_page(COLUMNS, first.next_cursor, per_page=10, category_ids=[category_id])
+    assert [p.id for p in first.items + rest.items] == newest_first
@@ -0,0 +1,51 @@
+import uuid
+
+import main as shop
+import versions
+from category_tree import CategoryTree, CategoryTreeCache, VERSION_KEY
+from create_db import Category
+
+
+def test_tree_lookups_survive_cycles_and_dangling_parents():
+    tree = CategoryTree([(1, "root", None), (2, "child", 1), (3, "grandchild", 2), (4, "orphan", 99),
+                         (5, "loop a", 6), (6, "loop b", 5)])
+    assert tree.subtree_ids(1) == {1, 2, 3}
+    assert [node.id for node in tree.ancestors_of(3)] == [1, 2]
+    assert tree.subtree_ids(4) == {4} and tree.ancestors_of(4) == []
+    # A parent_id cycle has no root, but both categories are still in the tree
+    assert 5 in tree.subtree_ids(5) and 6 in tree.subtree_ids(6)
+    assert [node.id for node in tree.ordered()] == [1, 2, 3, 4, 5, 6]
+
+
+def test_cache_rebuilds_only_when_the_version_moves(db):
+    cache = CategoryTreeCache(check_interval=0)
+    tree = cache.get(db.session)
+    category = Category(name="added elsewhere %s" % uuid.uuid4().hex[:8])
+    db.session.add(category)
+    db.session.commit()
+    # Another worker's write that didn't bump the version is not noticed
+    assert cache.get(db.session) is tree
+
+    versions.bump(db.session, VERSION_KEY)
+    db.session.commit()
+    assert cache.get(db.session).get(category.id).name == category.name
+
+
+def test_cache_skips_the_version_check_between_intervals(db):
+    cache = CategoryTreeCache(check_interval=3600)
+    tree = cache.get(db.session)
+    versions.bump(db.session, VERSION_KEY)
+    db.session.commit()
+    assert cache.get(db.session) is tree
+    cache.invalidate()
+    assert cache.get(db.session) is not tree
+
+
+def test_a_category_added_by_an_admin_is_listed_straight_away(app, make_user, login):
+    admin = login(make_user(is_admin=True))
+    name = "new category %s" % uuid.uuid4().hex[:8]
+    assert admin.post("/add-category", data={"name": name, "parent_id": 0}).status_code == 302
+    with app.app_context():
+        category_id = shop.db.session.execute(shop.db.select(Category.id).filter_by(name=name)).scalar_one()
+    response = app.test_client().get("/category/%d" % category_id)
+    assert response.status_code == 200 and name in response.get_data(as_text=True)
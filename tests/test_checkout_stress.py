@@ -0,0 +1,26 @@
+import main as shop
+from benchmarks import stress_checkout
+
+
+def test_concurrent_checkout_never_oversells(app):
+    results = stress_checkout.stress(shop, buyers=12, stock=5, rounds=2, report=lambda *args: None)
+    for result in results:
+        assert not result["auth_failures"], result
+        assert not result["errors"], result
+        assert result["consistent"], result
+        assert result["sold"] == result["expected_sold"] == 5, result
+
+
+def test_checkout_stress_sells_whole_multi_unit_lots(app):
+    results = stress_checkout.stress(shop, buyers=6, stock=7, quantity=2, rounds=1, report=lambda *args: None)
+    assert [r["sold"] for r in results] == [6]
+    assert all(r["ok"] for r in results)
+
+
+def test_buyers_who_cannot_log_in_fail_the_round_without_counting_as_an_oversell(app, monkeypatch):
+    wrong_password = shop.generate_password_hash("not the stress password")
+    monkeypatch.setattr(shop, "generate_password_hash", lambda password: wrong_password)
+    [result] = stress_checkout.stress(shop, buyers=3, stock=2, rounds=1, report=lambda *args: None)
+    assert result["auth_failures"] == [200, 200, 200]
+    assert result["sold"] == 0 and result["consistent"] and not result["errors"]
+    assert not result["ok"]
@@ -0,0 +1,64 @@
+import http.server
+import threading
+import urllib.error
+
+import pytest
+
+import images
+
+
+@pytest.fixture
+def server():
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/moved":
+                self.send_response(302)
+                self.send_header("Location", "/image.png")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b"image bytes")
+
+        def log_message(self, *args):
+            pass
+
+    httpd = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:%d" % httpd.server_port
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.mark.parametrize("address", ["127.0.0.1", "10.1.2.3", "192.168.0.1", "169.254.169.254", "::1",
+                                     "fd00::1", "::ffff:127.0.0.1", "0.0.0.0"])
+def test_internal_addresses_are_not_public(address):
+    assert not images._is_public(address)
+
+
+@pytest.mark.parametrize("address", ["93.184.216.34", "2606:2800:220:1:248:1893:25c8:1946"])
+def test_internet_addresses_are_public(address):
+    assert images._is_public(address)
+
+
+def test_fetching_from_a_loopback_host_is_refused(server):
+    with pytest.raises(ValueError, match="not a public address"):
+        images._read_source(server + "/image.png", None)
+    with pytest.raises(ValueError, match="not a public address"):
+        images._read_source(server.replace("127.0.0.1", "localhost") + "/image.png", None)
+
+
+def test_redirects_are_not_followed(server, monkeypatch):
+    monkeypatch.setattr(images, "_is_public", lambda address: True)
+    assert images._read_source(server + "/image.png", None) == b"image bytes"
+    with pytest.raises(urllib.error.HTTPError) as caught:
+        images._read_source(server + "/moved", None)
+    assert caught.value.code == 302
+
+
+def test_local_files_stay_under_the_local_root(tmp_path):
+    (tmp_path / "a.png").write_bytes(b"local")
+    assert images._read_source("file:///a.png", str(tmp_path)) == b"local"
+    with pytest.raises(ValueError, match="outside the local image root"):
+        images._read_source("file:///../etc/passwd", str(tmp_path))
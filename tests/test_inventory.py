@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta
+
+import inventory
+import main as shop
+from create_db import CartItem, StockCounter
+
+
+def test_holds_never_exceed_stock(db, make_user, make_product):
+    product_id = make_product(stock=3)
+    first, second = make_user(), make_user()
+
+    assert inventory.hold(db.session, first.id, product_id, 2) == (True, None)
+    assert inventory.hold(db.session, second.id, product_id, 2) == (False, 1)
+    assert inventory.hold(db.session, second.id, product_id, 1) == (True, None)
+    db.session.commit()
+    assert inventory.available(db.session, [product_id]) == {product_id: 0}
+
+    assert inventory.release(db.session, first.id) == 1
+    db.session.commit()
+    assert inventory.available(db.session, [product_id]) == {product_id: 2}
+
+
+def test_sweep_gives_expired_holds_back(db, make_user, make_product):
+    product_id = make_product(stock=4)
+    lapsed, kept = make_user(), make_user()
+    inventory.hold(db.session, lapsed.id, product_id, 3, ttl=timedelta(seconds=-1))
+    inventory.hold(db.session, kept.id, product_id, 1)
+    db.session.commit()
+
+    assert inventory.sweep(db.session, now=datetime.utcnow()) >= 1
+    assert inventory.holds_for(db.session, lapsed.id) == {}
+    assert list(inventory.holds_for(db.session, kept.id)) == [product_id]
+    assert db.session.get(StockCounter, product_id).reserved == 1
+
+
+def test_add_to_cart_is_capped_by_what_others_hold(app, make_customer, make_product):
+    product_id = make_product(stock=2)
+    first, second = make_customer(), make_customer()
+    first.client.post("/add-to-cart/%d" % product_id, data={"quantity": 2})
+    second.client.post("/add-to-cart/%d" % product_id, data={"quantity": 1})
+
+    with app.app_context():
+        lines = dict(shop.db.session.execute(
+            shop.db.select(CartItem.user_id, CartItem.quantity).filter_by(product_id=product_id)).all())
+    assert lines == {first.id: 2}
+
+
+def test_cart_lines_can_only_be_changed_by_their_owner(app, make_customer, make_product):
+    product_id = make_product(stock=5)
+    owner, other = make_customer(), make_customer()
+    owner_client = owner.client
+    owner_client.post("/add-to-cart/%d" % product_id, data={"quantity": 1})
+    with app.app_context():
+        item_id = shop.db.session.execute(
+            shop.db.select(CartItem.id).filter_by(user_id=owner.id, product_id=product_id)).scalar_one()
+
+    assert app.test_client().get("/update_quantity/%d/add" % item_id).status_code == 302  # to the login page
+    assert other.client.get("/update_quantity/%d/add" % item_id).status_code == 404
+    assert other.client.get("/remove-from-cart/%d" % item_id).status_code == 404
+
+    assert owner_client.get("/update_quantity/%d/add" % item_id).status_code == 302
+    with app.app_context():
+        assert shop.db.session.get(CartItem, item_id).quantity == 2
+        assert inventory.holds_for(shop.db.session, owner.id)[product_id][0] == 2
+    owner_client.get("/remove-from-cart/%d" % item_id)
+    with app.app_context():
+        assert shop.db.session.get(CartItem, item_id) is None
+        assert inventory.holds_for(shop.db.session, owner.id) == {}
+
+
+def test_hold_many_grants_and_refuses_like_hold(db, make_user, make_product):
+    plenty, scarce, dropped = make_product(stock=10), make_product(stock=2), make_product(stock=5)
+    user = make_user()
+    inventory.hold(db.session, user.id, dropped, 3)
+    inventory.hold(db.session, user.id, plenty, 1)
+
+    results = inventory.hold_many(db.session, user.id, {plenty: 4, scarce: 3, dropped: 0})
+    assert results == {plenty: (True, None), scarce: (False, 2), dropped: (True, None)}
+    db.session.commit()
+    assert {p: q for p, (q, _) in inventory.holds_for(db.session, user.id).items()} == {plenty: 4}
+    assert inventory.available(db.session, [plenty, scarce, dropped]) == {plenty: 6, scarce: 2, dropped: 5}
+    assert inventory.rebuild_counters(db.session) == 0
+
+
+def test_cached_listings_show_current_availability(app, make_category, make_customer, make_product, monkeypatch):
+    monkeypatch.setitem(app.config, "SQL_QUERY_BUDGET_STRICT", True)
+    category_id = make_category()
+    product_id = make_product(stock=2, category_id=category_id)
+    anonymous, path = app.test_client(), "/?category=%d" % category_id
+    assert "Available: 2" in anonymous.get(path).get_data(as_text=True)
+    first = anonymous.get(path)
+    assert "Available: 2" in first.get_data(as_text=True)
+
+    make_customer().client.post("/add-to-cart/%d" % product_id, data={"quantity": 2})
+    page = anonymous.get(path, headers={"If-None-Match": first.headers["ETag"]})
+    assert page.status_code == 200
+    body = page.get_data(as_text=True)
+    assert "Available: 0" in body and "Held in carts" in body
+
+
+
+def test_removing_a_held_product_drops_its_holds(app, make_user, make_customer, make_product, login):
+    product_id = make_product(stock=4)
+    shopper = make_customer()
+    shopper.client.post("/add-to-cart/%d" % product_id, data={"quantity": 2})
+
+    assert login(make_user(is_admin=True)).get("/remove_product/%d" % product_id).status_code == 302
+    with app.app_context():
+        session = shop.db.session
+        assert session.get(shop.Product, product_id) is None
+        assert session.get(StockCounter, product_id) is None
+        assert inventory.holds_for(session, shopper.id) == {}
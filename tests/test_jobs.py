@@ -0,0 +1,86 @@
+import itertools
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+import jobs
+import main as shop
+import versions
+from create_db import Job
+
+calls = []
+_backdated = itertools.count(3600)
+
+
+@jobs.task("tests.record")
+def record(value):
+    calls.append(value)
+
+
+@jobs.task("tests.fail", max_attempts=2)
+def fail():
+    raise RuntimeError("boom")
+
+
+@pytest.fixture
+def queue(db):
+    """``queue(name, payload=None, key=None)`` -> job id, due before every job queued so far, so it is claimed first."""
+    def enqueue(name, payload=None, key=None):
+        key = key or uuid.uuid4().hex
+        assert jobs.enqueue(db.session, name, payload, key=key, delay=-next(_backdated))
+        db.session.commit()
+        return db.session.execute(shop.db.select(Job.id).filter_by(idempotency_key=key)).scalar_one()
+    return enqueue
+
+
+def test_checkout_queues_its_follow_up_work_without_touching_the_catalog_version(app, customer, make_product):
+    product_id = make_product(stock=3)
+    customer.client.post("/add-to-cart/%d" % product_id, data={"quantity": 1})
+    with app.app_context():
+        before = versions.current(shop.db.session, shop.CATALOG_VERSION_KEY)
+
+    response = customer.client.post("/checkout", data={"address_id": customer.address_id, "payment_method": "cod"})
+    order_id = int(response.headers["Location"].rstrip("/").rsplit("/", 1)[-1])
+    with app.app_context():
+        queued = shop.db.session.execute(
+            shop.db.select(Job.name).where(Job.idempotency_key.like("order:%d:%%" % order_id))).scalars().all()
+        assert versions.current(shop.db.session, shop.CATALOG_VERSION_KEY) == before
+    assert queued == ["inventory.low_stock_alert"]
+
+
+def test_a_key_queues_its_job_once(db, queue):
+    key = uuid.uuid4().hex
+    job_id = queue("tests.record", {"value": key}, key=key)
+    assert jobs.enqueue(db.session, "tests.record", {"value": "again"}, key=key) is False
+    db.session.commit()
+    assert db.session.execute(shop.db.select(Job.id).filter_by(idempotency_key=key)).scalars().all() == [job_id]
+
+
+def test_an_expired_lease_hands_the_job_to_another_worker(db, queue):
+    job_id = queue("tests.record", {"value": "leased"})
+    assert jobs.claim(db.session, "worker-a", 1) == [job_id]
+    assert jobs.claim(db.session, "worker-b", 1, lease=3600) != [job_id]  # still leased to worker-a
+
+    two_hours_ago = datetime.utcnow() - timedelta(hours=2)
+    db.session.execute(shop.db.update(Job).filter_by(id=job_id).values(locked_at=two_hours_ago))
+    db.session.commit()
+    assert jobs.claim(db.session, "worker-b", 1, lease=3600) == [job_id]
+    assert jobs.run(db.session, job_id, "worker-a") is None  # worker-a lost it
+    assert jobs.run(db.session, job_id, "worker-b") == "done"
+    job = db.session.get(Job, job_id)
+    assert (job.status, job.attempts, calls[-1]) == ("done", 2, "leased")
+
+
+def test_a_failing_job_is_retried_with_backoff_then_failed(db, queue):
+    job_id = queue("tests.fail")
+    assert jobs.claim(db.session, "worker", 1) == [job_id]
+    assert jobs.run(db.session, job_id, "worker") == "retried"
+    job = db.session.get(Job, job_id)
+    assert job.status == "queued" and job.run_at > datetime.utcnow() and job.last_error == "RuntimeError: boom"
+
+    db.session.execute(shop.db.update(Job).filter_by(id=job_id).values(run_at=datetime.utcnow() - timedelta(hours=2)))
+    db.session.commit()
+    assert jobs.claim(db.session, "worker", 1) == [job_id]
+    assert jobs.run(db.session, job_id, "worker") == "failed"
+    assert db.session.get(Job, job_id).status == "failed"
@@ -0,0 +1,83 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import textwrap
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import Session
+
+import migrations
+import search
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine("sqlite:///" + str(tmp_path / "schema.db"))
+    yield engine
+    engine.dispose()
+
+
+def upgrade(engine):
+    with Session(engine) as session:
+        return migrations.upgrade(engine, session, search.index_for(engine))
+
+
+def test_a_new_database_gets_every_migration_once(engine):
+    assert migrations.current_version(engine) == 0
+    assert upgrade(engine) == [name for _, name, _ in migrations.MIGRATIONS]
+    assert migrations.current_version(engine) == migrations.LATEST
+    assert upgrade(engine) == []
+    tables = set(inspect(engine).get_table_names())
+    assert {"products", "cart_items", "co_purchase_counts", "product_recommendations",
+            "cart_update_tokens", "schema_migrations"} <= tables
+
+
+def test_migration_numbers_only_grow():
+    numbers = [number for number, _, _ in migrations.MIGRATIONS]
+    assert numbers == sorted(set(numbers)) == list(range(1, len(numbers) + 1))
+
+
+def test_a_database_from_before_migrations_is_brought_up_to_date(engine, tmp_path):
+    upgrade(engine)
+    engine.dispose()
+    # What an old deploy left behind: no effective_price, no unique cart index, no migration records
+    conn = sqlite3.connect(str(tmp_path / "schema.db"))
+    conn.execute("drop index ix_products_effective_price_id")
+    conn.execute("drop index ix_products_category_id_effective_price_id")
+    conn.execute("alter table products drop column effective_price")
+    conn.execute("drop index ux_cart_items_user_id_product_id")
+    conn.execute("drop table cart_update_tokens")
+    conn.execute("drop table schema_migrations")
+    conn.execute("insert into users (id, email, password) values (1, 'a@test.example', 'x')")
+    conn.execute("insert into products (id, name, price, discount, stock_quantity) values (1, 'a', 19.99, 25, 1)")
+    conn.execute("insert into cart_items (user_id, product_id, quantity) values (1, 1, 2), (1, 1, 3)")
+    conn.commit()
+    conn.close()
+
+    assert len(upgrade(engine)) == len(migrations.MIGRATIONS)
+    with engine.connect() as conn:
+        assert conn.execute(text("select effective_price from products")).scalar() == pytest.approx(14.99)
+        assert conn.execute(text("select user_id, product_id, quantity from cart_items")).all() == [(1, 1, 5)]
+    assert "cart_update_tokens" in inspect(engine).get_table_names()
+
+
+def test_importing_the_app_without_schema_setup_opens_no_connection(tmp_path):
+    # A fresh interpreter: this one imported main (and connected) long ago
+    script = textwrap.dedent("""
+        from sqlalchemy import event
+        from sqlalchemy.pool import Pool
+        opened = []
+        event.listen(Pool, "connect", lambda *args: opened.append(1))
+        import main
+        print(len(opened), main.search_index.name)
+    """)
+    env = dict(os.environ, DB_URI="sqlite:///" + str(tmp_path / "cold.db"), SCHEMA_ON_STARTUP="0")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, "-c", script], cwd=root, env=env, capture_output=True, text=True,
+                            check=True)
+    opened, backend = result.stdout.split()
+    assert opened == "0"
+    assert backend == search.index_for(create_engine("sqlite://")).name
+    assert not (tmp_path / "cold.db").exists()
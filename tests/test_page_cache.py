@@ -0,0 +1,48 @@
+import pytest
+
+import main as shop
+import versions
+from create_db import Product
+
+
+@pytest.fixture
+def listed(app, make_category, make_product):
+    """``(path, product_id)`` of a one-product listing, already in the page cache."""
+    category_id = make_category()
+    product_id = make_product(category_id=category_id)
+    path = "/?category=%d" % category_id
+    assert app.test_client().get(path).status_code == 200
+    return path, product_id
+
+
+def rename(product_id, name, bump=None):
+    # In its own app context: requests made while one is pushed would share its g, and so its login
+    with shop.app.app_context():
+        session = shop.db.session
+        session.get(Product, product_id).name = name
+        if bump:
+            versions.bump(session, bump)
+        session.commit()
+
+
+@pytest.mark.parametrize("version_key", [shop.CATALOG_VERSION_KEY, shop.CATEGORY_VERSION_KEY])
+def test_anonymous_pages_are_served_from_cache_until_a_version_moves(app, listed, customer, version_key):
+    path, product_id = listed
+    rename(product_id, "renamed quietly")
+    assert "renamed quietly" not in app.test_client().get(path).get_data(as_text=True)
+    # Signed-in pages are never cached
+    assert "renamed quietly" in customer.client.get(path).get_data(as_text=True)
+
+    rename(product_id, "renamed properly", bump=version_key)
+    assert "renamed properly" in app.test_client().get(path).get_data(as_text=True)
+
+
+def test_unchanged_pages_revalidate_with_a_304(app, listed):
+    path, product_id = listed
+    client = app.test_client()
+    first = client.get(path)
+    assert first.headers["Cache-Control"] == "no-cache"
+    assert client.get(path, headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+
+    rename(product_id, "renamed", bump=shop.CATALOG_VERSION_KEY)
+    assert client.get(path, headers={"If-None-Match": first.headers["ETag"]}).status_code == 200
@@ -0,0 +1,62 @@
+import html
+import re
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+import pagination
+from create_db import Product
+
+COLUMNS = (Product.created_at, Product.id)
+
+
+@pytest.fixture
+def listed(make_category, make_product):
+    """Seven products in a fresh category, three of them sharing one created_at."""
+    category_id = make_category()
+    start = datetime(2024, 1, 1)
+    stamps = [start, start + timedelta(hours=1), start + timedelta(hours=1), start + timedelta(hours=1),
+              start + timedelta(hours=2), start + timedelta(hours=3), start + timedelta(hours=4)]
+    ids = [make_product(category_id=category_id, created_at=stamp) for stamp in stamps]
+    newest_first = [i for _, i in sorted(zip(stamps, ids), reverse=True)]
+    return category_id, newest_first
+
+
+def walk(fetch):
+    seen, cursor = [], None
+    while True:
+        page = fetch(cursor)
+        seen.extend(item.id for item in page.items)
+        if page.next_cursor is None:
+            return seen
+        cursor = page.next_cursor
+
+
+@pytest.mark.parametrize("descending", [True, False])
+def test_keyset_pages_cover_every_row_once(db, listed, descending):
+    category_id, newest_first = listed
+    stmt = select(Product).where(Product.category_id == category_id)
+    seen = walk(lambda cursor: pagination.keyset_page(db.session, stmt, list(COLUMNS), cursor, per_page=3,
+                                                      descending=descending))
+    assert seen == (newest_first if descending else newest_first[::-1])
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", pagination.encode_cursor([1]), ""])
+def test_unreadable_cursors_start_from_the_first_page(cursor):
+    assert pagination.decode_cursor(cursor, COLUMNS) is None
+
+
+def test_listing_follows_its_next_link(app, listed):
+    category_id, newest_first = listed
+    client = app.test_client()
+    seen, path = [], "/?category=%d&per_page=3" % category_id
+    while path:
+        response = client.get(path)
+        assert response.status_code == 200
+        body = response.get_data(as_text=True)
+        seen.extend(int(i) for i in re.findall(r'/add-to-cart/(\d+)"', body))
+        link = re.search(r'href="([^"]*)">Next', body)
+        path = html.unescape(link.group(1)) if link else None
+    assert seen == newest_first
+    assert client.get("/?category=%d&after=garbage" % category_id).status_code == 200
@@ -0,0 +1,35 @@
+import pytest
+
+from sql_instrumentation import QueryBudgetExceeded, sql_budget_exceeded_total
+
+
+@pytest.fixture
+def strict(app, monkeypatch):
+    monkeypatch.setitem(app.config, "SQL_QUERY_BUDGET_STRICT", True)
+    return app
+
+
+def test_budgeted_pages_stay_within_budget(strict, customer, make_product):
+    client = customer.client
+    for product_id in (make_product(), make_product()):
+        client.post("/add-to-cart/%d" % product_id, data={"quantity": 1})
+
+    for path in ("/", "/?sort=oldest", "/cart", "/checkout", "/my_orders"):
+        assert client.get(path).status_code == 200, path
+    response = client.post("/checkout", data={"address_id": customer.address_id, "payment_method": "cod"})
+    assert response.status_code == 302
+    assert client.get(response.headers["Location"]).status_code == 200
+
+
+def test_strict_mode_raises_when_a_view_goes_over_budget(strict, customer, monkeypatch):
+    monkeypatch.setattr(strict.view_functions["view_cart"], "query_budget", 1)
+    with pytest.raises(QueryBudgetExceeded, match=r"view_cart issued \d+ queries \(budget 1\)"):
+        customer.client.get("/cart")
+
+
+def test_lenient_mode_only_counts_the_overrun(app, customer, monkeypatch):
+    monkeypatch.setitem(app.config, "SQL_QUERY_BUDGET_STRICT", False)
+    monkeypatch.setattr(app.view_functions["view_cart"], "query_budget", 1)
+    before = sql_budget_exceeded_total.value("view_cart")
+    assert customer.client.get("/cart").status_code == 200
+    assert sql_budget_exceeded_total.value("view_cart") == before + 1
@@ -0,0 +1,66 @@
+import uuid
+
+import pytest
+
+import main as shop
+import ratelimit
+
+
+@pytest.fixture
+def throttle(monkeypatch):
+    """``throttle(rules_name, **limits)`` swaps in a fresh limiter and sets limits by rule name for one test."""
+    monkeypatch.setattr(shop, "rate_limiter", ratelimit.RateLimiter(ratelimit.MemoryBuckets()))
+
+    def configure(rules_name, **limits):
+        rules = tuple(ratelimit.Rule(rule.name, limits.get(rule.name.split(":")[1], "off"), rule.key,
+                                     rule.failures_only)
+                      for rule in getattr(shop, rules_name))
+        monkeypatch.setattr(shop, rules_name, rules)
+    return configure
+
+
+def signup(client, email):
+    return client.post("/signup", data={"first_name": "A", "last_name": "B", "email": email,
+                                        "password": "pw", "confirm": "pw"})
+
+
+def test_signups_are_limited_per_email(app, throttle):
+    throttle("SIGNUP_LIMITS", ip="100/minute", email="2/minute")
+    client = app.test_client()
+    email = "signup-%s@test.example" % uuid.uuid4().hex[:8]
+    assert [signup(client, email).status_code for _ in range(3)] == [302, 302, 429]
+    # Another address from the same client is still let through
+    assert signup(client, "other-" + email).status_code == 302
+
+
+@pytest.fixture
+def hashes(monkeypatch):
+    """Passwords hashed or checked so far in this test."""
+    calls = []
+    run = shop.password_hasher.run
+
+    def counted(func, *args):
+        calls.append(func)
+        return run(func, *args)
+    monkeypatch.setattr(shop.password_hasher, "run", counted)
+    return calls
+
+
+def test_throttled_logins_are_rejected_before_the_password_is_hashed(app, throttle, hashes, make_user):
+    throttle("LOGIN_LIMITS", ip="100/minute", email="2/minute")
+    user, client = make_user(), app.test_client()
+    statuses = [client.post("/login", data={"email": user.email, "password": "wrong"}).status_code
+                for _ in range(4)]
+    assert statuses == [200, 200, 429, 429]
+    assert len(hashes) == 2
+    assert "Retry-After" in client.post("/login", data={"email": user.email, "password": "wrong"}).headers
+
+
+def test_successful_logins_do_not_use_up_the_per_address_limit(app, throttle, make_user, login):
+    throttle("LOGIN_LIMITS", ip="2/minute", email="100/minute")
+    for _ in range(3):
+        user = make_user()
+        login(user)  # asserts the sign-in went through
+    wrong = [app.test_client().post("/login", data={"email": user.email, "password": "wrong"}).status_code
+             for _ in range(3)]
+    assert wrong == [200, 200, 429]
@@ -0,0 +1,37 @@
+import pytest
+
+import main as shop
+
+
+@pytest.fixture
+def order(customer, make_product):
+    customer.client.post("/add-to-cart/%d" % make_product(), data={"quantity": 1})
+    response = customer.client.post("/checkout", data={"address_id": customer.address_id, "payment_method": "cod"})
+    return int(response.headers["Location"].rstrip("/").rsplit("/", 1)[-1])
+
+
+def test_only_finished_orders_are_cached_and_only_for_their_owner(customer, order, make_customer, make_user, login):
+    receipt = "/order/%d/receipt" % order
+    assert "Status: Pending" in customer.client.get(receipt).get_data(as_text=True)
+    assert shop.receipt_cache.get(order) is None
+
+    admin = login(make_user(is_admin=True))
+    for _ in range(2):  # pending -> paid -> delivered
+        admin.get("/update_order/%d" % order)
+    assert "Status: Delivered" in customer.client.get(receipt).get_data(as_text=True)
+    assert shop.receipt_cache.get(order)[0] == customer.id
+
+    assert make_customer().client.get(receipt).status_code == 404
+    assert admin.get(receipt).status_code == 200
+
+
+def test_a_status_change_replaces_the_cached_receipt(customer, order, make_user, login):
+    receipt = "/order/%d/receipt" % order
+    admin = login(make_user(is_admin=True))
+    for _ in range(2):
+        admin.get("/update_order/%d" % order)
+    assert "Status: Delivered" in customer.client.get(receipt).get_data(as_text=True)
+
+    customer.client.get("/cancel_order/%d" % order)
+    assert shop.receipt_cache.get(order) is None
+    assert "Status: Cancelled" in customer.client.get(receipt).get_data(as_text=True)
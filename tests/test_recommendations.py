@@ -0,0 +1,70 @@
+import itertools
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+import recommendations
+from create_db import Order, CoPurchaseCount
+
+# These tests count orders the moment they are placed
+SETTLED = timedelta(0)
+
+
+def expected_counts(session):
+    baskets = defaultdict(set)
+    for order in session.execute(select(Order)).scalars():
+        if order.status.lower() != "cancelled" and not order.user.is_admin:
+            baskets[order.id].update(item.product_id for item in order.items)
+    counts = Counter()
+    for basket in baskets.values():
+        if 1 < len(basket) <= recommendations.MAX_BASKET:
+            counts.update(itertools.permutations(basket, 2))
+    return dict(counts)
+
+
+def stored_counts(session):
+    return {(row.product_id, row.other_id): row.orders
+            for row in session.execute(select(CoPurchaseCount)).scalars()}
+
+
+@pytest.fixture
+def orders(db, make_user, make_product, make_order):
+    user = make_user()
+    products = [make_product() for _ in range(6)]
+    baskets = [products[:3], products[1:4], products[2:4], [products[5]], products[:2], products[3:]]
+    for n, basket in enumerate(baskets):
+        make_order(user, basket, status="Cancelled" if n == 4 else "pending")
+    return products
+
+
+@pytest.mark.parametrize("chunksize", [2, 5, 100000])
+def test_refresh_counts_every_pair_whatever_the_chunk_size(db, orders, chunksize):
+    result = recommendations.refresh(db.session, full=True, chunksize=chunksize, settle=SETTLED)
+    assert stored_counts(db.session) == expected_counts(db.session)
+    assert result.products == len({product for product, _ in stored_counts(db.session)})
+
+
+def test_incremental_refresh_adds_only_new_orders(db, orders, make_user, make_order):
+    recommendations.refresh(db.session, full=True, settle=SETTLED)
+    make_order(make_user(), orders[:2])
+
+    result = recommendations.refresh(db.session, chunksize=3, settle=SETTLED)
+    assert result.orders == 1 and result.pairs == 2
+    assert stored_counts(db.session) == expected_counts(db.session)
+    assert recommendations.refresh(db.session, settle=SETTLED).orders == 0
+
+
+def test_the_watermark_waits_for_ids_committed_out_of_order(db, orders, make_user, make_order):
+    recommendations.refresh(db.session, full=True, settle=SETTLED)
+    user = make_user()
+    late_id = db.session.execute(select(Order.id).order_by(Order.id.desc())).scalars().first() + 10
+    # A settled order, then a newer id that commits before the id just under it
+    make_order(user, orders[:2], created_at=datetime.utcnow() - timedelta(hours=1))
+    make_order(user, orders[:2], id=late_id + 1)
+
+    assert recommendations.refresh(db.session).orders == 1
+    make_order(user, orders[:2], id=late_id)
+    assert recommendations.refresh(db.session, settle=SETTLED).orders == 2
+    assert stored_counts(db.session) == expected_counts(db.session)
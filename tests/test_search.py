@@ -0,0 +1,25 @@
+import main as shop
+import search
+import versions
+from create_db import Product
+
+
+def test_memory_index_follows_committed_catalog_changes_only(db, make_product):
+    index = search.MemoryIndex()
+    product_id = make_product()
+    word = "zq%dx" % product_id
+    assert index.search(db.session, word, limit=10, offset=0).ids == []
+
+    # An edit that is rolled back never reaches the index
+    product = db.session.get(Product, product_id)
+    product.name = word
+    index.index_products(db.session, [product])
+    versions.bump(db.session, shop.CATALOG_VERSION_KEY)
+    db.session.rollback()
+    assert index.search(db.session, word, limit=10, offset=0).ids == []
+
+    # A committed one does, wherever it was made: the catalog version moved
+    db.session.get(Product, product_id).name = word
+    versions.bump(db.session, shop.CATALOG_VERSION_KEY)
+    db.session.commit()
+    assert index.search(db.session, word, limit=10, offset=0).ids == [product_id]
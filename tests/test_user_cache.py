@@ -0,0 +1,38 @@
+import re
+
+from cache import LRUCache
+from create_db import User
+from user_cache import PrincipalCache
+
+
+def badge(client):
+    found = re.search(r'id="cart-count"[^>]*>(\d+)<', client.get("/cart").get_data(as_text=True))
+    return int(found.group(1)) if found else 0
+
+
+def test_the_cart_badge_follows_cart_changes(customer, make_product):
+    assert badge(customer.client) == 0
+    product_id = make_product()
+    customer.client.post("/add-to-cart/%d" % product_id, data={"quantity": 2})
+    assert badge(customer.client) == 2
+    customer.client.post("/api/cart", json={"changes": [{"product_id": product_id, "delta": 1}]})
+    assert badge(customer.client) == 3
+
+
+def test_changes_made_elsewhere_show_after_invalidate_or_expiry(db, make_user):
+    user = make_user()
+    cache, uncached = PrincipalCache(LRUCache()), PrincipalCache(LRUCache(), ttl=0)
+    assert cache.load(db.session, user.id).is_admin is False
+
+    db.session.get(User, user.id).is_admin = True
+    db.session.commit()
+    assert cache.load(db.session, user.id).is_admin is False
+    assert uncached.load(db.session, user.id).is_admin is True
+    cache.invalidate(user.id)
+    assert cache.load(db.session, user.id).is_admin is True
+
+
+def test_an_unknown_user_id_is_not_cached(db):
+    cache = PrincipalCache(LRUCache())
+    assert cache.load(db.session, 10 ** 9) is None
+    assert len(cache.backend) == 0
@@ -0,0 +1,53 @@
+from flask_login import UserMixin
+from sqlalchemy import select, func
+
+from create_db import User, CartItem
+
+
+class CachedUser(UserMixin):
+    """Lightweight stand-in for User as ``current_user``: just what requests and the navbar need.
+
+    Views that need anything else (addresses, created_at, ...) load the User row themselves.
+    """
+
+    def __init__(self, id, name, email, is_admin, cart_count):
+        self.id = id
+        self.name = name
+        self.email = email
+        self.is_admin = bool(is_admin)
+        self.cart_count = cart_count
+
+
+class PrincipalCache:
+    """Bounded, TTL'd cache of the logged-in principal, keyed by user id.
+
+    Cart writes and logout call ``invalidate``; the TTL bounds how long a change
+    made elsewhere (another worker, an admin flag flipped in the database) can
+    go unseen. A ttl of 0 disables caching.
+    """
+
+    def __init__(self, backend, ttl=60):
+        self.backend = backend
+        self.ttl = ttl
+
+    def load(self, session, user_id):
+        entry = self.backend.get(user_id) if self.ttl > 0 else None
+        if entry is None:
+            cart_count = (
+                select(func.coalesce(func.sum(CartItem.quantity), 0))
+                .where(CartItem.user_id == User.id)
+                .scalar_subquery()
+            )
+            row = session.execute(
+                select(User.id, User.name, User.email, User.is_admin, cart_count).where(User.id == user_id)
+            ).first()
+            if row is None:
+                return None
+            entry = {"id": row[0], "name": row[1], "email": row[2], "is_admin": bool(row[3]),
+                     "cart_count": int(row[4] or 0)}
+            if self.ttl > 0:
+                self.backend.set(user_id, entry, ttl=self.ttl)
+        return CachedUser(**entry)
+
+    def invalidate(self, user_id):
+        self.backend.delete(user_id)
@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from sqlalchemy import select, update
+
+from create_db import CacheVersion
+
+
+def current(session, name):
+    row = session.execute(
+        select(CacheVersion.version, CacheVersion.updated_at).filter_by(name=name)
+    ).first()
+    return (row.version, row.updated_at) if row else (0, None)
+
+
+def bump(session, name, at=None):
+    # Runs inside the caller's transaction so the new version becomes visible
+    # to other workers exactly when the data it describes is committed.
+    now = at or datetime.utcnow()
+    updated = session.execute(
+        update(CacheVersion).filter_by(name=name).values(version=CacheVersion.version + 1, updated_at=now)
+    ).rowcount
+    if not updated:
+        session.add(CacheVersion(name=name, version=1, updated_at=now))
+        session.flush()
+
+
+def current_many(session, names):
+    """Versions for several data sets in one query: {name: (version, updated_at)}."""
+    rows = session.execute(
+        select(CacheVersion.name, CacheVersion.version, CacheVersion.updated_at)
+        .where(CacheVersion.name.in_(names))
+    ).all()
+    found = {row.name: (row.version, row.updated_at) for row in rows}
+    return {name: found.get(name, (0, None)) for name in names}